@@ -4,16 +4,61 @@ A/B Testing Framework for Mental Health Companion
 Tests different recommendation strategies and measures their effectiveness
 """
 
+import bisect
 import json
 import numpy as np
 import random
+import threading
+import time
 from datetime import datetime, timedelta
-from collections import defaultdict
-import sqlite3
+from collections import defaultdict, OrderedDict
+from itertools import accumulate
 import os
-from dataclasses import dataclass
-from typing import Dict, List, Any, Optional
+from dataclasses import dataclass, field
+from typing import Dict, List, Any, Optional, Iterable
 import hashlib
+import logging
+from micro_batcher import MicroBatcher
+from sequential_testing import MixtureSPRT
+from sqlite_storage import get_storage, remove_database
+
+logger = logging.getLogger(__name__)
+
+def _rebuild_aggregates(conn, experiment_id: Optional[str] = None):
+    """Recompute experiment_aggregates from experiment_events (two-pass variance)"""
+    scope = 'WHERE experiment_id = ?' if experiment_id is not None else ''
+    params = (experiment_id,) if experiment_id is not None else ()
+    conn.execute(f'DELETE FROM experiment_aggregates {scope}', params)
+    conn.execute(f'''
+        INSERT INTO experiment_aggregates
+        (experiment_id, variant, event_type, event_count, value_sum, value_sum_sq, mean, m2)
+        SELECT e.experiment_id, e.variant, e.event_type, COUNT(*), SUM(e.event_value),
+               SUM(e.event_value * e.event_value), m.mean,
+               SUM((e.event_value - m.mean) * (e.event_value - m.mean))
+        FROM experiment_events e
+        JOIN (SELECT experiment_id, variant, event_type, AVG(event_value) AS mean
+              FROM experiment_events {scope}
+              GROUP BY experiment_id, variant, event_type) m
+          ON m.experiment_id = e.experiment_id AND m.variant = e.variant AND m.event_type = e.event_type
+        WHERE e.event_value IS NOT NULL
+        GROUP BY e.experiment_id, e.variant, e.event_type
+    ''', params)
+
+# Versioned schema changes for existing databases (see SQLiteStorage.migrate)
+MIGRATIONS = [
+    (1, [
+        # One assignment per user and experiment: keep the latest row of any duplicates
+        '''DELETE FROM experiment_assignments WHERE id NOT IN (
+               SELECT MAX(id) FROM experiment_assignments GROUP BY experiment_id, user_id)''',
+        '''CREATE UNIQUE INDEX IF NOT EXISTS idx_experiment_assignments_experiment_user
+               ON experiment_assignments (experiment_id, user_id)''',
+        # Covers the per-variant aggregation of an experiment's success metric
+        '''CREATE INDEX IF NOT EXISTS idx_experiment_events_experiment_type
+               ON experiment_events (experiment_id, event_type, variant, event_value)''',
+    ]),
+    # Running aggregates for events recorded before experiment_aggregates existed
+    (2, [_rebuild_aggregates]),
+]
 
 @dataclass
 class Experiment:
@@ -40,28 +85,80 @@ class ExperimentResult:
     confidence_interval: tuple
     winner: Optional[str]
     recommendation: str
+    variant_metrics: Dict[str, Dict[str, float]] = field(default_factory=dict)  # every variant with data
+    comparisons: Dict[str, Dict[str, Any]] = field(default_factory=dict)  # challenger -> test vs control
 
 class ABTestingFramework:
-    """A/B testing framework for recommendation strategies"""
+    """A/B testing framework for recommendation strategies
+
+    With ``stateless_assignment`` (the default) a user's variant is a pure
+    function of (experiment_id, user_id, variant weights, salt), so assigning
+    needs no database round trip. Exposures are still logged to
+    ``experiment_assignments``, asynchronously and once per user. With
+    ``stateless_assignment=False`` the stored assignment is looked up first
+    and wins over the hash (sticky even if the weights change).
+
+    Request paths read ``active_experiment_snapshot()``, an in-memory list of
+    active experiment metadata that is rebuilt when an experiment is created
+    here or after ``snapshot_ttl`` seconds (picking up experiments created by
+    other workers). Per-variant statistics are a separate call cached for
+    ``stats_ttl`` seconds.
+
+    With ``sequential_testing`` results use always-valid mSPRT p-values
+    instead of the fixed-horizon test. Every ``sequential_check_every``
+    events an experiment is re-checked in the background from its
+    aggregates, and it is completed as soon as a boundary is crossed.
+    """
     
-    def __init__(self, db_path="ab_testing.db"):
+    def __init__(self, db_path="ab_testing.db", stateless_assignment: bool = True, salt: Optional[str] = None,
+                 assignment_cache_size: int = 100000, snapshot_ttl: float = 30.0, stats_ttl: float = 30.0,
+                 sequential_testing: bool = False, sequential_check_every: int = 100):
         self.db_path = db_path
+        self.storage = get_storage(db_path)
         self.init_database()
         self.active_experiments = {}
         self.experiment_results = {}
         
+        # Active experiment snapshot and dashboard statistics caches
+        self.snapshot_ttl = snapshot_ttl
+        self.stats_ttl = stats_ttl
+        self._snapshot = None
+        self._snapshot_time = 0.0
+        self._snapshot_lock = threading.Lock()
+        self._variant_stats = {}  # experiment_id -> (computed at, stats)
+        self.load_experiments()
+        
+        # Variant assignment
+        self.stateless_assignment = stateless_assignment
+        self.salt = salt if salt is not None else os.getenv('AB_ASSIGNMENT_SALT', '')
+        self.assignment_cache_size = assignment_cache_size
+        self._assignment_cache = OrderedDict()  # (experiment_id, user_id) -> variant, LRU order
+        self._cache_lock = threading.Lock()
+        
+        # Exposure log: batched, deduplicated inserts off the request path
+        self.exposure_writer = MicroBatcher(self._write_exposures, max_batch_size=500, max_wait_ms=50,
+                                            name="ab-exposures")
+        self._last_exposure = None
+        
         # Statistical parameters
         self.minimum_sample_size = 100
         self.confidence_level = 0.95
         self.significance_threshold = 0.05
+        
+        # Sequential (always-valid) testing with automatic stopping
+        self.sequential_testing = sequential_testing
+        self.sequential_test = MixtureSPRT(alpha=self.significance_threshold)
+        self.sequential_check_every = sequential_check_every
+        self._events_since_check = defaultdict(int)
+        self._events_lock = threading.Lock()
+        self._last_sequential_check = None
+        self.sequential_checker = MicroBatcher(self._run_sequential_checks, max_batch_size=64, max_wait_ms=0,
+                                               name="ab-sequential") if sequential_testing else None
     
     def init_database(self):
         """Initialize A/B testing database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Create experiments table
-        cursor.execute('''
+        self.storage.executescript('''
+            -- Experiments table
             CREATE TABLE IF NOT EXISTS experiments (
                 experiment_id TEXT PRIMARY KEY,
                 name TEXT,
@@ -73,11 +170,9 @@ class ABTestingFramework:
                 success_metric TEXT,
                 minimum_sample_size INTEGER,
                 confidence_level REAL
-            )
-        ''')
-        
-        # Create experiment assignments table
-        cursor.execute('''
+            );
+            
+            -- Experiment assignments table
             CREATE TABLE IF NOT EXISTS experiment_assignments (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 experiment_id TEXT,
@@ -85,11 +180,9 @@ class ABTestingFramework:
                 variant TEXT,
                 assigned_date DATETIME,
                 FOREIGN KEY (experiment_id) REFERENCES experiments (experiment_id)
-            )
-        ''')
-        
-        # Create experiment events table
-        cursor.execute('''
+            );
+            
+            -- Experiment events table
             CREATE TABLE IF NOT EXISTS experiment_events (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 experiment_id TEXT,
@@ -100,25 +193,51 @@ class ABTestingFramework:
                 timestamp DATETIME,
                 context TEXT,
                 FOREIGN KEY (experiment_id) REFERENCES experiments (experiment_id)
-            )
-        ''')
-        
-        # Create experiment results table
-        cursor.execute('''
+            );
+            
+            -- Running per-(experiment, variant, event type) statistics, updated with every event
+            CREATE TABLE IF NOT EXISTS experiment_aggregates (
+                experiment_id TEXT,
+                variant TEXT,
+                event_type TEXT,
+                event_count INTEGER,
+                value_sum REAL,
+                value_sum_sq REAL,
+                mean REAL,
+                m2 REAL,
+                PRIMARY KEY (experiment_id, variant, event_type)
+            );
+            
+            -- Always-valid p-value (running minimum) per challenger for sequential testing
+            CREATE TABLE IF NOT EXISTS experiment_sequential_state (
+                experiment_id TEXT,
+                variant TEXT,
+                p_value REAL,
+                checks INTEGER,
+                last_checked DATETIME,
+                PRIMARY KEY (experiment_id, variant)
+            );
+            
+            -- Experiment results table
             CREATE TABLE IF NOT EXISTS experiment_results (
                 experiment_id TEXT PRIMARY KEY,
                 results TEXT,
                 calculated_date DATETIME,
                 FOREIGN KEY (experiment_id) REFERENCES experiments (experiment_id)
-            )
+            );
         ''')
-        
-        conn.commit()
-        conn.close()
+        self.storage.migrate('ab_testing', MIGRATIONS)
     
     def create_experiment(self, name: str, description: str, variants: List[Dict], 
                          success_metric: str, duration_days: int = 14) -> str:
-        """Create a new A/B test experiment"""
+        """Create a new A/B test experiment
+        
+        Variants may carry a ``weight`` (traffic share, default 1.0).
+        """
+        weights = [variant.get('weight', 1.0) for variant in variants]
+        if not variants or any(weight < 0 for weight in weights) or sum(weights) <= 0:
+            raise ValueError("Experiment needs at least one variant with a positive weight and none negative")
+        
         experiment_id = self._generate_experiment_id(name)
         start_date = datetime.now()
         end_date = start_date + timedelta(days=duration_days)
@@ -141,10 +260,66 @@ class ABTestingFramework:
         
         # Add to active experiments
         self.active_experiments[experiment_id] = experiment
+        self._snapshot = None
         
         print(f"🧪 Created experiment: {name} (ID: {experiment_id})")
         return experiment_id
     
+    def load_experiments(self):
+        """(Re)load active experiments from the database"""
+        rows = self.storage.read('''
+            SELECT experiment_id, name, description, variants, start_date, end_date,
+                   status, success_metric, minimum_sample_size, confidence_level
+            FROM experiments
+            WHERE status = 'active'
+        ''')
+        
+        self.active_experiments = {
+            row[0]: Experiment(
+                experiment_id=row[0],
+                name=row[1],
+                description=row[2],
+                variants=json.loads(row[3]),
+                start_date=datetime.fromisoformat(row[4]),
+                end_date=datetime.fromisoformat(row[5]) if row[5] else None,
+                status=row[6],
+                success_metric=row[7],
+                minimum_sample_size=row[8],
+                confidence_level=row[9]
+            )
+            for row in rows
+        }
+        self._snapshot = None
+    
+    def active_experiment_snapshot(self) -> tuple:
+        """Metadata of the active experiments for request paths (no statistics, no query)
+        
+        The returned tuple is shared between callers and must not be modified.
+        """
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._snapshot_time < self.snapshot_ttl:
+            return snapshot
+        
+        with self._snapshot_lock:
+            if self._snapshot is not None and time.monotonic() - self._snapshot_time < self.snapshot_ttl:
+                return self._snapshot
+            if self._snapshot is not None:
+                # TTL expired: pick up experiments created or stopped by other workers
+                self.load_experiments()
+            snapshot = tuple(
+                {
+                    'experiment_id': experiment.experiment_id,
+                    'name': experiment.name,
+                    'status': experiment.status,
+                    'success_metric': experiment.success_metric,
+                    'variants': [variant['name'] for variant in experiment.variants]
+                }
+                for experiment in self.active_experiments.values()
+                if experiment.status == 'active'
+            )
+            self._snapshot, self._snapshot_time = snapshot, time.monotonic()
+            return snapshot
+    
     def _generate_experiment_id(self, name: str) -> str:
         """Generate unique experiment ID"""
         timestamp = datetime.now().isoformat()
@@ -153,10 +328,7 @@ class ABTestingFramework:
     
     def _store_experiment(self, experiment: Experiment):
         """Store experiment in database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        self.storage.write('''
             INSERT OR REPLACE INTO experiments
             (experiment_id, name, description, variants, start_date, end_date, 
              status, success_metric, minimum_sample_size, confidence_level)
@@ -173,120 +345,256 @@ class ABTestingFramework:
             experiment.minimum_sample_size,
             experiment.confidence_level
         ))
-        
-        conn.commit()
-        conn.close()
     
     def assign_user_to_variant(self, experiment_id: str, user_id: str) -> str:
         """Assign user to a variant in an experiment"""
+        return self.assign_users_to_variants(experiment_id, [user_id])[user_id]
+    
+    def assign_users_to_variants(self, experiment_id: str, user_ids: Iterable[str]) -> Dict[str, str]:
+        """Assign a list of users in one call (one query and one write in stored mode)"""
         if experiment_id not in self.active_experiments:
             raise ValueError(f"Experiment {experiment_id} not found or not active")
         
         experiment = self.active_experiments[experiment_id]
+        assignments = {}
+        missing = []
+        for user_id in user_ids:
+            variant = self._cached_assignment(experiment_id, user_id)
+            if variant is None:
+                missing.append(user_id)
+            else:
+                assignments[user_id] = variant
+        if not missing:
+            return assignments
         
-        # Check if user already assigned
-        existing_assignment = self._get_user_assignment(experiment_id, user_id)
-        if existing_assignment:
-            return existing_assignment
-        
-        # Assign user to variant using consistent hashing
-        variant = self._assign_variant_consistently(experiment_id, user_id, experiment.variants)
+        # Stored mode: existing assignments win over the hash
+        stored = {} if self.stateless_assignment else self._get_user_assignments(experiment_id, missing)
+        new_assignments = {
+            user_id: self._assign_variant_consistently(experiment_id, user_id, experiment.variants)
+            for user_id in missing if user_id not in stored
+        }
         
-        # Store assignment
-        self._store_user_assignment(experiment_id, user_id, variant)
+        if self.stateless_assignment:
+            self._log_exposures(experiment_id, new_assignments)
+        elif new_assignments:
+            self._store_user_assignments(experiment_id, new_assignments)
         
-        return variant
+        for user_id, variant in {**stored, **new_assignments}.items():
+            self._cache_assignment(experiment_id, user_id, variant)
+            assignments[user_id] = variant
+        return assignments
     
     def _assign_variant_consistently(self, experiment_id: str, user_id: str, variants: List[Dict]) -> str:
         """Assign user to variant using consistent hashing"""
         # Use consistent hashing to ensure same user gets same variant
-        hash_input = f"{experiment_id}_{user_id}".encode()
-        hash_value = int(hashlib.md5(hash_input).hexdigest(), 16)
+        hash_input = f"{experiment_id}_{user_id}_{self.salt}" if self.salt else f"{experiment_id}_{user_id}"
+        hash_value = int(hashlib.md5(hash_input.encode()).hexdigest(), 16)
         
-        # Distribute users evenly across variants
-        variant_index = hash_value % len(variants)
+        weights = [variant.get('weight', 1.0) for variant in variants]
+        if len(set(weights)) == 1:
+            # Distribute users evenly across variants
+            variant_index = hash_value % len(variants)
+        else:
+            # Weighted split: place the hash in [0, total weight) and find its variant's share
+            cumulative = list(accumulate(weights))
+            point = (hash_value % 2**64) / 2**64 * cumulative[-1]
+            variant_index = min(bisect.bisect_right(cumulative, point), len(variants) - 1)
         return variants[variant_index]['name']
     
+    def _cached_assignment(self, experiment_id: str, user_id: str) -> Optional[str]:
+        key = (experiment_id, user_id)
+        with self._cache_lock:
+            variant = self._assignment_cache.get(key)
+            if variant is not None:
+                self._assignment_cache.move_to_end(key)
+            return variant
+    
+    def _cache_assignment(self, experiment_id: str, user_id: str, variant: str):
+        with self._cache_lock:
+            self._assignment_cache[(experiment_id, user_id)] = variant
+            self._assignment_cache.move_to_end((experiment_id, user_id))
+            while len(self._assignment_cache) > self.assignment_cache_size:
+                self._assignment_cache.popitem(last=False)
+    
+    def _log_exposures(self, experiment_id: str, assignments: Dict[str, str]):
+        """Queue exposure rows for users not yet seen by this process (callers do not wait)"""
+        if not assignments:
+            return
+        timestamp = datetime.now().isoformat()
+        self._last_exposure = self.exposure_writer.submit(
+            [(experiment_id, user_id, variant, timestamp) for user_id, variant in assignments.items()]
+        )
+    
+    def _write_exposures(self, exposures: List[List[tuple]]) -> List[None]:
+        """Exposure writer batch: one INSERT per (experiment, user), existing rows kept"""
+        rows = {(row[0], row[1]): row for batch in exposures for row in batch}
+        self.storage.write_many('''
+            INSERT INTO experiment_assignments
+            (experiment_id, user_id, variant, assigned_date)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (experiment_id, user_id) DO NOTHING
+        ''', rows.values())
+        return [None] * len(exposures)
+    
+    def flush_exposures(self):
+        """Block until every queued exposure has been written"""
+        last_exposure = self._last_exposure
+        if last_exposure is not None:
+            last_exposure.exception()  # waits; a failed batch is already logged
+    
+    def close(self):
+        """Write queued exposures and stop the background writers"""
+        self.exposure_writer.close()
+        if self.sequential_checker is not None:
+            self.sequential_checker.close()
+    
     def _get_user_assignment(self, experiment_id: str, user_id: str) -> Optional[str]:
         """Get user's assigned variant"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        result = self.storage.read_one('''
             SELECT variant FROM experiment_assignments
             WHERE experiment_id = ? AND user_id = ?
-            ORDER BY assigned_date DESC
-            LIMIT 1
         ''', (experiment_id, user_id))
         
-        result = cursor.fetchone()
-        conn.close()
-        
         return result[0] if result else None
     
+    def _get_user_assignments(self, experiment_id: str, user_ids: List[str]) -> Dict[str, str]:
+        """Stored assignments for many users (chunked IN queries)"""
+        assignments = {}
+        for start in range(0, len(user_ids), 500):
+            chunk = user_ids[start:start + 500]
+            rows = self.storage.read(f'''
+                SELECT user_id, variant FROM experiment_assignments
+                WHERE experiment_id = ? AND user_id IN ({', '.join('?' * len(chunk))})
+            ''', (experiment_id, *chunk))
+            assignments.update(rows)
+        return assignments
+    
+    def _store_user_assignments(self, experiment_id: str, assignments: Dict[str, str]):
+        """Store many assignments in one write (existing rows kept)"""
+        timestamp = datetime.now().isoformat()
+        self.storage.write_many('''
+            INSERT INTO experiment_assignments
+            (experiment_id, user_id, variant, assigned_date)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (experiment_id, user_id) DO NOTHING
+        ''', [(experiment_id, user_id, variant, timestamp) for user_id, variant in assignments.items()])
+    
     def _store_user_assignment(self, experiment_id: str, user_id: str, variant: str):
-        """Store user assignment in database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        """Store user assignment in database (the first assignment wins)"""
+        self.storage.write('''
             INSERT INTO experiment_assignments
             (experiment_id, user_id, variant, assigned_date)
             VALUES (?, ?, ?, ?)
+            ON CONFLICT (experiment_id, user_id) DO NOTHING
         ''', (experiment_id, user_id, variant, datetime.now().isoformat()))
-        
-        conn.commit()
-        conn.close()
     
     def record_event(self, experiment_id: str, user_id: str, event_type: str, 
                     event_value: float = 1.0, context: Dict = None):
         """Record an event for an experiment"""
-        if experiment_id not in self.active_experiments:
+        experiment = self.active_experiments.get(experiment_id)
+        if experiment is None or experiment.status != 'active':
             return
         
-        # Get user's variant
-        variant = self._get_user_assignment(experiment_id, user_id)
-        if not variant:
-            return
+        # Get user's variant: the hash in stateless mode (exposure rows are written
+        # asynchronously, possibly by another worker); stored mode counts only exposed users
+        if self.stateless_assignment:
+            variant = self.assign_user_to_variant(experiment_id, user_id)
+        else:
+            variant = self._cached_assignment(experiment_id, user_id)
+            if variant is None:
+                variant = self._get_user_assignment(experiment_id, user_id)
+                if not variant:
+                    return
+                self._cache_assignment(experiment_id, user_id, variant)
         
-        # Store event
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        # Store event and update the aggregates (group-committed; callers do not wait for the commit)
+        event = (
+            experiment_id, user_id, variant, event_type, float(event_value),
+            datetime.now().isoformat(), json.dumps(context) if context else None
+        )
+        self.storage.transaction(lambda conn: self._apply_event(conn, event), wait=False)
+        
+        if self.sequential_testing and event_type == experiment.success_metric:
+            with self._events_lock:
+                self._events_since_check[experiment_id] += 1
+                check = self._events_since_check[experiment_id] >= self.sequential_check_every
+                if check:
+                    self._events_since_check[experiment_id] = 0
+            if check:
+                self._last_sequential_check = self.sequential_checker.submit(experiment_id)
+    
+    def _run_sequential_checks(self, experiment_ids: List[str]) -> List[None]:
+        """Sequential checker batch: re-evaluate each experiment once (stops it on a boundary)"""
+        for experiment_id in set(experiment_ids):
+            experiment = self.active_experiments.get(experiment_id)
+            if experiment is not None and experiment.status == 'active':
+                self.calculate_experiment_results(experiment_id)
+        return [None] * len(experiment_ids)
+    
+    def _sequential_p_value(self, experiment_id: str, variant: str, metrics_control: Dict[str, float],
+                            metrics_variant: Dict[str, float]) -> float:
+        """Update and persist the challenger's always-valid p-value (it never increases)"""
+        row = self.storage.read_one('''
+            SELECT p_value FROM experiment_sequential_state WHERE experiment_id = ? AND variant = ?
+        ''', (experiment_id, variant))
+        decision = self.sequential_test.check(metrics_control, metrics_variant, row[0] if row else 1.0)
         
-        cursor.execute('''
+        # MIN() keeps the lowest p-value when several workers check concurrently
+        self.storage.write('''
+            INSERT INTO experiment_sequential_state (experiment_id, variant, p_value, checks, last_checked)
+            VALUES (?, ?, ?, 1, ?)
+            ON CONFLICT (experiment_id, variant) DO UPDATE SET
+                p_value = MIN(p_value, excluded.p_value),
+                checks = checks + 1,
+                last_checked = excluded.last_checked
+        ''', (experiment_id, variant, decision.p_value, datetime.now().isoformat()))
+        return decision.p_value
+    
+    def _stop_experiment(self, experiment_id: str, result: ExperimentResult):
+        """Complete an experiment whose sequential test crossed a boundary"""
+        experiment = self.active_experiments[experiment_id]
+        experiment.status = 'completed'
+        experiment.end_date = datetime.now()
+        self._store_experiment(experiment)
+        self._snapshot = None
+        logger.info(f"Experiment {experiment.name} ({experiment_id}) stopped early: {result.recommendation}")
+    
+    def _apply_event(self, conn, event: tuple):
+        """Insert one event and fold it into its running aggregate (runs on the storage writer)"""
+        experiment_id, user_id, variant, event_type, value = event[:5]
+        conn.execute('''
             INSERT INTO experiment_events
             (experiment_id, user_id, variant, event_type, event_value, timestamp, context)
             VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            experiment_id, user_id, variant, event_type, event_value,
-            datetime.now().isoformat(), json.dumps(context) if context else None
-        ))
+        ''', event)
         
-        conn.commit()
-        conn.close()
+        # Welford update; the right-hand sides all see the row's previous values
+        conn.execute('''
+            INSERT INTO experiment_aggregates
+            (experiment_id, variant, event_type, event_count, value_sum, value_sum_sq, mean, m2)
+            VALUES (?, ?, ?, 1, ?, ?, ?, 0.0)
+            ON CONFLICT (experiment_id, variant, event_type) DO UPDATE SET
+                event_count = event_count + 1,
+                value_sum = value_sum + excluded.value_sum,
+                value_sum_sq = value_sum_sq + excluded.value_sum_sq,
+                mean = mean + (excluded.mean - mean) / (event_count + 1),
+                m2 = m2 + (excluded.mean - mean) * (excluded.mean - (mean + (excluded.mean - mean) / (event_count + 1)))
+        ''', (experiment_id, variant, event_type, value, value * value, value))
     
     def calculate_experiment_results(self, experiment_id: str) -> ExperimentResult:
-        """Calculate results for an experiment"""
+        """Calculate results for an experiment from its running aggregates
+        
+        The first variant (control) is compared with every other variant;
+        p-values are Bonferroni-adjusted for the number of comparisons and the
+        headline result is the challenger with the smallest adjusted p-value.
+        """
         if experiment_id not in self.active_experiments:
             raise ValueError(f"Experiment {experiment_id} not found")
         
         experiment = self.active_experiments[experiment_id]
+        variant_metrics = self._get_aggregate_metrics(experiment_id, experiment.success_metric)
         
-        # Get experiment data
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT variant, event_type, event_value, timestamp
-            FROM experiment_events
-            WHERE experiment_id = ? AND event_type = ?
-            ORDER BY timestamp
-        ''', (experiment_id, experiment.success_metric))
-        
-        events = cursor.fetchall()
-        conn.close()
-        
-        if not events:
+        if not variant_metrics:
             return ExperimentResult(
                 experiment_id=experiment_id,
                 variant_a_metrics={},
@@ -298,13 +606,10 @@ class ABTestingFramework:
                 recommendation="Insufficient data"
             )
         
-        # Group events by variant
-        variant_events = defaultdict(list)
-        for variant, event_type, event_value, timestamp in events:
-            variant_events[variant].append(event_value)
-        
-        # Calculate metrics for each variant
-        variants = list(variant_events.keys())
+        # Variants in experiment order (then any unknown names found in the events)
+        variant_order = [variant['name'] for variant in experiment.variants]
+        variants = [name for name in variant_order if name in variant_metrics]
+        variants += [name for name in variant_metrics if name not in variant_order]
         if len(variants) < 2:
             return ExperimentResult(
                 experiment_id=experiment_id,
@@ -314,23 +619,36 @@ class ABTestingFramework:
                 p_value=1.0,
                 confidence_interval=(0, 0),
                 winner=None,
-                recommendation="Need at least 2 variants"
+                recommendation="Need at least 2 variants",
+                variant_metrics=variant_metrics
             )
         
-        variant_a = variants[0]
-        variant_b = variants[1]
-        
-        variant_a_values = variant_events[variant_a]
-        variant_b_values = variant_events[variant_b]
-        
-        # Calculate basic metrics
-        variant_a_metrics = self._calculate_metrics(variant_a_values)
-        variant_b_metrics = self._calculate_metrics(variant_b_values)
+        # Compare every challenger with the control
+        control, challengers = variants[0], variants[1:]
+        comparisons = {}
+        for challenger in challengers:
+            _, p_value, confidence_interval = self._perform_statistical_test(
+                variant_metrics[control], variant_metrics[challenger]
+            )
+            if self.sequential_testing:
+                p_value = self._sequential_p_value(
+                    experiment_id, challenger, variant_metrics[control], variant_metrics[challenger]
+                )
+            adjusted_p_value = min(1.0, p_value * len(challengers))
+            comparisons[challenger] = {
+                'p_value': p_value,
+                'adjusted_p_value': adjusted_p_value,
+                'confidence_interval': confidence_interval,
+                'significant': bool(adjusted_p_value < self.significance_threshold)
+            }
         
-        # Perform statistical test
-        significance, p_value, confidence_interval = self._perform_statistical_test(
-            variant_a_values, variant_b_values
-        )
+        variant_a = control
+        variant_b = min(challengers, key=lambda name: np.nan_to_num(comparisons[name]['adjusted_p_value'], nan=1.0))
+        variant_a_metrics = variant_metrics[variant_a]
+        variant_b_metrics = variant_metrics[variant_b]
+        significance = comparisons[variant_b]['significant']
+        p_value = comparisons[variant_b]['adjusted_p_value']
+        confidence_interval = comparisons[variant_b]['confidence_interval']
         
         # Determine winner
         winner = None
@@ -353,40 +671,65 @@ class ABTestingFramework:
             p_value=p_value,
             confidence_interval=confidence_interval,
             winner=winner,
-            recommendation=recommendation
+            recommendation=recommendation,
+            variant_metrics=variant_metrics,
+            comparisons=comparisons
         )
         
+        # Sequential mode: a crossed boundary ends the experiment
+        if self.sequential_testing and significance and experiment.status == 'active':
+            result.recommendation += " Stopped early by the sequential test."
+            self._stop_experiment(experiment_id, result)
+        
         # Store results
         self._store_experiment_results(experiment_id, result)
         self.experiment_results[experiment_id] = result
         
         return result
     
-    def _calculate_metrics(self, values: List[float]) -> Dict[str, float]:
-        """Calculate metrics for a variant"""
-        if not values:
-            return {'mean': 0, 'std': 0, 'count': 0, 'conversion_rate': 0}
+    def _get_aggregate_metrics(self, experiment_id: str, event_type: str) -> Dict[str, Dict[str, float]]:
+        """Per-variant metrics from experiment_aggregates (one primary-key range read)"""
+        rows = self.storage.read('''
+            SELECT variant, event_count, mean, m2
+            FROM experiment_aggregates
+            WHERE experiment_id = ? AND event_type = ?
+        ''', (experiment_id, event_type))
         
         return {
-            'mean': np.mean(values),
-            'std': np.std(values),
-            'count': len(values),
-            'conversion_rate': np.mean(values) if all(v in [0, 1] for v in values) else np.mean(values)
+            variant: {
+                'mean': mean,
+                'std': float(np.sqrt(m2 / count)),
+                'sample_std': float(np.sqrt(m2 / (count - 1))) if count > 1 else 0.0,
+                'count': count,
+                'conversion_rate': mean
+            }
+            for variant, count, mean, m2 in rows if count
         }
     
-    def _perform_statistical_test(self, values_a: List[float], values_b: List[float]) -> tuple:
-        """Perform statistical significance test"""
+    def rebuild_aggregates(self, experiment_id: Optional[str] = None) -> int:
+        """Recompute experiment_aggregates from the raw events (all experiments by default)"""
+        self.storage.transaction(lambda conn: _rebuild_aggregates(conn, experiment_id))
+        self._variant_stats.clear()
+        if experiment_id is None:
+            return self.storage.read_one('SELECT COUNT(*) FROM experiment_aggregates')[0]
+        return self.storage.read_one('SELECT COUNT(*) FROM experiment_aggregates WHERE experiment_id = ?',
+                                     (experiment_id,))[0]
+    
+    def _perform_statistical_test(self, metrics_a: Dict[str, float], metrics_b: Dict[str, float]) -> tuple:
+        """Perform statistical significance test from per-variant summary statistics"""
         from scipy import stats
         
-        if len(values_a) < 30 or len(values_b) < 30:
-            # Use t-test for small samples
-            t_stat, p_value = stats.ttest_ind(values_a, values_b)
+        n_a, n_b = metrics_a['count'], metrics_b['count']
+        mean_a, mean_b = np.float64(metrics_a['mean']), np.float64(metrics_b['mean'])
+        std_a, std_b = np.float64(metrics_a['std']), np.float64(metrics_b['std'])
+        
+        if n_a < 30 or n_b < 30:
+            # Use t-test for small samples (pooled variance, as scipy's ttest_ind)
+            t_stat, p_value = stats.ttest_ind_from_stats(
+                mean_a, metrics_a['sample_std'], n_a, mean_b, metrics_b['sample_std'], n_b
+            )
         else:
             # Use z-test for large samples
-            mean_a, mean_b = np.mean(values_a), np.mean(values_b)
-            std_a, std_b = np.std(values_a), np.std(values_b)
-            n_a, n_b = len(values_a), len(values_b)
-            
             se = np.sqrt((std_a**2 / n_a) + (std_b**2 / n_b))
             z_stat = (mean_a - mean_b) / se
             p_value = 2 * (1 - stats.norm.cdf(abs(z_stat)))
@@ -394,12 +737,12 @@ class ABTestingFramework:
         significance = p_value < self.significance_threshold
         
         # Calculate confidence interval
-        mean_diff = np.mean(values_a) - np.mean(values_b)
-        se_diff = np.sqrt((np.var(values_a) / len(values_a)) + (np.var(values_b) / len(values_b)))
+        mean_diff = mean_a - mean_b
+        se_diff = np.sqrt((std_a**2 / n_a) + (std_b**2 / n_b))
         margin_error = 1.96 * se_diff  # 95% confidence interval
         confidence_interval = (mean_diff - margin_error, mean_diff + margin_error)
         
-        return significance, p_value, confidence_interval
+        return significance, float(p_value), confidence_interval
     
     def _generate_recommendation(self, significance: bool, p_value: float, 
                                metrics_a: Dict, metrics_b: Dict, winner: str) -> str:
@@ -415,9 +758,6 @@ class ABTestingFramework:
     
     def _store_experiment_results(self, experiment_id: str, result: ExperimentResult):
         """Store experiment results in database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
         results_data = {
             'variant_a_metrics': result.variant_a_metrics,
             'variant_b_metrics': result.variant_b_metrics,
@@ -425,17 +765,24 @@ class ABTestingFramework:
             'p_value': float(result.p_value),
             'confidence_interval': [float(x) for x in result.confidence_interval],
             'winner': result.winner,
-            'recommendation': result.recommendation
+            'recommendation': result.recommendation,
+            'variant_metrics': result.variant_metrics,
+            'comparisons': {
+                variant: {
+                    'p_value': float(comparison['p_value']),
+                    'adjusted_p_value': float(comparison['adjusted_p_value']),
+                    'confidence_interval': [float(x) for x in comparison['confidence_interval']],
+                    'significant': comparison['significant']
+                }
+                for variant, comparison in result.comparisons.items()
+            }
         }
         
-        cursor.execute('''
+        self.storage.write('''
             INSERT OR REPLACE INTO experiment_results
             (experiment_id, results, calculated_date)
             VALUES (?, ?, ?)
         ''', (experiment_id, json.dumps(results_data), datetime.now().isoformat()))
-        
-        conn.commit()
-        conn.close()
     
     def get_experiment_status(self, experiment_id: str) -> Dict:
         """Get current status of an experiment"""
@@ -444,32 +791,32 @@ class ABTestingFramework:
         
         experiment = self.active_experiments[experiment_id]
         
-        # Get current metrics
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT variant, COUNT(*) as event_count, AVG(event_value) as avg_value
-            FROM experiment_events
-            WHERE experiment_id = ? AND event_type = ?
-            GROUP BY variant
-        ''', (experiment_id, experiment.success_metric))
-        
-        variant_stats = cursor.fetchall()
-        conn.close()
-        
         return {
             'experiment_id': experiment_id,
             'name': experiment.name,
             'status': experiment.status,
             'start_date': experiment.start_date.isoformat(),
             'end_date': experiment.end_date.isoformat() if experiment.end_date else None,
-            'variant_stats': {row[0]: {'count': row[1], 'avg_value': row[2]} for row in variant_stats},
+            'variant_stats': self.get_variant_stats(experiment_id),
             'has_results': experiment_id in self.experiment_results
         }
     
+    def get_variant_stats(self, experiment_id: str, max_age: Optional[float] = None) -> Dict[str, Dict]:
+        """Event count and mean success metric per variant (cached for ``stats_ttl`` seconds)"""
+        max_age = self.stats_ttl if max_age is None else max_age
+        cached = self._variant_stats.get(experiment_id)
+        if cached is not None and time.monotonic() - cached[0] < max_age:
+            return cached[1]
+        
+        experiment = self.active_experiments[experiment_id]
+        metrics = self._get_aggregate_metrics(experiment_id, experiment.success_metric)
+        
+        stats = {variant: {'count': m['count'], 'avg_value': m['mean']} for variant, m in metrics.items()}
+        self._variant_stats[experiment_id] = (time.monotonic(), stats)
+        return stats
+    
     def list_active_experiments(self) -> List[Dict]:
-        """List all active experiments"""
+        """List all active experiments with their statistics (dashboard)"""
         return [
             self.get_experiment_status(exp_id) 
             for exp_id in self.active_experiments.keys()
@@ -539,13 +886,189 @@ def test_ab_testing_framework():
     for variant, stats in status['variant_stats'].items():
         print(f"   {variant}: {stats['count']} events, avg value: {stats['avg_value']:.3f}")
     
+    # Request paths read a cached snapshot; statistics are cached separately
+    snapshot = ab_framework.active_experiment_snapshot()
+    assert ab_framework.active_experiment_snapshot() is snapshot
+    assert [experiment['experiment_id'] for experiment in snapshot] == [experiment_id]
+    assert ab_framework.get_variant_stats(experiment_id) is status['variant_stats']
+    
+    # Experiments survive a restart
+    restarted = ABTestingFramework("test_ab.db")
+    assert [experiment['experiment_id'] for experiment in restarted.active_experiment_snapshot()] == [experiment_id]
+    assert restarted.get_experiment_status(experiment_id)['variant_stats'] == status['variant_stats']
+    restarted.close()
+    
+    # Running aggregates match the raw events and survive a rebuild
+    ab_framework.storage.flush()
+    raw = defaultdict(list)
+    for variant, value in ab_framework.storage.read(
+            'SELECT variant, event_value FROM experiment_events WHERE experiment_id = ?', (experiment_id,)):
+        raw[variant].append(value)
+    aggregates = ab_framework._get_aggregate_metrics(experiment_id, 'recommendation_helpful')
+    for variant, values in raw.items():
+        assert aggregates[variant]['count'] == len(values)
+        assert abs(aggregates[variant]['mean'] - np.mean(values)) < 1e-9
+        assert abs(aggregates[variant]['std'] - np.std(values)) < 1e-9
+    ab_framework.rebuild_aggregates(experiment_id)
+    rebuilt = ab_framework._get_aggregate_metrics(experiment_id, 'recommendation_helpful')
+    assert all(abs(rebuilt[v]['std'] - aggregates[v]['std']) < 1e-9 for v in raw)
+    
+    # Hot queries are index lookups, not table scans
+    storage = ab_framework.storage
+    assert storage.schema_version('ab_testing') == len(MIGRATIONS)
+    assert storage.uses_index('''
+        SELECT variant FROM experiment_assignments WHERE experiment_id = ? AND user_id = ?
+    ''', (experiment_id, 'user_001'))
+    assert storage.uses_index('''
+        SELECT variant, COUNT(*), AVG(event_value) FROM experiment_events
+        WHERE experiment_id = ? AND event_type = ? GROUP BY variant
+    ''', (experiment_id, 'recommendation_helpful'))
+    assert storage.uses_index('''
+        SELECT variant, event_count, mean, m2 FROM experiment_aggregates
+        WHERE experiment_id = ? AND event_type = ?
+    ''', (experiment_id, 'recommendation_helpful'))
+    ab_framework._store_user_assignment(experiment_id, 'user_001', 'other')
+    assert storage.read_one('''
+        SELECT COUNT(*) FROM experiment_assignments WHERE experiment_id = ? AND user_id = ?
+    ''', (experiment_id, 'user_001'))[0] == 1
+    print(f"   Query plans use indexes ({len(MIGRATIONS)} migration(s) applied)")
+    
+    # Stateless assignment: exposures are logged once, asynchronously
+    ab_framework.flush_exposures()
+    assert storage.read_one('SELECT COUNT(*) FROM experiment_assignments WHERE experiment_id = ?',
+                            (experiment_id,))[0] == len(test_users)
+    
+    # Bulk assignment matches single assignment, and the stored mode agrees with the hash
+    users = [f"bulk_user_{i}" for i in range(2000)]
+    bulk = ab_framework.assign_users_to_variants(experiment_id, users)
+    assert all(bulk[user_id] == ab_framework.assign_user_to_variant(experiment_id, user_id) for user_id in users[:50])
+    stored_framework = ABTestingFramework("test_ab.db", stateless_assignment=False)
+    stored_framework.active_experiments = ab_framework.active_experiments
+    assert stored_framework.assign_users_to_variants(experiment_id, users) == bulk
+    ab_framework.flush_exposures()
+    assert storage.read_one('SELECT COUNT(*) FROM experiment_assignments WHERE experiment_id = ?',
+                            (experiment_id,))[0] == len(test_users) + len(users)
+    
+    # Weighted traffic split (90/10) and a salt that reshuffles users
+    weighted_id = ab_framework.create_experiment(
+        name="Weighted Rollout Test",
+        description="Gradual rollout",
+        variants=[{'name': 'control', 'weight': 0.9}, {'name': 'enhanced', 'weight': 0.1}],
+        success_metric="recommendation_helpful"
+    )
+    shares = list(ab_framework.assign_users_to_variants(weighted_id, users).values()).count('enhanced') / len(users)
+    assert 0.07 < shares < 0.13, shares
+    salted = ABTestingFramework("test_ab.db", salt="2024-q3")
+    salted.active_experiments = ab_framework.active_experiments
+    assert salted.assign_users_to_variants(experiment_id, users) != bulk
+    print(f"   Weighted split: {shares:.1%} enhanced (target 10%)")
+    
+    for framework in (stored_framework, salted):
+        framework.close()
+    
+    # More than two variants: every challenger is compared with the control
+    multi_id = ab_framework.create_experiment(
+        name="Three Way Test",
+        description="Control vs two challengers",
+        variants=[{'name': 'control'}, {'name': 'gentle'}, {'name': 'structured'}],
+        success_metric="recommendation_helpful"
+    )
+    success_rates = {'control': 0.4, 'gentle': 0.42, 'structured': 0.7}
+    for user_id, variant in ab_framework.assign_users_to_variants(multi_id, users[:600]).items():
+        ab_framework.record_event(multi_id, user_id, 'recommendation_helpful',
+                                  1.0 if random.random() < success_rates[variant] else 0.0)
+    multi = ab_framework.calculate_experiment_results(multi_id)
+    assert set(multi.comparisons) == {'gentle', 'structured'} and len(multi.variant_metrics) == 3
+    assert multi.winner == 'structured', multi.recommendation
+    print(f"   Three variants: {multi.recommendation}")
+    
+    # Stateless mode: a worker that never assigned the user counts its events under the hashed variant
+    other_worker = ABTestingFramework("test_ab.db")
+    other_worker.active_experiments = ab_framework.active_experiments
+    other_worker.record_event(multi_id, 'user_seen_elsewhere', 'recommendation_helpful', 1.0)
+    other_worker.close()
+    other_worker.storage.flush()
+    assert storage.read_one('SELECT variant FROM experiment_events WHERE experiment_id = ? AND user_id = ?',
+                            (multi_id, 'user_seen_elsewhere'))[0] == \
+        ab_framework.assign_user_to_variant(multi_id, 'user_seen_elsewhere')
+    
+    # Sequential mode checks in the background and stops the experiment at a boundary
+    sequential = ABTestingFramework("test_ab.db", sequential_testing=True, sequential_check_every=50)
+    sequential_id = sequential.create_experiment(
+        name="Sequential Test",
+        description="Stops as soon as the evidence is conclusive",
+        variants=[{'name': 'control'}, {'name': 'enhanced'}],
+        success_metric="recommendation_helpful"
+    )
+    assignments = sequential.assign_users_to_variants(sequential_id, users)
+    recorded = 0
+    for user_id, variant in assignments.items():
+        if sequential.active_experiments[sequential_id].status != 'active':
+            break
+        sequential.record_event(sequential_id, user_id, 'recommendation_helpful',
+                                1.0 if random.random() < (0.75 if variant == 'enhanced' else 0.4) else 0.0)
+        recorded += 1
+        if recorded % 50 == 0:
+            sequential._last_sequential_check.exception()  # let the background check finish
+    assert sequential.active_experiments[sequential_id].status == 'completed'
+    assert sequential_id not in [e['experiment_id'] for e in sequential.active_experiment_snapshot()]
+    stopped = sequential.experiment_results[sequential_id]
+    assert stopped.winner == 'enhanced', stopped.recommendation
+    print(f"   Sequential: stopped after {recorded} of {len(users)} events, p={stopped.p_value:.4f}")
+    
+    # Concurrent events lose no counts toward the next check
+    from concurrent.futures import ThreadPoolExecutor
+    sequential.sequential_check_every = 10**9
+    counted_id = sequential.create_experiment(
+        name="Concurrent Events Test",
+        description="Event counter under concurrency",
+        variants=[{'name': 'control'}, {'name': 'enhanced'}],
+        success_metric="recommendation_helpful"
+    )
+    with ThreadPoolExecutor(16) as pool:
+        list(pool.map(lambda i: sequential.record_event(counted_id, users[i % 200], 'recommendation_helpful', i % 2),
+                      range(1600)))
+    assert sequential._events_since_check[counted_id] == 1600
+    sequential.close()
+    
     # Clean up test database
-    if os.path.exists("test_ab.db"):
-        os.remove("test_ab.db")
+    ab_framework.close()
+    remove_database("test_ab.db")
     
     print(f"\n🎉 A/B testing framework test completed!")
     
     return ab_framework
 
+def benchmark_variant_assignment(num_users=2000):
+    """First-time assignments/s: stored lookup + insert per user vs stateless hashing"""
+    print("⏱️ Benchmarking Variant Assignment")
+    print("=" * 40)
+    
+    variants = [{'name': 'control'}, {'name': 'enhanced'}]
+    for name, stateless in [('stored (lookup + insert)', False), ('stateless + exposure log', True)]:
+        framework = ABTestingFramework("bench_ab.db", stateless_assignment=stateless)
+        experiment_id = framework.create_experiment("Benchmark", "", variants, "recommendation_helpful")
+        
+        start = time.perf_counter()
+        for i in range(num_users):
+            framework.assign_user_to_variant(experiment_id, f"user_{i}")
+        elapsed = time.perf_counter() - start
+        print(f"   {name:<26} {num_users / elapsed:9.0f} assignments/s")
+        
+        start = time.perf_counter()
+        framework.assign_users_to_variants(experiment_id, [f"new_user_{i}" for i in range(num_users)])
+        print(f"   {'  bulk, ' + str(num_users) + ' users':<26} {(time.perf_counter() - start) * 1000:9.1f} ms")
+        framework.close()
+        remove_database("bench_ab.db")
+
 if __name__ == "__main__":
-    ab_framework = test_ab_testing_framework()
+    import sys
+    if sys.argv[1:2] == ['rebuild-aggregates']:
+        # python ab_testing_framework.py rebuild-aggregates [db_path] [experiment_id]
+        framework = ABTestingFramework(sys.argv[2] if len(sys.argv) > 2 else "ab_testing.db")
+        rows = framework.rebuild_aggregates(sys.argv[3] if len(sys.argv) > 3 else None)
+        print(f"✅ Rebuilt {rows} aggregate rows in {framework.db_path}")
+        framework.close()
+    else:
+        ab_framework = test_ab_testing_framework()
+        benchmark_variant_assignment()
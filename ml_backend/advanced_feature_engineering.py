@@ -10,30 +10,76 @@ from datetime import datetime, timedelta
 from sklearn.preprocessing import StandardScaler, LabelEncoder
 from sklearn.feature_extraction.text import TfidfVectorizer
 import re
-import nltk
-from nltk.sentiment import SentimentIntensityAnalyzer
-from textblob import TextBlob
+from lexicon_matcher import LexiconMatcher
+from sentiment_service import get_sentiment_service
+from mood_history import MoodHistoryTracker, DEFAULT_HISTORY_FEATURES, entry_timestamp
+from feature_schema import (
+    FEATURE_SCHEMA, ALL_EMOTIONS, EMOTION_CATEGORIES, BASE_COLUMNS, TEMPORAL_COLUMNS,
+    CYCLICAL_COLUMNS, EMOTION_COLUMNS, TEXT_COLUMNS, CONTEXT_COLUMNS, PROFILE_COLUMNS,
+    HISTORY_COLUMNS, JOURNAL_COLUMNS
+)
+
+EMOTION_INTENSITY = {'Happy': 2, 'Excited': 2, 'Angry': 2, 'Sad': 1.5, 'Anxious': 1.5, 'Overwhelmed': 1.5}
+CATEGORICAL_VALUES = {
+    'age_group': ['18-25', '26-35', '36-45', '46-55', '56-65', '65+'],
+    'occupation': ['student', 'professional', 'retired', 'unemployed', 'freelancer'],
+    'living_situation': ['alone', 'with_family', 'with_roommates', 'with_partner']
+}
+
+# Lexicons scored by the LexiconMatcher (whole-token matches)
+EMOTIONAL_WORDS = [
+    'happy', 'sad', 'angry', 'excited', 'anxious', 'calm', 'frustrated',
+    'grateful', 'lonely', 'confident', 'overwhelmed', 'peaceful', 'worried',
+    'joy', 'fear', 'love', 'hate', 'hope', 'despair', 'content', 'miserable'
+]
+NEGATIVE_WORDS = [
+    'bad', 'terrible', 'awful', 'horrible', 'worst', 'hate', 'dislike',
+    'angry', 'frustrated', 'sad', 'depressed', 'anxious', 'worried',
+    'stressed', 'overwhelmed', 'lonely', 'hopeless', 'miserable'
+]
+POSITIVE_WORDS = [
+    'good', 'great', 'wonderful', 'amazing', 'fantastic', 'love', 'like',
+    'happy', 'excited', 'grateful', 'confident', 'peaceful', 'calm',
+    'joyful', 'content', 'blessed', 'lucky', 'hopeful', 'optimistic'
+]
+FIRST_PERSON_PRONOUNS = ['i', 'me', 'my', 'mine', 'myself']
+
+class JournalIndex:
+    """Journal aggregates keyed by calendar day and by (user_id, day)"""
+    
+    def __init__(self, by_day, by_user_day):
+        self.by_day = by_day
+        self.by_user_day = by_user_day
 
 class AdvancedFeatureEngineer:
     """Advanced feature engineering for mental health data"""
     
     def __init__(self):
-        self.sentiment_analyzer = SentimentIntensityAnalyzer()
+        self.sentiment_service = get_sentiment_service()
         self.scaler = StandardScaler()
         self.label_encoders = {}
-        
-        # Download required NLTK data
-        try:
-            nltk.data.find('vader_lexicon')
-        except LookupError:
-            nltk.download('vader_lexicon')
+        self.lexicon_matcher = LexiconMatcher(
+            {
+                'emotional_words_count': EMOTIONAL_WORDS,
+                'negative_words': NEGATIVE_WORDS,
+                'positive_words': POSITIVE_WORDS
+            },
+            {'pronoun_count': FIRST_PERSON_PRONOUNS}
+        )
     
-    def extract_comprehensive_features(self, mood_entries, journal_entries=None):
+    def extract_comprehensive_features(self, mood_entries, journal_entries=None, history_tracker=None):
         """Extract comprehensive features from mood and journal entries"""
         features = []
         
-        for entry in mood_entries:
-            feature_vector = self._extract_mood_features(entry)
+        # Parse journal dates once and bucket them by day (and user)
+        if journal_entries:
+            journal_entries = self._build_journal_index(journal_entries)
+        
+        # Mood history features from each user's earlier entries
+        history = self.compute_history_features(mood_entries, history_tracker)
+        
+        for entry, entry_history in zip(mood_entries, history):
+            feature_vector = self._extract_mood_features(entry, entry_history)
             
             # Add journal context if available
             if journal_entries:
@@ -43,9 +89,295 @@ class AdvancedFeatureEngineer:
             features.append(feature_vector)
         
         return pd.DataFrame(features)
-    
-    def _extract_mood_features(self, entry):
-        """Extract comprehensive features from a single mood entry"""
+
+    def extract_features_batch(self, mood_entries, journal_entries=None, history_tracker=None,
+                               schema=None):
+        """Extract features for a whole batch into a preallocated float32 matrix
+
+        ``mood_entries`` is either a list of entry dicts or a dict of
+        equal-length columns ('mood', 'emotions', 'date', 'note', 'context',
+        'profile', 'user_id', 'timestamp').  Returns ``(matrix, feature_names)``; the matrix is
+        bit-for-bit equal to ``extract_comprehensive_features(...)`` converted
+        with ``to_numpy(np.float32)``, including NaN wherever the per-row path
+        would not emit a feature for an entry.
+
+        With a FeatureSchema the columns are the schema's (the target is left
+        out) and missing features are 0, matching ``extract_feature_row``.
+        """
+        columns = self._entries_to_columns(mood_entries)
+        n = columns['size']
+        dates = columns['date']
+        emotions = columns['emotions']
+        notes = columns['note']
+
+        has_date = np.fromiter((bool(d) for d in dates), dtype=bool, count=n)
+        has_context = columns['has_context']
+        has_profile = columns['has_profile']
+        journal_context = None
+        has_journal = np.zeros(n, dtype=bool)
+        if journal_entries:
+            journal_index = self._build_journal_index(journal_entries)
+            journal_context = [
+                self._get_journal_context({'date': d, 'user_id': user_id}, journal_index)
+                for d, user_id in zip(dates, columns['user_id'])
+            ]
+            has_journal = np.fromiter((bool(j) for j in journal_context), dtype=bool, count=n)
+
+        if schema is not None:
+            feature_names = list(schema.feature_names)
+            index = schema.index
+            matrix = schema.new_matrix(n)
+        else:
+            feature_names = self._batch_column_order(has_date, has_context, has_profile, has_journal)
+            index = {name: i for i, name in enumerate(feature_names)}
+            matrix = np.full((n, len(feature_names)), np.nan, dtype=np.float32)
+        if n == 0:
+            return matrix, feature_names
+
+        def fill(name, values, rows=None):
+            column = index.get(name)
+            if column is None:
+                return
+            if rows is None:
+                matrix[:, column] = values
+            else:
+                matrix[rows, column] = values
+
+        # Basic mood features
+        fill('mood', np.asarray(columns['mood'], dtype=np.float64))
+        emotion_count = np.fromiter((len(e) for e in emotions), dtype=np.int64, count=n)
+        fill('emotion_count', emotion_count)
+        fill('has_note', np.fromiter((1 if note else 0 for note in notes), dtype=np.int64, count=n))
+
+        # Temporal features (rows without a date fall back to the defaults)
+        hour = np.array([d.get('hour', 12) if d else 12 for d in dates], dtype=np.float64)
+        day_of_week = np.array([d.get('day_of_week', 1) if d else 1 for d in dates], dtype=np.float64)
+        month = np.array([d.get('month', 6) if d else 6 for d in dates], dtype=np.float64)
+        fill('hour', hour)
+        fill('day_of_week', day_of_week)
+        fill('is_weekend', np.where(has_date & (day_of_week >= 5), 1, 0))
+        fill('is_morning', np.where(has_date & (hour >= 6) & (hour < 12), 1, 0))
+        fill('is_afternoon', np.where(has_date & (hour >= 12) & (hour < 18), 1, 0))
+        fill('is_evening', np.where(has_date & (hour >= 18) & (hour < 22), 1, 0))
+        fill('is_night', np.where(has_date & ((hour >= 22) | (hour < 6)), 1, 0))
+        fill('month', month)
+        season = np.select(
+            [np.isin(month, [12, 1, 2]), np.isin(month, [3, 4, 5]), np.isin(month, [6, 7, 8])],
+            [0, 1, 2], default=3
+        )
+        fill('season', np.where(has_date, season, 2))
+        if has_date.any():
+            rows = np.flatnonzero(has_date)
+            fill('hour_sin', np.sin(2 * np.pi * hour[rows] / 24), rows)
+            fill('hour_cos', np.cos(2 * np.pi * hour[rows] / 24), rows)
+            fill('day_sin', np.sin(2 * np.pi * day_of_week[rows] / 7), rows)
+            fill('day_cos', np.cos(2 * np.pi * day_of_week[rows] / 7), rows)
+            fill('month_sin', np.sin(2 * np.pi * month[rows] / 12), rows)
+            fill('month_cos', np.cos(2 * np.pi * month[rows] / 12), rows)
+
+        # Emotion features: count matrix over the known vocabulary (+1 unknown slot)
+        vocabulary = {emotion: i for i, emotion in enumerate(ALL_EMOTIONS)}
+        unknown = len(ALL_EMOTIONS)
+        counts = np.zeros((n, unknown + 1), dtype=np.int64)
+        if n:
+            row_ids = np.repeat(np.arange(n), emotion_count)
+            emotion_ids = np.fromiter(
+                (vocabulary.get(emotion, unknown) for row in emotions for emotion in row),
+                dtype=np.int64, count=int(emotion_count.sum())
+            )
+            np.add.at(counts, (row_ids, emotion_ids), 1)
+        for emotion, i in vocabulary.items():
+            fill(f'emotion_{emotion.lower()}', (counts[:, i] > 0).astype(np.int64))
+        for category, emotion_list in EMOTION_CATEGORIES.items():
+            membership = np.zeros(unknown + 1, dtype=np.int64)
+            membership[[vocabulary[emotion] for emotion in emotion_list]] = 1
+            fill(f'{category}_emotion_count', counts @ membership)
+
+        # Entropy depends on set iteration order, so it is memoised per emotion tuple
+        diversity_cache = {}
+        diversity = np.empty(n, dtype=np.float64)
+        for i, row in enumerate(emotions):
+            key = tuple(row)
+            if key not in diversity_cache:
+                diversity_cache[key] = self._emotion_diversity(row)
+            diversity[i] = diversity_cache[key]
+        fill('emotion_diversity', diversity)
+
+        weights = np.ones(unknown + 1, dtype=np.float64)
+        for emotion, weight in EMOTION_INTENSITY.items():
+            weights[vocabulary[emotion]] = weight
+        intensity = counts @ weights
+        fill('emotion_intensity', np.divide(intensity, emotion_count,
+                                            out=np.zeros(n, dtype=np.float64),
+                                            where=emotion_count > 0))
+
+        # Text features are computed per note and written column by column
+        text_values = np.tile(
+            np.array([self._get_default_text_features()[c] for c in TEXT_COLUMNS], dtype=np.float64),
+            (n, 1)
+        )
+        note_rows = [i for i, note in enumerate(notes) if note]
+        lexicon_scores = self.lexicon_matcher.score_many([notes[i] for i in note_rows])
+        for i, scores in zip(note_rows, lexicon_scores):
+            text_features = self._extract_text_features(
+                notes[i], dict(zip(self.lexicon_matcher.names, scores.tolist()))
+            )
+            text_values[i] = [text_features[c] for c in TEXT_COLUMNS]
+        for k, name in enumerate(TEXT_COLUMNS):
+            fill(name, text_values[:, k])
+
+        # Contextual features
+        if has_context.any():
+            rows = np.flatnonzero(has_context)
+            contexts = [columns['context'][i] or {} for i in rows]
+            fill('sleep_quality', np.array([c.get('sleep_quality', 0.5) for c in contexts], dtype=np.float64), rows)
+            fill('work_stress', np.array([c.get('work_stress', 0.5) for c in contexts], dtype=np.float64), rows)
+            for name in ['exercise_today', 'social_interaction', 'medication_taken',
+                         'therapy_session', 'crisis_thoughts']:
+                fill(name, np.array([1 if c.get(name, False) else 0 for c in contexts], dtype=np.int64), rows)
+
+        # Profile features
+        if has_profile.any():
+            rows = np.flatnonzero(has_profile)
+            profiles = [columns['profile'][i] for i in rows]
+            present = np.array([bool(p) for p in profiles])
+            profiles = [p or {} for p in profiles]
+            fill('has_condition', np.array([1 if p.get('has_condition', False) else 0 for p in profiles],
+                                           dtype=np.int64), rows)
+            fill('life_stress_level', np.array([p.get('life_stress_level', 0.5) for p in profiles],
+                                               dtype=np.float64), rows)
+            fill('social_support', np.array([p.get('social_support', 0.5) for p in profiles],
+                                            dtype=np.float64), rows)
+            for category, default in [('age_group', '26-35'), ('occupation', 'professional'),
+                                      ('living_situation', 'alone')]:
+                lookup = self._categorical_lookup(category)
+                encoded = np.array([lookup.get(p.get(category, default), 0) for p in profiles], dtype=np.int64)
+                fill(f'{category}_encoded', np.where(present, encoded, 0), rows)
+
+        # Mood history features, replayed per user in time order
+        history = self._history_features(columns['user_id'], columns['mood'],
+                                         columns['timestamp'], history_tracker)
+        for name in HISTORY_COLUMNS:
+            fill(name, np.array([h[name] for h in history], dtype=np.float64))
+
+        # Journal context
+        if has_journal.any():
+            rows = np.flatnonzero(has_journal)
+            for name in JOURNAL_COLUMNS:
+                fill(name, np.array([journal_context[i][name] for i in rows], dtype=np.float64), rows)
+
+        return matrix, feature_names
+
+    def _entries_to_columns(self, mood_entries):
+        """Normalise a list of entries or a dict of columns into columns"""
+        if isinstance(mood_entries, dict):
+            size = len(mood_entries.get('mood', mood_entries.get('emotions', [])))
+
+            def column(name, default):
+                values = mood_entries.get(name)
+                return list(values) if values is not None else [default] * size
+
+            return {
+                'size': size,
+                'mood': column('mood', 5),
+                'emotions': column('emotions', []),
+                'date': column('date', {}),
+                'note': column('note', None),
+                'context': column('context', None),
+                'profile': column('profile', None),
+                'user_id': column('user_id', None),
+                'timestamp': [entry_timestamp({'date': d, 'timestamp': t})
+                              for d, t in zip(column('date', {}), column('timestamp', None))],
+                'has_context': np.full(size, 'context' in mood_entries, dtype=bool),
+                'has_profile': np.full(size, 'profile' in mood_entries, dtype=bool)
+            }
+
+        size = len(mood_entries)
+        return {
+            'size': size,
+            'mood': [entry.get('mood', 5) for entry in mood_entries],
+            'emotions': [entry.get('emotions', []) for entry in mood_entries],
+            'date': [entry.get('date', {}) for entry in mood_entries],
+            'note': [entry.get('note') for entry in mood_entries],
+            'context': [entry.get('context') for entry in mood_entries],
+            'profile': [entry.get('profile') for entry in mood_entries],
+            'user_id': [entry.get('user_id') for entry in mood_entries],
+            'timestamp': [entry_timestamp(entry) for entry in mood_entries],
+            'has_context': np.fromiter(('context' in entry for entry in mood_entries), dtype=bool, count=size),
+            'has_profile': np.fromiter(('profile' in entry for entry in mood_entries), dtype=bool, count=size)
+        }
+
+    def compute_history_features(self, mood_entries, history_tracker=None):
+        """Mood history features for each entry, computed from the entries before it
+
+        Entries are replayed per user in chronological order through a
+        MoodHistoryTracker, so each entry costs O(1) regardless of how long the
+        user's history is.  Pass ``history_tracker`` to continue from (and
+        update) existing per-user states; entries without a ``user_id`` get the
+        default history features.
+        """
+        return self._history_features(
+            [entry.get('user_id') for entry in mood_entries],
+            [entry.get('mood', 5) for entry in mood_entries],
+            [entry_timestamp(entry) for entry in mood_entries],
+            history_tracker
+        )
+
+    def _history_features(self, user_ids, moods, timestamps, history_tracker=None):
+        """Replay (user_id, mood, timestamp) columns through a history tracker"""
+        tracker = history_tracker if history_tracker is not None else MoodHistoryTracker()
+        history = [None] * len(user_ids)
+
+        rows_by_user = {}
+        for i, user_id in enumerate(user_ids):
+            if user_id is None:
+                history[i] = dict(DEFAULT_HISTORY_FEATURES)
+            else:
+                rows_by_user.setdefault(user_id, []).append(i)
+
+        for user_id, rows in rows_by_user.items():
+            # Sort by time when every entry is dated; otherwise keep input order
+            if all(timestamps[i] is not None for i in rows):
+                rows.sort(key=lambda i: timestamps[i])
+            for i in rows:
+                history[i] = tracker.features(user_id, timestamps[i])
+                tracker.update(user_id, moods[i], timestamps[i], persist=False)
+
+        if rows_by_user:
+            tracker.save_states(list(rows_by_user))
+        return history
+
+    def _batch_column_order(self, has_date, has_context, has_profile, has_journal):
+        """Reproduce the column order pandas derives from the per-row dicts
+
+        pandas takes the union of dict keys in order of first appearance, so
+        only the first row of each distinct group signature matters.
+        """
+        signatures = np.stack([has_date, has_context, has_profile, has_journal], axis=1)
+        if not len(signatures):
+            return []
+        _, first_rows = np.unique(signatures, axis=0, return_index=True)
+
+        feature_names = []
+        seen = set()
+        for row in sorted(first_rows):
+            date, context, profile, journal = signatures[row]
+            keys = (BASE_COLUMNS + TEMPORAL_COLUMNS + (CYCLICAL_COLUMNS if date else []) +
+                    EMOTION_COLUMNS + TEXT_COLUMNS + (CONTEXT_COLUMNS if context else []) +
+                    (PROFILE_COLUMNS if profile else []) + HISTORY_COLUMNS +
+                    (JOURNAL_COLUMNS if journal else []))
+            for key in keys:
+                if key not in seen:
+                    seen.add(key)
+                    feature_names.append(key)
+        return feature_names
+
+    def _extract_mood_features(self, entry, history=None):
+        """Extract comprehensive features from a single mood entry
+
+        ``history`` holds the entry's mood history features (see
+        compute_history_features); without it the defaults are used.
+        """
         features = {}
         
         # Basic mood features
@@ -75,13 +407,45 @@ class AdvancedFeatureEngineer:
             features.update(self._extract_profile_features(entry['profile']))
         
         # Advanced temporal patterns
-        features.update(self._extract_advanced_temporal_features(entry))
+        features.update(self._extract_advanced_temporal_features(entry, history))
         
         # Mood history features (if available)
-        features.update(self._extract_mood_history_features(entry))
+        features.update(self._extract_mood_history_features(entry, history))
         
         return features
     
+    def extract_feature_row(self, entry, history=None, journal_context=None,
+                            schema=FEATURE_SCHEMA, out=None):
+        """Extract one entry's model features into a schema-ordered float32 row
+
+        Each extractor's output goes straight to its precomputed column, so
+        prediction never builds or walks a full feature dict.  Groups the
+        entry lacks (context, profile, journal) stay 0, as in training.
+        """
+        row = schema.new_row() if out is None else out
+        index = schema.index
+
+        def write(features):
+            for name, value in features.items():
+                column = index.get(name)
+                if column is not None:
+                    row[column] = value
+
+        emotions = entry.get('emotions', [])
+        note = entry.get('note')
+        write({'emotion_count': len(emotions), 'has_note': 1 if note else 0})
+        write(self._extract_temporal_features(entry.get('date', {})))
+        write(self._extract_emotion_features(emotions))
+        write(self._extract_text_features(note) if note else self._get_default_text_features())
+        if 'context' in entry:
+            write(self._extract_contextual_features(entry['context']))
+        if 'profile' in entry:
+            write(self._extract_profile_features(entry['profile']))
+        write(history or DEFAULT_HISTORY_FEATURES)
+        if journal_context:
+            write(journal_context)
+        return row
+    
     def _extract_temporal_features(self, date_info):
         """Extract temporal features from date information"""
         features = {}
@@ -136,50 +500,41 @@ class AdvancedFeatureEngineer:
         """Extract emotion-based features"""
         features = {}
         
-        # Standard emotion categories
-        emotion_categories = {
-            'positive': ['Happy', 'Excited', 'Grateful', 'Confident', 'Peaceful'],
-            'negative': ['Sad', 'Anxious', 'Frustrated', 'Lonely', 'Overwhelmed', 'Angry'],
-            'neutral': ['Calm', 'Peaceful']
-        }
-        
         # One-hot encoding for individual emotions
-        all_emotions = ['Happy', 'Sad', 'Anxious', 'Calm', 'Excited', 'Frustrated', 
-                       'Grateful', 'Lonely', 'Confident', 'Overwhelmed', 'Peaceful', 'Angry']
-        
-        for emotion in all_emotions:
+        for emotion in ALL_EMOTIONS:
             features[f'emotion_{emotion.lower()}'] = 1 if emotion in emotions else 0
         
         # Emotion category counts
-        for category, emotion_list in emotion_categories.items():
+        for category, emotion_list in EMOTION_CATEGORIES.items():
             count = sum(1 for emotion in emotions if emotion in emotion_list)
             features[f'{category}_emotion_count'] = count
         
         # Emotion diversity (entropy)
-        if emotions:
-            emotion_counts = {emotion: emotions.count(emotion) for emotion in set(emotions)}
-            total = len(emotions)
-            entropy = -sum((count/total) * np.log2(count/total) for count in emotion_counts.values())
-            features['emotion_diversity'] = entropy
-        else:
-            features['emotion_diversity'] = 0
+        features['emotion_diversity'] = self._emotion_diversity(emotions)
         
         # Emotion intensity (based on emotion combinations)
         intensity_score = 0
         for emotion in emotions:
-            if emotion in ['Happy', 'Excited', 'Angry']:
-                intensity_score += 2
-            elif emotion in ['Sad', 'Anxious', 'Overwhelmed']:
-                intensity_score += 1.5
-            else:
-                intensity_score += 1
+            intensity_score += EMOTION_INTENSITY.get(emotion, 1)
         
         features['emotion_intensity'] = intensity_score / len(emotions) if emotions else 0
         
         return features
     
-    def _extract_text_features(self, text):
-        """Extract comprehensive text features"""
+    def _emotion_diversity(self, emotions):
+        """Shannon entropy of the emotion list"""
+        if not emotions:
+            return 0
+        emotion_counts = {emotion: emotions.count(emotion) for emotion in set(emotions)}
+        total = len(emotions)
+        return -sum((count/total) * np.log2(count/total) for count in emotion_counts.values())
+    
+    def _extract_text_features(self, text, lexicon_counts=None):
+        """Extract comprehensive text features
+
+        ``lexicon_counts`` may carry precomputed LexiconMatcher scores for the
+        text (the batch path scores all notes in one call).
+        """
         features = {}
         
         if not text or not text.strip():
@@ -195,17 +550,21 @@ class AdvancedFeatureEngineer:
         sentiment = self._analyze_sentiment_comprehensive(text)
         features.update(sentiment)
         
+        # Lexicon and pronoun counts in a single token pass
+        if lexicon_counts is None:
+            lexicon_counts = self.lexicon_matcher.score(text)
+        
         # Text complexity features
         features['readability_score'] = self._calculate_readability(text)
-        features['emotional_words_count'] = self._count_emotional_words(text)
+        features['emotional_words_count'] = lexicon_counts['emotional_words_count']
         features['question_marks'] = text.count('?')
         features['exclamation_marks'] = text.count('!')
         features['capital_letters'] = sum(1 for c in text if c.isupper())
         
         # Linguistic features
-        features['pronoun_count'] = len(re.findall(r'\b(I|me|my|mine|myself)\b', text, re.IGNORECASE))
-        features['negative_words'] = self._count_negative_words(text)
-        features['positive_words'] = self._count_positive_words(text)
+        features['pronoun_count'] = lexicon_counts['pronoun_count']
+        features['negative_words'] = lexicon_counts['negative_words']
+        features['positive_words'] = lexicon_counts['positive_words']
         
         return features
     
@@ -222,21 +581,17 @@ class AdvancedFeatureEngineer:
     
     def _analyze_sentiment_comprehensive(self, text):
         """Comprehensive sentiment analysis"""
-        # VADER sentiment
-        vader_scores = self.sentiment_analyzer.polarity_scores(text)
-        
-        # TextBlob sentiment
-        blob = TextBlob(text)
-        polarity = blob.sentiment.polarity
-        subjectivity = blob.sentiment.subjectivity
+        # VADER and TextBlob scores via the shared sentiment cache
+        scores = self.sentiment_service.scores(text)
+        vader_scores = scores['vader'] or {'pos': 0, 'neg': 0, 'neu': 1, 'compound': 0}
         
         return {
             'sentiment_positive': vader_scores['pos'],
             'sentiment_negative': vader_scores['neg'],
             'sentiment_neutral': vader_scores['neu'],
             'sentiment_compound': vader_scores['compound'],
-            'polarity': polarity,
-            'subjectivity': subjectivity
+            'polarity': scores['polarity'],
+            'subjectivity': scores['subjectivity']
         }
     
     def _calculate_readability(self, text):
@@ -274,36 +629,15 @@ class AdvancedFeatureEngineer:
     
     def _count_emotional_words(self, text):
         """Count emotional words in text"""
-        emotional_words = [
-            'happy', 'sad', 'angry', 'excited', 'anxious', 'calm', 'frustrated',
-            'grateful', 'lonely', 'confident', 'overwhelmed', 'peaceful', 'worried',
-            'joy', 'fear', 'love', 'hate', 'hope', 'despair', 'content', 'miserable'
-        ]
-        
-        text_lower = text.lower()
-        return sum(1 for word in emotional_words if word in text_lower)
+        return self.lexicon_matcher.score(text)['emotional_words_count']
     
     def _count_negative_words(self, text):
         """Count negative words in text"""
-        negative_words = [
-            'bad', 'terrible', 'awful', 'horrible', 'worst', 'hate', 'dislike',
-            'angry', 'frustrated', 'sad', 'depressed', 'anxious', 'worried',
-            'stressed', 'overwhelmed', 'lonely', 'hopeless', 'miserable'
-        ]
-        
-        text_lower = text.lower()
-        return sum(1 for word in negative_words if word in text_lower)
+        return self.lexicon_matcher.score(text)['negative_words']
     
     def _count_positive_words(self, text):
         """Count positive words in text"""
-        positive_words = [
-            'good', 'great', 'wonderful', 'amazing', 'fantastic', 'love', 'like',
-            'happy', 'excited', 'grateful', 'confident', 'peaceful', 'calm',
-            'joyful', 'content', 'blessed', 'lucky', 'hopeful', 'optimistic'
-        ]
-        
-        text_lower = text.lower()
-        return sum(1 for word in positive_words if word in text_lower)
+        return self.lexicon_matcher.score(text)['positive_words']
     
     def _extract_contextual_features(self, context):
         """Extract features from contextual information"""
@@ -356,43 +690,90 @@ class AdvancedFeatureEngineer:
         if category not in self.label_encoders:
             self.label_encoders[category] = LabelEncoder()
             # Initialize with common values
-            common_values = {
-                'age_group': ['18-25', '26-35', '36-45', '46-55', '56-65', '65+'],
-                'occupation': ['student', 'professional', 'retired', 'unemployed', 'freelancer'],
-                'living_situation': ['alone', 'with_family', 'with_roommates', 'with_partner']
-            }
-            self.label_encoders[category].fit(common_values.get(category, [value]))
+            self.label_encoders[category].fit(CATEGORICAL_VALUES.get(category, [value]))
         
         try:
             return self.label_encoders[category].transform([value])[0]
         except ValueError:
             return 0  # Default value for unknown categories
-    
-    def _extract_advanced_temporal_features(self, entry):
+
+    def _categorical_lookup(self, category):
+        """Value -> code mapping equivalent to _encode_categorical"""
+        if category not in self.label_encoders:
+            self._encode_categorical(CATEGORICAL_VALUES[category][0], category)
+        return {value: code for code, value in enumerate(self.label_encoders[category].classes_)}
+
+    def _extract_advanced_temporal_features(self, entry, history=None):
         """Extract advanced temporal pattern features"""
+        history = history or DEFAULT_HISTORY_FEATURES
         features = {}
         
-        # These would require historical data to calculate properly
-        # For now, we'll add placeholder features that could be calculated with more data
-        features['mood_trend'] = 0  # Would be calculated from recent mood history
-        features['mood_volatility'] = 0  # Would be calculated from mood variance
-        features['entry_frequency'] = 1  # Would be calculated from entry frequency
+        features['mood_trend'] = history['mood_trend']  # Slope over the last few moods
+        features['mood_volatility'] = history['mood_volatility']  # EW standard deviation
+        features['entry_frequency'] = history['entry_frequency']  # Entries per day
         
         return features
     
-    def _extract_mood_history_features(self, entry):
-        """Extract features from mood history (requires historical data)"""
+    def _extract_mood_history_features(self, entry, history=None):
+        """Extract features from mood history"""
+        history = history or DEFAULT_HISTORY_FEATURES
         features = {}
         
-        # These features would be calculated from historical mood data
-        features['mood_momentum'] = 0  # Recent trend in mood
-        features['mood_consistency'] = 0  # How consistent recent moods have been
-        features['mood_recovery'] = 0  # How quickly mood recovers from lows
+        features['mood_momentum'] = history['mood_momentum']  # Fast EWMA minus slow EWMA
+        features['mood_consistency'] = history['mood_consistency']  # 1 / (1 + recent std)
+        features['mood_recovery'] = history['mood_recovery']  # Days taken to recover from lows
         
         return features
     
+    def _build_journal_index(self, journal_entries):
+        """Parse journal dates once and aggregate journals per calendar day
+
+        Journals carrying a ``user_id`` are additionally bucketed per
+        (user, day) so mood entries of that user only see their own journals.
+        """
+        if isinstance(journal_entries, JournalIndex):
+            return journal_entries
+        
+        by_day = {}
+        by_user_day = {}
+        for journal in journal_entries:
+            journal_day = datetime.fromisoformat(journal['date'].replace('Z', '+00:00')).date()
+            by_day.setdefault(journal_day, []).append(journal)
+            if journal.get('user_id') is not None:
+                by_user_day.setdefault((journal['user_id'], journal_day), []).append(journal)
+        
+        return JournalIndex(
+            {day: self._aggregate_journals(journals) for day, journals in by_day.items()},
+            {key: self._aggregate_journals(journals) for key, journals in by_user_day.items()}
+        )
+    
+    def _aggregate_journals(self, same_day_journals):
+        """Aggregate journal features for one bucket"""
+        total_journal_length = sum(len(j['content']) for j in same_day_journals)
+        # Convert sentiment to numeric values
+        sentiment_values = []
+        for j in same_day_journals:
+            sentiment = j.get('sentiment', 'neutral')
+            if sentiment == 'positive':
+                sentiment_values.append(1)
+            elif sentiment == 'negative':
+                sentiment_values.append(-1)
+            else:
+                sentiment_values.append(0)
+        avg_journal_sentiment = np.mean(sentiment_values) if sentiment_values else 0
+        
+        return {
+            'journal_entries_today': len(same_day_journals),
+            'total_journal_length': total_journal_length,
+            'avg_journal_sentiment': avg_journal_sentiment
+        }
+    
     def _get_journal_context(self, mood_entry, journal_entries):
-        """Get journal context for a mood entry"""
+        """Get journal context for a mood entry
+
+        ``journal_entries`` is either a JournalIndex (one dictionary lookup)
+        or a plain list, which is indexed on the fly.
+        """
         features = {}
         
         # Find journal entries from the same day
@@ -400,34 +781,19 @@ class AdvancedFeatureEngineer:
         if not mood_date:
             return features
         
-        same_day_journals = []
-        for journal in journal_entries:
-            journal_date = datetime.fromisoformat(journal['date'].replace('Z', '+00:00'))
-            mood_datetime = datetime(mood_date.get('year', 2024), 
-                                   mood_date.get('month', 1), 
-                                   mood_date.get('day', 1))
-            
-            if journal_date.date() == mood_datetime.date():
-                same_day_journals.append(journal)
-        
-        if same_day_journals:
-            # Aggregate journal features
-            total_journal_length = sum(len(j['content']) for j in same_day_journals)
-            # Convert sentiment to numeric values
-            sentiment_values = []
-            for j in same_day_journals:
-                sentiment = j.get('sentiment', 'neutral')
-                if sentiment == 'positive':
-                    sentiment_values.append(1)
-                elif sentiment == 'negative':
-                    sentiment_values.append(-1)
-                else:
-                    sentiment_values.append(0)
-            avg_journal_sentiment = np.mean(sentiment_values) if sentiment_values else 0
-            
-            features['journal_entries_today'] = len(same_day_journals)
-            features['total_journal_length'] = total_journal_length
-            features['avg_journal_sentiment'] = avg_journal_sentiment
+        journal_index = self._build_journal_index(journal_entries)
+        mood_day = datetime(mood_date.get('year', 2024),
+                            mood_date.get('month', 1),
+                            mood_date.get('day', 1)).date()
+        
+        user_id = mood_entry.get('user_id')
+        if user_id is not None and journal_index.by_user_day:
+            aggregate = journal_index.by_user_day.get((user_id, mood_day))
+        else:
+            aggregate = journal_index.by_day.get(mood_day)
+        
+        if aggregate:
+            features.update(aggregate)
         else:
             features['journal_entries_today'] = 0
             features['total_journal_length'] = 0
@@ -510,6 +876,26 @@ def test_advanced_feature_engineering():
     for col in features_df.columns[:10]:  # Show first 10 features
         print(f"   {col}: {features_df[col].iloc[0]:.3f}")
     
+    # Batch mode must reproduce the per-row path exactly
+    batch_matrix, batch_columns = engineer.extract_features_batch(sample_entries)
+    assert batch_columns == list(features_df.columns)
+    assert np.array_equal(batch_matrix, features_df.to_numpy(np.float32), equal_nan=True)
+    print(f"✅ Batch extraction matches per-row path: {batch_matrix.shape}")
+    
+    # History features come from the same user's earlier entries (Sep 7 precedes Sep 8)
+    user_entries = [dict(entry, user_id='user_001') for entry in sample_entries]
+    history_df = engineer.extract_comprehensive_features(user_entries)
+    print(f"📈 Mood history (Sep 8 entry): volatility={history_df['mood_volatility'].iloc[0]:.3f}, "
+          f"consistency={history_df['mood_consistency'].iloc[0]:.3f}")
+    assert history_df['mood_consistency'].iloc[1] == 0 and history_df['mood_consistency'].iloc[0] == 1
+    
+    # Schema rows from the batch and the per-entry writer agree
+    schema_matrix, schema_columns = engineer.extract_features_batch(user_entries, schema=FEATURE_SCHEMA)
+    history = engineer.compute_history_features(user_entries)
+    for i, entry in enumerate(user_entries):
+        assert np.array_equal(schema_matrix[i], engineer.extract_feature_row(entry, history[i]))
+    print(f"✅ Schema rows match: {schema_matrix.shape} (v{FEATURE_SCHEMA.version})")
+    
     # Prepare for training
     X_scaled, y, feature_names = engineer.prepare_features_for_training(features_df)
     
@@ -4,7 +4,7 @@ Production-ready ML Backend for Mental Health Companion
 Simplified version for cloud deployment
 """
 
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, request, jsonify
 from flask_cors import CORS
 import os
 import logging
@@ -12,10 +12,12 @@ from datetime import datetime
 import json
 import pandas as pd
 import numpy as np
-from textblob import TextBlob
-import joblib
 import sqlite3
 from pathlib import Path
+from sentiment_service import get_sentiment_service
+from forest_compiler import COMPILED_FOREST_DIRNAME, load_compiled_forest
+from model_registry import active_model_dir, load_joblib, model_mmap_mode
+from process_memory import read_process_memory
 
 # Configure logging
 logging.basicConfig(
@@ -24,33 +26,37 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Initialize Flask app
-app = Flask(__name__)
-CORS(app)
+# API routes, registered on the app by create_app()
+api = Blueprint('api', __name__)
+
+# Operator-only routes (process details), registered only with INTERNAL_ENDPOINTS=true
+internal = Blueprint('internal', __name__)
 
 # Global variables for models
 mood_predictor = None
 scaler = None
 vectorizer = None
 
-def load_models():
+def load_models(models_dir: str = "models"):
     """Load pre-trained models"""
     global mood_predictor, scaler, vectorizer
     
     try:
-        models_dir = Path("models")
+        vectorizer_dir = Path(models_dir)
+        models_dir = Path(active_model_dir(models_dir))  # the registry's active version, if published
         
-        # Load models if they exist
-        if (models_dir / "mood_predictor.joblib").exists():
-            mood_predictor = joblib.load(models_dir / "mood_predictor.joblib")
-            logger.info("Mood predictor model loaded")
+        # Only an already compiled forest is opened (memory-mapped, read-only); the joblib
+        # forest is compiled by ModelRegistry.publish or `python forest_compiler.py export-legacy`
+        mood_predictor = load_compiled_forest(str(models_dir / COMPILED_FOREST_DIRNAME), mmap_mode=model_mmap_mode())
+        if mood_predictor is not None:
+            logger.info(f"Mood predictor loaded (compiled, mmap_mode={mood_predictor.mmap_mode})")
         
         if (models_dir / "scaler.joblib").exists():
-            scaler = joblib.load(models_dir / "scaler.joblib")
+            scaler = load_joblib(models_dir / "scaler.joblib")
             logger.info("Scaler model loaded")
             
-        if (models_dir / "vectorizer.joblib").exists():
-            vectorizer = joblib.load(models_dir / "vectorizer.joblib")
+        if (vectorizer_dir / "vectorizer.joblib").exists():
+            vectorizer = load_joblib(vectorizer_dir / "vectorizer.joblib")
             logger.info("Vectorizer model loaded")
             
         return True
@@ -58,11 +64,24 @@ def load_models():
         logger.error(f"Error loading models: {e}")
         return False
 
-# Load models on startup
-load_models()
+def create_app(models_dir: str = "models") -> Flask:
+    """Application factory
+
+    Loads the models before returning, so under ``gunicorn --preload`` (see
+    gunicorn.conf.py) they are loaded once in the master and shared by the
+    forked workers. The ``internal`` routes are added only when
+    INTERNAL_ENDPOINTS is true; expose those only on a private network.
+    """
+    flask_app = Flask(__name__)
+    CORS(flask_app)
+    load_models(models_dir)
+    flask_app.register_blueprint(api)
+    if os.environ.get('INTERNAL_ENDPOINTS', 'false').lower() == 'true':
+        flask_app.register_blueprint(internal)
+    return flask_app
 
 # Health check endpoint
-@app.route('/api/health', methods=['GET'])
+@api.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     try:
@@ -83,8 +102,18 @@ def health_check():
             'timestamp': datetime.now().isoformat()
         }), 500
 
+# Worker memory for operators (reads /proc smaps_rollup, so not part of the health probe)
+@internal.route('/internal/memory', methods=['GET'])
+def worker_memory():
+    """This worker's pid and memory (RSS, PSS, shared and private MB)"""
+    return jsonify({
+        'pid': os.getpid(),
+        'memory': read_process_memory(),
+        'timestamp': datetime.now().isoformat()
+    })
+
 # Sentiment analysis endpoint
-@app.route('/api/sentiment', methods=['POST'])
+@api.route('/api/sentiment', methods=['POST'])
 def analyze_sentiment():
     """Analyze sentiment of text"""
     try:
@@ -94,10 +123,10 @@ def analyze_sentiment():
         if not text:
             return jsonify({'error': 'Text is required'}), 400
         
-        # Use TextBlob for sentiment analysis
-        blob = TextBlob(text)
-        polarity = blob.sentiment.polarity
-        subjectivity = blob.sentiment.subjectivity
+        # TextBlob sentiment via the shared sentiment cache
+        scores = get_sentiment_service().scores(text)
+        polarity = scores['polarity']
+        subjectivity = scores['subjectivity']
         
         if polarity >= 0.1:
             sentiment = "positive"
@@ -122,7 +151,7 @@ def analyze_sentiment():
         return jsonify({'error': str(e)}), 500
 
 # Mood prediction endpoint
-@app.route('/api/predict-mood', methods=['POST'])
+@api.route('/api/predict-mood', methods=['POST'])
 def predict_mood():
     """Predict mood based on emotions and note"""
     try:
@@ -151,8 +180,7 @@ def predict_mood():
         
         # Text sentiment influence
         if note:
-            blob = TextBlob(note)
-            sentiment_polarity = blob.sentiment.polarity
+            sentiment_polarity = get_sentiment_service().scores(note)['polarity']
             mood_score += sentiment_polarity * 2
         
         # Normalize mood score to 1-10 range
@@ -195,7 +223,7 @@ def predict_mood():
         return jsonify({'error': str(e)}), 500
 
 # Recommendations endpoint
-@app.route('/api/recommendations', methods=['POST'])
+@api.route('/api/recommendations', methods=['POST'])
 def get_recommendations():
     """Get mental health recommendations"""
     try:
@@ -282,7 +310,7 @@ def get_recommendations():
         return jsonify({'error': str(e)}), 500
 
 # Pattern analysis endpoint
-@app.route('/api/patterns', methods=['POST'])
+@api.route('/api/patterns', methods=['POST'])
 def analyze_patterns():
     """Analyze patterns in mood data"""
     try:
@@ -329,14 +357,17 @@ def analyze_patterns():
         return jsonify({'error': str(e)}), 500
 
 # Error handlers
-@app.errorhandler(404)
+@api.app_errorhandler(404)
 def not_found(error):
     return jsonify({'error': 'Endpoint not found'}), 404
 
-@app.errorhandler(500)
+@api.app_errorhandler(500)
 def internal_error(error):
     return jsonify({'error': 'Internal server error'}), 500
 
+# Module-level app for `gunicorn app:app`, Vercel and `python app.py`
+app = create_app()
+
 # For Vercel deployment
 def handler(request):
     return app(request)
@@ -352,5 +383,6 @@ if __name__ == '__main__':
     logger.info("  POST /api/predict-mood - Mood prediction")
     logger.info("  POST /api/recommendations - Get recommendations")
     logger.info("  POST /api/patterns - Analyze patterns")
+    logger.info("  GET  /internal/memory - Worker memory (only with INTERNAL_ENDPOINTS=true)")
     
     app.run(host='0.0.0.0', port=port, debug=debug)
\ No newline at end of file
@@ -5,7 +5,7 @@ import numpy as np
 import os
 from datetime import datetime, timedelta
 import json
-from textblob import TextBlob
+from sentiment_service import get_sentiment_service
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -21,10 +21,10 @@ class SimpleMentalHealthML:
         if not text or not text.strip():
             return {"sentiment": "neutral", "confidence": 0.5, "scores": {"positive": 0.33, "negative": 0.33, "neutral": 0.34}}
         
-        # TextBlob sentiment analysis
-        blob = TextBlob(text)
-        polarity = blob.sentiment.polarity
-        subjectivity = blob.sentiment.subjectivity
+        # TextBlob sentiment analysis via the shared sentiment cache
+        scores = get_sentiment_service().scores(text)
+        polarity = scores['polarity']
+        subjectivity = scores['subjectivity']
         
         # Determine overall sentiment
         if polarity >= 0.1:
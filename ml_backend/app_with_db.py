@@ -10,11 +10,9 @@ from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.linear_model import LinearRegression
 from sklearn.preprocessing import StandardScaler
-from textblob import TextBlob
-import nltk
-from nltk.sentiment import SentimentIntensityAnalyzer
 import warnings
 from database_service import DatabaseService
+from sentiment_service import get_sentiment_service
 from dotenv import load_dotenv
 
 warnings.filterwarnings('ignore')
@@ -22,12 +20,6 @@ warnings.filterwarnings('ignore')
 # Load environment variables
 load_dotenv()
 
-# Download required NLTK data
-try:
-    nltk.data.find('vader_lexicon')
-except LookupError:
-    nltk.download('vader_lexicon')
-
 app = Flask(__name__)
 CORS(app)
 
@@ -36,7 +28,8 @@ db_service = DatabaseService()
 
 class MentalHealthML:
     def __init__(self):
-        self.sentiment_analyzer = SentimentIntensityAnalyzer()
+        self.sentiment_service = get_sentiment_service()
+        self.sentiment_analyzer = self.sentiment_service.vader
         self.mood_predictor = None
         self.sentiment_classifier = None
         self.vectorizer = TfidfVectorizer(max_features=1000, stop_words='english')
@@ -79,13 +72,11 @@ class MentalHealthML:
         if not text or not text.strip():
             return {"sentiment": "neutral", "confidence": 0.5, "scores": {"positive": 0.33, "negative": 0.33, "neutral": 0.34}}
         
-        # VADER sentiment analysis
-        vader_scores = self.sentiment_analyzer.polarity_scores(text)
-        
-        # TextBlob sentiment analysis
-        blob = TextBlob(text)
-        polarity = blob.sentiment.polarity
-        subjectivity = blob.sentiment.subjectivity
+        # VADER and TextBlob scores via the shared sentiment cache
+        scores = self.sentiment_service.scores(text)
+        vader_scores = scores['vader']
+        polarity = scores['polarity']
+        subjectivity = scores['subjectivity']
         
         # Determine overall sentiment
         if vader_scores['compound'] >= 0.05:
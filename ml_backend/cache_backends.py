@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Cache Backends for Mental Health Companion
+In-process, SQLite-file and Redis key/value caches behind one interface, chosen by configuration
+"""
+
+import os
+import math
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from sqlite_storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+class CacheBackend:
+    """Byte-valued cache with a TTL per entry
+
+    ``shared`` backends are visible to every process using the same
+    configuration (gunicorn workers, the Celery worker); the in-process
+    backend is not.
+    """
+    name = "base"
+    shared = False
+
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: float):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def clear(self, prefix: str = ""):
+        """Drop every entry whose key starts with ``prefix`` (all entries by default)"""
+        raise NotImplementedError
+
+    def ping(self) -> bool:
+        return True
+
+    def get_stats(self) -> Dict:
+        return {'backend': self.name, 'shared': self.shared}
+
+class MemoryCacheBackend(CacheBackend):
+    """Bounded LRU in this process"""
+    name = "memory"
+    shared = False
+
+    def __init__(self, maxsize: int = 10000, default_ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = default_ttl
+        self._entries = OrderedDict()  # key -> (expires at, value), LRU order
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self, prefix: str = ""):
+        with self._lock:
+            if not prefix:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                del self._entries[key]
+
+    def get_stats(self) -> Dict:
+        return {**super().get_stats(), 'size': len(self._entries), 'maxsize': self.maxsize, 'ttl': self.ttl}
+
+class SQLiteCacheBackend(CacheBackend):
+    """Cache table in a SQLite file shared by every process on the host
+
+    Reads go through the per-thread WAL connections of SQLiteStorage and
+    writes through its group-committing writer without waiting. Expiry uses
+    wall-clock time so all processes agree; expired rows are skipped on read
+    and deleted every ``cleanup_every`` writes.
+    """
+    name = "sqlite"
+    shared = True
+
+    def __init__(self, db_path: str = "cache.db", cleanup_every: int = 1000):
+        self.db_path = db_path
+        self.cleanup_every = cleanup_every
+        self.storage = get_storage(db_path)
+        self.storage.executescript('''
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                key TEXT PRIMARY KEY,
+                value BLOB,
+                expires_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_cache_entries_expires_at ON cache_entries (expires_at);
+        ''')
+        self._writes = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        row = self.storage.read_one('SELECT value FROM cache_entries WHERE key = ? AND expires_at > ?',
+                                    (key, time.time()))
+        return row[0] if row else None
+
+    def set(self, key: str, value: bytes, ttl: float):
+        now = time.time()
+        self.storage.write('''
+            INSERT INTO cache_entries (key, value, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at
+        ''', (key, value, now + ttl), wait=False)
+        self._writes += 1
+        if self._writes % self.cleanup_every == 0:
+            self.storage.write('DELETE FROM cache_entries WHERE expires_at <= ?', (now,), wait=False)
+
+    def delete(self, key: str):
+        self.storage.write('DELETE FROM cache_entries WHERE key = ?', (key,))
+
+    def clear(self, prefix: str = ""):
+        if not prefix:
+            self.storage.write('DELETE FROM cache_entries')
+        else:
+            self.storage.write('DELETE FROM cache_entries WHERE substr(key, 1, ?) = ?', (len(prefix), prefix))
+
+    def ping(self) -> bool:
+        try:
+            self.storage.read_one('SELECT 1')
+            return True
+        except Exception as e:
+            logger.warning(f"SQLite cache unavailable: {e}")
+            return False
+
+    def get_stats(self) -> Dict:
+        size = self.storage.read_one('SELECT COUNT(*) FROM cache_entries WHERE expires_at > ?', (time.time(),))[0]
+        return {**super().get_stats(), 'size': size, 'db_path': self.db_path}
+
+class RedisCacheBackend(CacheBackend):
+    """Redis server shared by every host (needs the ``redis`` package)"""
+    name = "redis"
+    shared = True
+
+    def __init__(self, url: str = "redis://localhost:6379/0"):
+        import redis  # optional: only this backend needs it
+
+        self.url = url
+        self.client = redis.from_url(url)  # binary replies: values are bytes
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(key)
+
+    def set(self, key: str, value: bytes, ttl: float):
+        self.client.setex(key, max(1, math.ceil(ttl)), value)
+
+    def delete(self, key: str):
+        self.client.delete(key)
+
+    def clear(self, prefix: str = ""):
+        if not prefix:
+            self.client.flushdb()
+            return
+        for key in self.client.scan_iter(match=f"{prefix}*"):
+            self.client.delete(key)
+
+    def ping(self) -> bool:
+        try:
+            return bool(self.client.ping())
+        except Exception as e:
+            logger.warning(f"Redis unavailable: {e}")
+            return False
+
+    def get_stats(self) -> Dict:
+        stats = super().get_stats()
+        try:
+            info = self.client.info()
+        except Exception as e:
+            return {**stats, 'error': str(e)}
+        return {
+            **stats,
+            'used_memory': info.get('used_memory_human'),
+            'connected_clients': info.get('connected_clients'),
+            'keyspace_hits': info.get('keyspace_hits'),
+            'keyspace_misses': info.get('keyspace_misses')
+        }
+
+CACHE_BACKENDS = {
+    'memory': MemoryCacheBackend,
+    'sqlite': SQLiteCacheBackend,
+    'redis': RedisCacheBackend
+}
+
+def cache_backend_name() -> str:
+    """CACHE_BACKEND, else redis when REDIS_URL is set, else the host-local SQLite file"""
+    name = os.getenv('CACHE_BACKEND') or ('redis' if os.getenv('REDIS_URL') else 'sqlite')
+    if name not in CACHE_BACKENDS:
+        raise ValueError(f"Unknown CACHE_BACKEND {name!r} (expected one of {', '.join(CACHE_BACKENDS)})")
+    return name
+
+def cache_from_env() -> CacheBackend:
+    """Cache backend chosen by CACHE_BACKEND / REDIS_URL / CACHE_SQLITE_PATH / CACHE_MAX_ENTRIES"""
+    name = cache_backend_name()
+    if name == 'redis':
+        return RedisCacheBackend(os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+    if name == 'sqlite':
+        return SQLiteCacheBackend(os.getenv('CACHE_SQLITE_PATH', 'cache.db'))
+    return MemoryCacheBackend(maxsize=int(os.getenv('CACHE_MAX_ENTRIES', '10000')))
+
+def celery_broker_url(name: Optional[str] = None) -> Optional[str]:
+    """Celery broker for background tasks, or None to run them on an in-process thread pool
+
+    CELERY_BROKER_URL wins; otherwise the redis backend reuses its server.
+    The memory and sqlite backends have no broker: they serve a single host
+    without a ``celery worker``, so celery is not needed at all.
+    """
+    if os.getenv('CELERY_BROKER_URL'):
+        return os.getenv('CELERY_BROKER_URL')
+    if (name or cache_backend_name()) == 'redis':
+        return os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+    return None
+
+def test_cache_backends():
+    """Test the cache backends"""
+    from sqlite_storage import remove_database
+
+    print("🧰 Testing Cache Backends")
+    print("=" * 40)
+
+    backends = [MemoryCacheBackend(maxsize=3), SQLiteCacheBackend("test_cache.db", cleanup_every=2)]
+    for backend in backends:
+        backend.set('response:a', b'\x00alpha', 60)
+        backend.set('response:b', b'beta', 60)
+        backend.set('other:c', b'gamma', 0.05)
+        assert backend.get('response:a') == b'\x00alpha' and backend.get('missing') is None
+        time.sleep(0.06)
+        assert backend.get('other:c') is None  # expired
+        backend.clear('response:')
+        assert backend.get('response:b') is None
+        backend.set('response:b', b'beta', 60)
+        backend.delete('response:b')
+        assert backend.get('response:b') is None and backend.ping()
+        print(f"   {backend.name}: {backend.get_stats()}")
+
+    # The in-process backend is a bounded LRU
+    memory = backends[0]
+    for key in 'wxyz':
+        memory.set(key, key.encode(), 60)
+    assert len(memory) == 3 and memory.get('w') is None
+
+    # Gunicorn workers on one host share the SQLite backend
+    sqlite_backend = backends[1]
+    if hasattr(os, 'fork'):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                sqlite_backend.set('shared', b'from worker', 60)
+                sqlite_backend.storage.flush()
+                os._exit(0)
+            except BaseException:
+                os._exit(1)
+        assert os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1]) == 0
+        assert sqlite_backend.get('shared') == b'from worker'
+        print("   SQLite entry written by a forked worker is visible to the parent")
+
+    # Selection by configuration
+    previous = os.environ.get('CACHE_BACKEND')
+    os.environ['CACHE_BACKEND'] = 'memory'
+    assert isinstance(cache_from_env(), MemoryCacheBackend)
+    previous_broker = os.environ.pop('CELERY_BROKER_URL', None)
+    assert celery_broker_url() is None and celery_broker_url('sqlite') is None
+    assert celery_broker_url('redis').startswith('redis://')
+    if previous_broker is not None:
+        os.environ['CELERY_BROKER_URL'] = previous_broker
+    os.environ['CACHE_BACKEND'] = 'memcached'
+    try:
+        cache_from_env()
+        raise AssertionError("unknown backend accepted")
+    except ValueError as e:
+        print(f"   Rejected: {e}")
+    if previous is None:
+        del os.environ['CACHE_BACKEND']
+    else:
+        os.environ['CACHE_BACKEND'] = previous
+
+    remove_database("test_cache.db")
+    print("✅ Cache backends test completed!")
+    return backends
+
+def benchmark_cache_backends(num_keys=1000, lookups=20000):
+    """Hit latency of each backend (Redis only when a server answers at REDIS_URL)"""
+    from sqlite_storage import remove_database
+
+    print("⏱️ Benchmarking Cache Backends")
+    print("=" * 40)
+
+    backends = [MemoryCacheBackend(maxsize=num_keys), SQLiteCacheBackend("benchmark_cache.db")]
+    try:
+        redis_backend = RedisCacheBackend(os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+        if redis_backend.ping():
+            backends.append(redis_backend)
+        else:
+            print("   redis: no server, skipped")
+    except ImportError:
+        print("   redis: package not installed, skipped")
+
+    value = b'{"prediction": {"mood": 6, "confidence": 0.82}}' * 8
+    for backend in backends:
+        for i in range(num_keys):
+            backend.set(f"benchmark:{i}", value, 600)
+
+        start = time.perf_counter()
+        for i in range(lookups):
+            assert backend.get(f"benchmark:{i % num_keys}") is not None
+        elapsed = time.perf_counter() - start
+        print(f"   {backend.name:>6}: {elapsed / lookups * 1e6:8.1f} µs/hit")
+        backend.clear('benchmark:')
+
+    remove_database("benchmark_cache.db")
+
+if __name__ == "__main__":
+    backends = test_cache_backends()
+    benchmark_cache_backends()
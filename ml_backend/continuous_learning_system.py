@@ -4,32 +4,59 @@ Continuous Learning System for Mental Health Companion
 Implements automatic model retraining and continuous improvement
 """
 
+import atexit
 import json
 import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 from collections import deque
-import joblib
 import os
-import sqlite3
-from typing import Dict, List, Any, Optional, Tuple
+from typing import Dict, Any, Optional, Tuple, Union
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import accuracy_score, classification_report
 import threading
 import time
 import logging
+from feature_schema import FEATURE_SCHEMA, FeatureSchemaMismatch
+from model_registry import ModelRegistry, get_model_registry
+from micro_batcher import register_after_fork, weak_method
+from sqlite_storage import get_storage, remove_database
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def _add_feature_vector_columns(conn):
+    """Databases created before feature vectors were stored as BLOBs"""
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(learning_data)')}
+    for column, column_type in [('feature_vector', 'BLOB'), ('schema_fingerprint', 'TEXT')]:
+        if column not in columns:
+            conn.execute(f'ALTER TABLE learning_data ADD COLUMN {column} {column_type}')
+
+# Versioned schema changes for existing databases (see SQLiteStorage.migrate)
+MIGRATIONS = [
+    (1, [_add_feature_vector_columns]),
+    (2, [
+        # Recency reads: retrain checks, accuracy tracking, insights
+        '''CREATE INDEX IF NOT EXISTS idx_learning_data_timestamp ON learning_data (timestamp)''',
+        # Training matrix: the newest rows for the current feature schema
+        '''CREATE INDEX IF NOT EXISTS idx_learning_data_schema_timestamp
+               ON learning_data (schema_fingerprint, timestamp)''',
+        # Rows still waiting for the JSON -> vector conversion (empty once migrated)
+        '''CREATE INDEX IF NOT EXISTS idx_learning_data_json_pending
+               ON learning_data (id) WHERE feature_vector IS NULL''',
+    ]),
+]
+
 class ContinuousLearningSystem:
     """Continuous learning system for model improvement"""
     
-    def __init__(self, models_dir="models", db_path="learning.db"):
+    def __init__(self, models_dir="models", db_path="learning.db", model_registry: Optional[ModelRegistry] = None):
         self.models_dir = models_dir
         self.db_path = db_path
+        self.model_registry = model_registry or get_model_registry(models_dir)
+        self.storage = get_storage(db_path)
         self.init_database()
         
         # Learning parameters
@@ -47,30 +74,45 @@ class ContinuousLearningSystem:
         self.retrain_thread = None
         self.stop_retraining = False
         
+        # Write-behind buffer: samples are inserted with executemany from a background thread
+        self.flush_batch_size = 200  # Flush once this many samples are buffered
+        self.flush_interval = 2.0  # ...or after this many seconds
+        self.max_pending_samples = 10000  # While flushes fail, keep at most this many (newest)
+        self.pending_samples = []
+        self.buffer_lock = threading.Lock()
+        self.flush_lock = threading.Lock()  # One flush at a time
+        self.flush_requested = threading.Event()
+        self.stop_flushing = threading.Event()
+        self.flush_thread = None
+        
+        # Samples since the last retrain, counted in memory instead of queried per sample
+        self.samples_since_retrain = self.storage.read_one('SELECT COUNT(*) FROM learning_data')[0]
+        
+        self._start_flush_thread()
+        atexit.register(weak_method(self, 'flush_samples'))
+        register_after_fork(self)
+        
         # Initialize models
         self.load_latest_models()
     
     def init_database(self):
         """Initialize learning database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Create learning data table
-        cursor.execute('''
+        self.storage.executescript('''
+            -- Learning data table
             CREATE TABLE IF NOT EXISTS learning_data (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id TEXT,
                 features TEXT,
+                feature_vector BLOB,
+                schema_fingerprint TEXT,
                 target_value REAL,
                 prediction REAL,
                 confidence REAL,
                 timestamp DATETIME,
                 data_type TEXT
-            )
-        ''')
-        
-        # Create model versions table
-        cursor.execute('''
+            );
+            
+            -- Model versions table
             CREATE TABLE IF NOT EXISTS model_versions (
                 version_id TEXT PRIMARY KEY,
                 model_type TEXT,
@@ -78,11 +120,9 @@ class ContinuousLearningSystem:
                 created_date DATETIME,
                 file_path TEXT,
                 is_active BOOLEAN
-            )
-        ''')
-        
-        # Create retraining log table
-        cursor.execute('''
+            );
+            
+            -- Retraining log table
             CREATE TABLE IF NOT EXISTS retraining_log (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 version_id TEXT,
@@ -91,16 +131,17 @@ class ContinuousLearningSystem:
                 retrain_date DATETIME,
                 success BOOLEAN,
                 error_message TEXT
-            )
+            );
         ''')
+        self.storage.migrate('continuous_learning', MIGRATIONS)
         
-        conn.commit()
-        conn.close()
+        # JSON-only rows are converted on first read (see _migrate_json_samples)
+        self.json_samples_pending = True
     
-    def add_training_sample(self, user_id: str, features: Dict, target_value: float, 
+    def add_training_sample(self, user_id: str, features: Union[Dict, np.ndarray], target_value: float, 
                            prediction: float = None, confidence: float = None, 
                            data_type: str = "mood_entry"):
-        """Add a new training sample to the learning system"""
+        """Add a new training sample (a features dict or a FEATURE_SCHEMA row)"""
         sample = {
             'user_id': user_id,
             'features': features,
@@ -114,7 +155,7 @@ class ContinuousLearningSystem:
         # Add to buffer
         self.data_buffer.append(sample)
         
-        # Store in database
+        # Queue for storage
         self._store_learning_sample(sample)
         
         # Check if retraining is needed
@@ -122,26 +163,88 @@ class ContinuousLearningSystem:
             self._schedule_retraining()
     
     def _store_learning_sample(self, sample: Dict):
-        """Store learning sample in database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO learning_data
-            (user_id, features, target_value, prediction, confidence, timestamp, data_type)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
+        """Queue a learning sample for the next batched insert"""
+        row = (
             sample['user_id'],
-            json.dumps(sample['features']),
+            self._feature_vector(sample['features']).tobytes(),
+            FEATURE_SCHEMA.fingerprint,
             sample['target_value'],
             sample['prediction'],
             sample['confidence'],
             sample['timestamp'].isoformat(),
             sample['data_type']
-        ))
+        )
         
-        conn.commit()
-        conn.close()
+        with self.buffer_lock:
+            self.pending_samples.append(row)
+            self.samples_since_retrain += 1
+            full = len(self.pending_samples) >= self.flush_batch_size
+        
+        if full:
+            self.flush_requested.set()
+    
+    def flush_samples(self) -> int:
+        """Insert every buffered sample now; returns how many were written
+        
+        Flushes run one at a time, so on return the samples taken by a
+        concurrent flush (the flusher thread) are written too.
+        """
+        with self.flush_lock:
+            with self.buffer_lock:
+                rows, self.pending_samples = self.pending_samples, []
+            
+            if not rows:
+                return 0
+            
+            try:
+                self.storage.write_many('''
+                    INSERT INTO learning_data
+                    (user_id, feature_vector, schema_fingerprint, target_value, prediction, confidence,
+                     timestamp, data_type)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', rows)
+            except Exception as e:
+                logger.error(f"Error flushing {len(rows)} learning samples: {e}")
+                with self.buffer_lock:
+                    self.pending_samples[:0] = rows  # Keep them for the next flush
+                    dropped = len(self.pending_samples) - self.max_pending_samples
+                    if dropped > 0:
+                        del self.pending_samples[:dropped]
+                if dropped > 0:
+                    logger.warning(f"Learning sample buffer full: dropped the {dropped} oldest samples")
+                return 0
+        
+        return len(rows)
+    
+    def _start_flush_thread(self):
+        self.flush_thread = threading.Thread(target=self._flush_loop, name="learning-sample-flusher")
+        self.flush_thread.daemon = True
+        self.flush_thread.start()
+    
+    def _flush_loop(self):
+        """Flush on the size threshold or every flush_interval seconds"""
+        while not self.stop_flushing.is_set():
+            self.flush_requested.wait(self.flush_interval)
+            self.flush_requested.clear()
+            self.flush_samples()
+    
+    def _after_fork(self):
+        """Samples buffered before the fork are flushed by the parent"""
+        self.buffer_lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.pending_samples = []
+        self.flush_requested = threading.Event()
+        if not self.stop_flushing.is_set():
+            self._start_flush_thread()
+    
+    def close(self):
+        """Stop the background threads and flush everything still buffered"""
+        self.stop_continuous_learning()
+        self.stop_flushing.set()
+        self.flush_requested.set()
+        if self.flush_thread:
+            self.flush_thread.join(timeout=5)
+        self.flush_samples()
     
     def _should_retrain(self) -> bool:
         """Check if model should be retrained"""
@@ -152,8 +255,7 @@ class ContinuousLearningSystem:
                 return False
         
         # Check if enough new samples
-        recent_samples = self._get_recent_samples(self.retrain_threshold)
-        if len(recent_samples) < self.retrain_threshold:
+        if self.samples_since_retrain < self.retrain_threshold:
             return False
         
         # Check if retraining is already in progress
@@ -162,38 +264,83 @@ class ContinuousLearningSystem:
         
         return True
     
-    def _get_recent_samples(self, limit: int) -> List[Dict]:
-        """Get recent learning samples"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT user_id, features, target_value, prediction, confidence, timestamp, data_type
+    def _feature_vector(self, features: Union[Dict, np.ndarray]) -> np.ndarray:
+        """float32 FEATURE_SCHEMA row for a features dict (or an existing row)"""
+        if isinstance(features, np.ndarray):
+            row = np.ascontiguousarray(features, dtype=np.float32)
+            if row.shape != (FEATURE_SCHEMA.size,):
+                raise FeatureSchemaMismatch(
+                    f"Feature row has shape {row.shape}, the schema has {FEATURE_SCHEMA.size} features"
+                )
+            return row
+        return FEATURE_SCHEMA.row_from_dict(features)
+    
+    def _load_training_matrix(self, limit: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Most recent ``limit`` samples as an (N x F) float32 matrix and integer targets
+
+        Vectors are stored as packed float32 BLOBs, so the matrix is one
+        np.frombuffer over the concatenated blobs; rows written for another
+        feature schema are left out.
+        """
+        self.flush_samples()
+        self._migrate_json_samples()
+        rows = self.storage.read('''
+            SELECT feature_vector, target_value
             FROM learning_data
+            WHERE schema_fingerprint = ?
             ORDER BY timestamp DESC
             LIMIT ?
-        ''', (limit,))
-        
-        samples = []
-        for row in cursor.fetchall():
-            samples.append({
-                'user_id': row[0],
-                'features': json.loads(row[1]),
-                'target_value': row[2],
-                'prediction': row[3],
-                'confidence': row[4],
-                'timestamp': datetime.fromisoformat(row[5]),
-                'data_type': row[6]
-            })
-        
-        conn.close()
-        return samples
+        ''', (FEATURE_SCHEMA.fingerprint, limit))
+        
+        if not rows:
+            return FEATURE_SCHEMA.new_matrix(0), np.zeros(0, dtype=np.int64)
+        
+        vectors, targets = zip(*rows)
+        X = np.frombuffer(b''.join(vectors), dtype=np.float32).reshape(len(rows), FEATURE_SCHEMA.size)
+        y = np.rint(np.array(targets, dtype=np.float64)).astype(np.int64)  # REAL column -> mood classes
+        return X, y
+    
+    def _migrate_json_samples(self, batch_size: int = 500) -> int:
+        """Convert rows stored as JSON feature dicts into float32 vectors (once per process)"""
+        if not self.json_samples_pending:
+            return 0
+        
+        migrated = 0
+        while True:
+            rows = self.storage.read('''
+                SELECT id, features FROM learning_data
+                WHERE feature_vector IS NULL
+                LIMIT ?
+            ''', (batch_size,))
+            if not rows:
+                break
+            
+            updates = []
+            for sample_id, features in rows:
+                try:
+                    vector = self._feature_vector(json.loads(features)).tobytes()
+                    updates.append((vector, FEATURE_SCHEMA.fingerprint, sample_id))
+                except (AttributeError, TypeError, ValueError) as e:
+                    logger.warning(f"Learning sample {sample_id} has unreadable features: {e}")
+                    updates.append((b'', 'unreadable', sample_id))
+            
+            self.storage.write_many('''
+                UPDATE learning_data SET feature_vector = ?, schema_fingerprint = ? WHERE id = ?
+            ''', updates)
+            migrated += len(updates)
+        
+        if migrated:
+            logger.info(f"Migrated {migrated} JSON learning samples to feature vectors")
+        self.json_samples_pending = False
+        return migrated
     
     def _schedule_retraining(self):
         """Schedule background retraining"""
         if self.retrain_thread and self.retrain_thread.is_alive():
             return
         
+        with self.buffer_lock:
+            self.samples_since_retrain = 0
         self.retrain_thread = threading.Thread(target=self._retrain_models_background)
         self.retrain_thread.daemon = True
         self.retrain_thread.start()
@@ -216,19 +363,12 @@ class ContinuousLearningSystem:
         """Retrain models with new data"""
         try:
             # Get recent training data
-            recent_samples = self._get_recent_samples(self.retrain_threshold * 2)
+            X, y = self._load_training_matrix(self.retrain_threshold * 2)
             
-            if len(recent_samples) < self.retrain_threshold:
+            if len(y) < self.retrain_threshold:
                 logger.warning("Not enough samples for retraining")
                 return False
             
-            # Prepare training data
-            X, y = self._prepare_training_data(recent_samples)
-            
-            if X is None or y is None:
-                logger.error("Failed to prepare training data")
-                return False
-            
             # Train new model
             new_model, new_scaler = self._train_new_model(X, y)
             
@@ -245,13 +385,13 @@ class ContinuousLearningSystem:
             
             if improvement >= self.min_accuracy_improvement:
                 # Save new model
-                version_id = self._save_model_version(new_model, new_scaler, accuracy)
+                bundle = self._save_model_version(new_model, new_scaler, accuracy)
                 
                 # Update active model
-                self._update_active_model(new_model, new_scaler)
+                self._update_active_model(bundle)
                 
                 # Log retraining
-                self._log_retraining(version_id, improvement, len(recent_samples), True)
+                self._log_retraining(bundle.version, improvement, len(y), True)
                 
                 logger.info(f"Model retrained successfully. Accuracy improved by {improvement:.3f}")
                 return True
@@ -264,61 +404,6 @@ class ContinuousLearningSystem:
             self._log_retraining(None, 0, 0, False, str(e))
             return False
     
-    def _prepare_training_data(self, samples: List[Dict]) -> Tuple[np.ndarray, np.ndarray]:
-        """Prepare training data from samples"""
-        try:
-            features_list = []
-            targets = []
-            
-            for sample in samples:
-                features = sample['features']
-                target = sample['target_value']
-                
-                # Convert features to array
-                feature_array = self._features_to_array(features)
-                if feature_array is not None:
-                    features_list.append(feature_array)
-                    targets.append(target)
-            
-            if not features_list:
-                return None, None
-            
-            X = np.array(features_list)
-            y = np.array(targets)
-            
-            return X, y
-            
-        except Exception as e:
-            logger.error(f"Error preparing training data: {e}")
-            return None, None
-    
-    def _features_to_array(self, features: Dict) -> Optional[np.ndarray]:
-        """Convert features dictionary to numpy array"""
-        try:
-            # Define expected feature order (should match training)
-            feature_order = [
-                'emotion_count', 'has_note', 'hour', 'day_of_week', 'is_weekend',
-                'emotion_happy', 'emotion_sad', 'emotion_anxious', 'emotion_calm',
-                'emotion_excited', 'emotion_frustrated', 'emotion_grateful',
-                'emotion_lonely', 'emotion_confident', 'emotion_overwhelmed',
-                'emotion_peaceful', 'emotion_angry', 'sentiment_positive',
-                'sentiment_negative', 'sentiment_neutral', 'polarity', 'subjectivity'
-            ]
-            
-            feature_array = []
-            for feature in feature_order:
-                value = features.get(feature, 0)
-                if isinstance(value, (int, float)):
-                    feature_array.append(value)
-                else:
-                    feature_array.append(0)
-            
-            return np.array(feature_array)
-            
-        except Exception as e:
-            logger.error(f"Error converting features to array: {e}")
-            return None
-    
     def _train_new_model(self, X: np.ndarray, y: np.ndarray) -> Tuple[Any, Any]:
         """Train new model with given data"""
         try:
@@ -358,10 +443,8 @@ class ContinuousLearningSystem:
     def _get_current_model_accuracy(self) -> float:
         """Get current model accuracy"""
         # Get recent predictions and actual values
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        self.flush_samples()
+        results = self.storage.read('''
             SELECT target_value, prediction
             FROM learning_data
             WHERE prediction IS NOT NULL
@@ -369,9 +452,6 @@ class ContinuousLearningSystem:
             LIMIT 100
         ''')
         
-        results = cursor.fetchall()
-        conn.close()
-        
         if not results:
             return 0.5  # Default accuracy
         
@@ -382,123 +462,96 @@ class ContinuousLearningSystem:
         correct = sum(1 for a, p in zip(actual, predicted) if abs(a - p) <= 1)
         return correct / len(actual)
     
-    def _save_model_version(self, model: Any, scaler: Any, accuracy: float) -> str:
-        """Save new model version"""
+    def _save_model_version(self, model: Any, scaler: Any, accuracy: float):
+        """Publish the new model version through the registry and record it"""
         version_id = f"v{datetime.now().strftime('%Y%m%d_%H%M%S')}"
         
-        # Save model files
-        model_path = os.path.join(self.models_dir, f"mood_predictor_{version_id}.joblib")
-        scaler_path = os.path.join(self.models_dir, f"scaler_{version_id}.joblib")
-        
-        joblib.dump(model, model_path)
-        joblib.dump(scaler, scaler_path)
+        # The registry writes the artifacts once, under versions/<version_id>/
+        bundle = self.model_registry.publish(model, scaler, version_id)
+        model_path = self.model_registry.version_path(bundle.version)
         
         # Save to database
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Deactivate previous models
-        cursor.execute('UPDATE model_versions SET is_active = FALSE WHERE model_type = "mood_predictor"')
-        
-        # Add new model version
-        cursor.execute('''
-            INSERT INTO model_versions
-            (version_id, model_type, accuracy, created_date, file_path, is_active)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (version_id, "mood_predictor", accuracy, datetime.now().isoformat(), model_path, True))
+        def record_version(conn):
+            # Deactivate previous models
+            conn.execute('UPDATE model_versions SET is_active = FALSE WHERE model_type = "mood_predictor"')
+            
+            # Add new model version
+            conn.execute('''
+                INSERT INTO model_versions
+                (version_id, model_type, accuracy, created_date, file_path, is_active)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (version_id, "mood_predictor", accuracy, datetime.now().isoformat(), model_path, True))
         
-        conn.commit()
-        conn.close()
+        self.storage.transaction(record_version)
         
-        return version_id
+        return bundle
     
-    def _update_active_model(self, model: Any, scaler: Any):
-        """Update active model in memory"""
-        # Update model files
-        joblib.dump(model, os.path.join(self.models_dir, "mood_predictor.joblib"))
-        joblib.dump(scaler, os.path.join(self.models_dir, "scaler.joblib"))
-        
+    def _update_active_model(self, bundle):
+        """Track the version serving components have swapped to"""
         # Update tracking
         self.last_retrain = datetime.now()
         self.model_versions["mood_predictor"] = {
-            'model': model,
-            'scaler': scaler,
+            'version': bundle.version,
             'last_updated': self.last_retrain
         }
     
     def _log_retraining(self, version_id: str, improvement: float, samples_used: int, 
                        success: bool, error_message: str = None):
         """Log retraining attempt"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        self.storage.write('''
             INSERT INTO retraining_log
             (version_id, accuracy_improvement, samples_used, retrain_date, success, error_message)
             VALUES (?, ?, ?, ?, ?, ?)
         ''', (version_id, improvement, samples_used, datetime.now().isoformat(), success, error_message))
-        
-        conn.commit()
-        conn.close()
     
     def load_latest_models(self):
-        """Load latest trained models"""
+        """Load latest trained models (shared with serving through the registry)"""
         try:
-            model_path = os.path.join(self.models_dir, "mood_predictor.joblib")
-            scaler_path = os.path.join(self.models_dir, "scaler.joblib")
+            bundle = self.model_registry.current() or self.model_registry.load()
             
-            if os.path.exists(model_path) and os.path.exists(scaler_path):
-                model = joblib.load(model_path)
-                scaler = joblib.load(scaler_path)
-                
+            if bundle is not None:
                 self.model_versions["mood_predictor"] = {
-                    'model': model,
-                    'scaler': scaler,
-                    'last_updated': datetime.now()
+                    'version': bundle.version,
+                    'last_updated': bundle.published_at
                 }
                 
-                logger.info("Latest models loaded successfully")
+                logger.info(f"Latest model {bundle.version} loaded successfully")
             else:
                 logger.warning("No trained models found")
                 
+        except FeatureSchemaMismatch as e:
+            logger.error(f"Not loading models: {e}")
         except Exception as e:
             logger.error(f"Error loading models: {e}")
     
     def get_learning_insights(self) -> Dict:
         """Get insights about the learning system"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        self.flush_samples()
         
         # Get total samples
-        cursor.execute('SELECT COUNT(*) FROM learning_data')
-        total_samples = cursor.fetchone()[0]
+        total_samples = self.storage.read_one('SELECT COUNT(*) FROM learning_data')[0]
         
         # Get recent samples
-        cursor.execute('''
+        recent_samples = self.storage.read_one('''
             SELECT COUNT(*) FROM learning_data
             WHERE timestamp > datetime('now', '-7 days')
-        ''')
-        recent_samples = cursor.fetchone()[0]
+        ''')[0]
         
         # Get model versions
-        cursor.execute('''
+        model_versions = self.storage.read('''
             SELECT version_id, accuracy, created_date, is_active
             FROM model_versions
             ORDER BY created_date DESC
             LIMIT 5
         ''')
-        model_versions = cursor.fetchall()
         
         # Get retraining history
-        cursor.execute('''
+        retraining_history = self.storage.read('''
             SELECT accuracy_improvement, samples_used, retrain_date, success
             FROM retraining_log
             ORDER BY retrain_date DESC
             LIMIT 10
         ''')
-        retraining_history = cursor.fetchall()
-        
-        conn.close()
         
         return {
             'total_samples': total_samples,
@@ -522,7 +575,8 @@ class ContinuousLearningSystem:
                 for row in retraining_history
             ],
             'last_retrain': self.last_retrain.isoformat() if self.last_retrain else None,
-            'buffer_size': len(self.data_buffer)
+            'buffer_size': len(self.data_buffer),
+            'samples_since_retrain': self.samples_since_retrain
         }
     
     def start_continuous_learning(self):
@@ -616,6 +670,18 @@ def test_continuous_learning_system():
     success = learning_system.retrain_models()
     print(f"   Retraining success: {success}")
     
+    # A saved version is published once through the registry; its row points at the version directory
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.preprocessing import StandardScaler
+    X, y = learning_system._load_training_matrix(100)
+    scaler = StandardScaler().fit(X)
+    bundle = learning_system._save_model_version(
+        RandomForestClassifier(n_estimators=5, random_state=0).fit(scaler.transform(X), y), scaler, 0.5)
+    version, file_path = learning_system.storage.read_one(
+        'SELECT version_id, file_path FROM model_versions WHERE is_active')
+    assert version == bundle.version and file_path == learning_system.model_registry.version_path(version)
+    assert sorted(os.listdir("test_models")) == ["active_model.json", "versions"]
+    
     # Get insights
     print("📈 Learning System Insights:")
     insights = learning_system.get_learning_insights()
@@ -623,16 +689,61 @@ def test_continuous_learning_system():
     print(f"   Recent samples: {insights['recent_samples']}")
     print(f"   Model versions: {len(insights['model_versions'])}")
     print(f"   Buffer size: {insights['buffer_size']}")
+    assert insights['total_samples'] == 100  # buffered samples are flushed before reading
+    
+    # Rows from before feature vectors (JSON only) are converted on the next read
+    learning_system.storage.write('''
+        INSERT INTO learning_data (user_id, features, target_value, timestamp, data_type)
+        VALUES (?, ?, ?, ?, ?)
+    ''', ("user_legacy", json.dumps({'emotion_count': 2, 'hour': 9}), 6, datetime.now().isoformat(), "mood_entry"))
+    learning_system.json_samples_pending = True
+    X, y = learning_system._load_training_matrix(1000)
+    assert X.shape == (101, FEATURE_SCHEMA.size) and X.dtype == np.float32 and len(y) == 101
+    assert learning_system.storage.read_one(
+        'SELECT COUNT(*) FROM learning_data WHERE feature_vector IS NULL')[0] == 0
+    legacy = learning_system.storage.read_one(
+        'SELECT feature_vector FROM learning_data WHERE user_id = ?', ("user_legacy",))[0]
+    assert FEATURE_SCHEMA.to_dict(np.frombuffer(legacy, dtype=np.float32))['hour'] == 9
+    print(f"   Training matrix: {X.shape[0]} x {X.shape[1]} float32")
+    
+    # Hot queries are index lookups, not table scans
+    storage = learning_system.storage
+    assert storage.schema_version('continuous_learning') == len(MIGRATIONS)
+    for sql, params in [
+        ('''SELECT feature_vector, target_value FROM learning_data WHERE schema_fingerprint = ?
+            ORDER BY timestamp DESC LIMIT ?''', (FEATURE_SCHEMA.fingerprint, 100)),
+        ('''SELECT user_id, features, target_value FROM learning_data ORDER BY timestamp DESC LIMIT ?''', (100,)),
+        ('''SELECT target_value, prediction FROM learning_data WHERE prediction IS NOT NULL
+            ORDER BY timestamp DESC LIMIT 100''', ()),
+        ('''SELECT id, features FROM learning_data WHERE feature_vector IS NULL LIMIT ?''', (500,)),
+        ('''SELECT COUNT(*) FROM learning_data WHERE timestamp > datetime('now', '-7 days')''', ()),
+    ]:
+        assert storage.uses_index(sql, params), storage.explain_query_plan(sql, params)
+    
+    # While flushes fail, the retry buffer keeps only the newest samples
+    def unavailable(sql, rows):
+        raise sqlite3.OperationalError("disk I/O error")
+    
+    import sqlite3
+    learning_system.max_pending_samples = 3
+    learning_system.storage.write_many = unavailable
+    for i in range(5):
+        learning_system.add_training_sample(f"user_offline_{i}", {'emotion_count': 1}, 5)
+    assert learning_system.flush_samples() == 0
+    del learning_system.storage.write_many
+    assert [row[0] for row in learning_system.pending_samples] == [f"user_offline_{i}" for i in (2, 3, 4)]
+    assert learning_system.flush_samples() == 3
     
-    # Clean up
-    learning_system.stop_continuous_learning()
+    # Samples still buffered at shutdown are written by close()
+    learning_system.add_training_sample("user_late", {'emotion_count': 1}, 5)
+    learning_system.close()
+    assert learning_system.storage.read_one('SELECT COUNT(*) FROM learning_data')[0] == 105
     
     # Clean up test files
     import shutil
     if os.path.exists("test_models"):
         shutil.rmtree("test_models")
-    if os.path.exists("test_learning.db"):
-        os.remove("test_learning.db")
+    remove_database("test_learning.db")
     
     print("✅ Continuous learning system test completed!")
     
@@ -14,6 +14,8 @@ import json
 # Import all enhancement modules
 from enhanced_ml_system import EnhancedMentalHealthML
 from enhanced_recommendations import EnhancedMentalHealthRecommendations
+from sentiment_service import get_sentiment_service
+from mood_history import entry_timestamp
 
 # Configure logging
 logging.basicConfig(
@@ -91,19 +93,14 @@ def analyze_sentiment():
         if enhanced_ml is None:
             return jsonify({'error': 'ML system not available'}), 500
         
-        # Use enhanced sentiment analysis
-        from textblob import TextBlob
-        from nltk.sentiment import SentimentIntensityAnalyzer
+        # VADER and TextBlob scores via the shared sentiment cache
+        scores = get_sentiment_service().scores(text)
+        vader_scores = scores['vader']
+        polarity = scores['polarity']
+        subjectivity = scores['subjectivity']
         
-        # Initialize sentiment analyzer
-        try:
-            sia = SentimentIntensityAnalyzer()
-        except:
+        if vader_scores is None:
             # Fallback to TextBlob only
-            blob = TextBlob(text)
-            polarity = blob.sentiment.polarity
-            subjectivity = blob.sentiment.subjectivity
-            
             if polarity >= 0.1:
                 sentiment = "positive"
                 confidence = polarity
@@ -122,14 +119,6 @@ def analyze_sentiment():
                 'method': 'textblob_fallback'
             })
         
-        # VADER sentiment analysis
-        vader_scores = sia.polarity_scores(text)
-        
-        # TextBlob sentiment analysis
-        blob = TextBlob(text)
-        polarity = blob.sentiment.polarity
-        subjectivity = blob.sentiment.subjectivity
-        
         # Determine overall sentiment
         if vader_scores['compound'] >= 0.05:
             sentiment = "positive"
@@ -168,8 +157,11 @@ def predict_mood():
         note = data.get('note', '')
         time_context = data.get('time_context')
         user_id = data.get('user_id')
+        mood = data.get('mood')  # the mood the user logged with this entry, if any
         
         if enhanced_ml is None or not enhanced_ml.models_loaded:
+            if enhanced_ml is not None and user_id and mood is not None:
+                enhanced_ml.record_mood_entry(user_id, mood)
             return jsonify({
                 'error': 'Enhanced ML system not available',
                 'fallback_available': True
@@ -180,7 +172,8 @@ def predict_mood():
             emotions=emotions,
             note=note,
             time_context=time_context,
-            user_id=user_id
+            user_id=user_id,
+            mood=mood
         )
         
         return jsonify(prediction)
@@ -189,6 +182,29 @@ def predict_mood():
         logger.error(f"Mood prediction error: {e}")
         return jsonify({'error': str(e)}), 500
 
+# Mood logging endpoint: keeps each user's rolling history current for prediction
+@app.route('/api/mood-entry', methods=['POST'])
+def record_mood_entry():
+    """Record a logged mood in the user's history"""
+    try:
+        data = request.get_json()
+        user_id = data.get('user_id')
+        mood = data.get('mood')
+        
+        if not user_id or mood is None:
+            return jsonify({'error': 'user_id and mood are required'}), 400
+        if enhanced_ml is None:
+            return jsonify({'error': 'Enhanced ML system not available'}), 503
+        
+        timestamp = data.get('timestamp')
+        enhanced_ml.record_mood_entry(user_id, mood, entry_timestamp({'timestamp': timestamp}))
+        
+        return jsonify({'recorded': True, 'user_id': user_id})
+        
+    except Exception as e:
+        logger.error(f"Mood entry error: {e}")
+        return jsonify({'error': str(e)}), 500
+
 # Enhanced recommendations endpoint
 @app.route('/api/recommendations', methods=['POST'])
 def get_recommendations():
@@ -90,6 +90,7 @@ class EnhancedDataGenerator:
         
         for i in range(num_profiles):
             profile = {
+                'user_id': f"user_{i:03d}",
                 'age_group': random.choice(self.demographics['age_groups']),
                 'gender': random.choice(self.demographics['genders']),
                 'occupation': random.choice(self.demographics['occupations']),
@@ -153,6 +154,7 @@ class EnhancedDataGenerator:
         context = self._generate_context(profile, entry_date, mood)
         
         return {
+            'user_id': profile['user_id'],
             'mood': mood,
             'emotions': emotions,
             'date': {
@@ -15,6 +15,11 @@ from typing import Dict, List, Any, Optional
 # Import all the enhancement modules
 from enhanced_data_generator import EnhancedDataGenerator
 from advanced_feature_engineering import AdvancedFeatureEngineer
+from mood_history import MoodHistoryTracker, entry_timestamp
+from feature_schema import FEATURE_SCHEMA, FeatureSchemaMismatch
+from micro_batcher import batcher_from_env
+from model_registry import get_model_registry
+from sqlite_storage import remove_database
 from feedback_system import FeedbackSystem
 from ab_testing_framework import ABTestingFramework
 from continuous_learning_system import ContinuousLearningSystem
@@ -34,14 +39,17 @@ class EnhancedMentalHealthML:
         # Initialize all components
         self.data_generator = EnhancedDataGenerator()
         self.feature_engineer = AdvancedFeatureEngineer()
+        self.model_registry = get_model_registry(models_dir)
         self.feedback_system = FeedbackSystem(f"{db_path}_feedback")
         self.ab_framework = ABTestingFramework(f"{db_path}_ab")
-        self.learning_system = ContinuousLearningSystem(models_dir, f"{db_path}_learning")
+        self.learning_system = ContinuousLearningSystem(models_dir, f"{db_path}_learning",
+                                                        model_registry=self.model_registry)
+        self.mood_history = MoodHistoryTracker(f"{db_path}_history")
         self.recommendations = EnhancedMentalHealthRecommendations()
         
-        # Model state
-        self.models_loaded = False
-        self.current_models = {}
+        # Concurrent predictions share one predict_proba call per micro-batch
+        self.prediction_batcher = batcher_from_env(self._predict_rows, name="mood-prediction")
+        self.prediction_timeout = 10
         
         # Initialize
         self._initialize_system()
@@ -56,29 +64,37 @@ class EnhancedMentalHealthML:
         # Load existing models
         self._load_models()
         
+        # Pick up models published by retraining in other processes
+        self.model_registry.start_watching()
+        
         # Start continuous learning
         self.learning_system.start_continuous_learning()
         
         logger.info("Enhanced ML System initialized successfully")
     
+    @property
+    def models_loaded(self):
+        """Whether the shared registry holds a model to serve"""
+        return self.model_registry.current() is not None
+    
     def _load_models(self):
-        """Load existing trained models"""
+        """Load existing trained models into the shared registry"""
         try:
-            model_path = os.path.join(self.models_dir, "mood_predictor.joblib")
-            scaler_path = os.path.join(self.models_dir, "scaler.joblib")
+            if self.model_registry.current() is not None:
+                logger.info(f"Using model {self.model_registry.version} already loaded in this process")
+                return
             
-            if os.path.exists(model_path) and os.path.exists(scaler_path):
-                import joblib
-                self.current_models['mood_predictor'] = joblib.load(model_path)
-                self.current_models['scaler'] = joblib.load(scaler_path)
-                self.models_loaded = True
-                logger.info("Existing models loaded successfully")
+            # Refuses artifacts built for a different feature layout
+            bundle = self.model_registry.load()
+            if bundle is not None:
+                logger.info(f"Existing model {bundle.version} loaded successfully")
             else:
                 logger.info("No existing models found, will train new ones")
                 
+        except FeatureSchemaMismatch as e:
+            logger.error(f"Not loading models: {e}")
         except Exception as e:
             logger.error(f"Error loading models: {e}")
-            self.models_loaded = False
     
     def generate_enhanced_training_data(self, num_mood_entries=500, num_journal_entries=200):
         """Generate enhanced training data with diverse patterns"""
@@ -100,23 +116,25 @@ class EnhancedMentalHealthML:
         """Train models with enhanced features and data"""
         logger.info("Training enhanced models...")
         
-        # Extract comprehensive features
-        features_df = self.feature_engineer.extract_comprehensive_features(
-            mood_entries, journal_entries
+        if not mood_entries:
+            logger.error("No target values found for training")
+            return False
+        
+        # Extract features in one vectorized batch, laid out by the feature schema
+        history_tracker = MoodHistoryTracker()
+        X, feature_names = self.feature_engineer.extract_features_batch(
+            mood_entries, journal_entries, history_tracker=history_tracker, schema=FEATURE_SCHEMA
         )
+        y = np.array([entry.get('mood', 5) for entry in mood_entries])
+        # history_tracker stays in memory: training users never reach the serving history store
         
-        logger.info(f"Extracted {len(features_df.columns)} features")
+        logger.info(f"Extracted {len(feature_names)} features")
         
-        # Prepare features for training
-        X_scaled, y, feature_names = self.feature_engineer.prepare_features_for_training(features_df)
-        
-        if y is None:
-            logger.error("No target values found for training")
-            return False
+        # Scale features
+        X_scaled = self.feature_engineer.scaler.fit_transform(X)
         
         # Train model
         from sklearn.ensemble import RandomForestClassifier
-        import joblib
         
         model = RandomForestClassifier(
             n_estimators=200,
@@ -133,21 +151,14 @@ class EnhancedMentalHealthML:
         train_accuracy = model.score(X_scaled, y)
         logger.info(f"Training accuracy: {train_accuracy:.3f}")
         
-        # Save models
-        os.makedirs(self.models_dir, exist_ok=True)
-        joblib.dump(model, os.path.join(self.models_dir, "mood_predictor.joblib"))
-        joblib.dump(self.feature_engineer.scaler, os.path.join(self.models_dir, "scaler.joblib"))
-        
-        # Update current models
-        self.current_models['mood_predictor'] = model
-        self.current_models['scaler'] = self.feature_engineer.scaler
-        self.models_loaded = True
+        # Save and publish: every component and worker switches to the new bundle
+        self.model_registry.publish(model, self.feature_engineer.scaler)
         
         # Add training samples to learning system
-        for i, (features, target) in enumerate(zip(features_df.to_dict('records'), y)):
+        for i, (row, target) in enumerate(zip(X, y.tolist())):
             self.learning_system.add_training_sample(
                 user_id=f"training_sample_{i}",
-                features=features,
+                features=row,
                 target_value=target,
                 data_type="training"
             )
@@ -155,33 +166,38 @@ class EnhancedMentalHealthML:
         logger.info("Enhanced models trained and saved successfully")
         return True
     
-    def predict_mood_enhanced(self, emotions, note="", time_context=None, user_id=None):
-        """Enhanced mood prediction with all improvements"""
+    def predict_mood_enhanced(self, emotions, note="", time_context=None, user_id=None, mood=None):
+        """Enhanced mood prediction with all improvements
+        
+        ``mood`` is the mood the user logged with this entry, if any. It is
+        folded into the user's history after the prediction, so later entries
+        get the same history features the model was trained on.
+        """
+        try:
+            return self._predict_mood_enhanced(emotions, note, time_context, user_id)
+        finally:
+            if user_id and mood is not None:
+                self.record_mood_entry(user_id, mood, entry_timestamp({'date': time_context or {}}))
+    
+    def _predict_mood_enhanced(self, emotions, note, time_context, user_id):
         if not self.models_loaded:
             return self._fallback_prediction(emotions, note)
         
         try:
-            # Prepare features using enhanced feature engineering
-            features = self._prepare_prediction_features(emotions, note, time_context)
-            
-            # Convert to array format
-            feature_array = self._convert_features_to_array(features)
-            if feature_array is None:
-                return self._fallback_prediction(emotions, note)
-            
-            # Scale features
-            feature_array_scaled = self.current_models['scaler'].transform([feature_array])
+            # Prepare a schema-ordered feature row
+            feature_array = self._prepare_prediction_features(emotions, note, time_context, user_id)
             
-            # Predict
-            prediction = self.current_models['mood_predictor'].predict(feature_array_scaled)[0]
-            probabilities = self.current_models['mood_predictor'].predict_proba(feature_array_scaled)[0]
-            confidence = max(probabilities)
+            # Predict (label and confidence come from the batch's predict_proba)
+            prediction, probabilities, classes = self.prediction_batcher.process(
+                feature_array, timeout=self.prediction_timeout
+            )
+            confidence = float(probabilities.max())
             
             # Record prediction for learning
             if user_id:
                 self.learning_system.add_training_sample(
                     user_id=user_id,
-                    features=features,
+                    features=feature_array,
                     target_value=prediction,
                     prediction=prediction,
                     confidence=confidence,
@@ -192,7 +208,7 @@ class EnhancedMentalHealthML:
                 'predicted_mood': int(prediction),
                 'confidence': float(confidence),
                 'probabilities': {
-                    str(i+1): float(prob) for i, prob in enumerate(probabilities)
+                    str(label): float(prob) for label, prob in zip(classes, probabilities)
                 },
                 'method': 'enhanced_ml'
             }
@@ -201,8 +217,18 @@ class EnhancedMentalHealthML:
             logger.error(f"Error in enhanced prediction: {e}")
             return self._fallback_prediction(emotions, note)
     
-    def _prepare_prediction_features(self, emotions, note, time_context):
-        """Prepare features for prediction"""
+    def _predict_rows(self, rows):
+        """Score a micro-batch of feature rows with a single predict_proba call"""
+        # One bundle for the whole batch, even if a new version is published meanwhile
+        bundle = self.model_registry.current()
+        
+        probabilities = bundle.predict_proba(np.stack(rows))
+        classes = bundle.classes_.tolist()
+        labels = bundle.classes_[probabilities.argmax(axis=1)].tolist()
+        return [(int(label), row, classes) for label, row in zip(labels, probabilities)]
+    
+    def _prepare_prediction_features(self, emotions, note, time_context, user_id=None):
+        """Prepare a FEATURE_SCHEMA row for prediction"""
         # Create a mock entry for feature extraction
         mock_entry = {
             'mood': 5,  # Will be predicted
@@ -229,50 +255,18 @@ class EnhancedMentalHealthML:
             }
         }
         
-        # Extract features
-        features = self.feature_engineer._extract_mood_features(mock_entry)
-        return features
+        # Mood history features from the user's rolling state
+        history = self.mood_history.features(user_id, entry_timestamp(mock_entry))
+        
+        # Extract features straight into the schema row
+        return self.feature_engineer.extract_feature_row(mock_entry, history)
     
-    def _convert_features_to_array(self, features):
-        """Convert features dictionary to numpy array"""
+    def record_mood_entry(self, user_id, mood, timestamp=None):
+        """Fold a logged mood into the user's history state (O(1) per entry)"""
         try:
-            # Define expected feature order (should match training)
-            feature_order = [
-                'emotion_count', 'has_note', 'hour', 'day_of_week', 'is_weekend',
-                'is_morning', 'is_afternoon', 'is_evening', 'is_night', 'month', 'season',
-                'hour_sin', 'hour_cos', 'day_sin', 'day_cos', 'month_sin', 'month_cos',
-                'emotion_happy', 'emotion_sad', 'emotion_anxious', 'emotion_calm',
-                'emotion_excited', 'emotion_frustrated', 'emotion_grateful',
-                'emotion_lonely', 'emotion_confident', 'emotion_overwhelmed',
-                'emotion_peaceful', 'emotion_angry', 'positive_emotion_count',
-                'negative_emotion_count', 'neutral_emotion_count', 'emotion_diversity',
-                'emotion_intensity', 'text_length', 'word_count', 'sentence_count',
-                'avg_word_length', 'sentiment_positive', 'sentiment_negative',
-                'sentiment_neutral', 'sentiment_compound', 'polarity', 'subjectivity',
-                'readability_score', 'emotional_words_count', 'question_marks',
-                'exclamation_marks', 'capital_letters', 'pronoun_count', 'negative_words',
-                'positive_words', 'sleep_quality', 'exercise_today', 'social_interaction',
-                'work_stress', 'medication_taken', 'therapy_session', 'crisis_thoughts',
-                'has_condition', 'life_stress_level', 'social_support', 'age_group_encoded',
-                'occupation_encoded', 'living_situation_encoded', 'mood_trend',
-                'mood_volatility', 'entry_frequency', 'mood_momentum', 'mood_consistency',
-                'mood_recovery', 'journal_entries_today', 'total_journal_length',
-                'avg_journal_sentiment'
-            ]
-            
-            feature_array = []
-            for feature in feature_order:
-                value = features.get(feature, 0)
-                if isinstance(value, (int, float)):
-                    feature_array.append(value)
-                else:
-                    feature_array.append(0)
-            
-            return np.array(feature_array)
-            
+            self.mood_history.update(user_id, mood, timestamp or datetime.now())
         except Exception as e:
-            logger.error(f"Error converting features to array: {e}")
-            return None
+            logger.error(f"Error recording mood entry for {user_id}: {e}")
     
     def _fallback_prediction(self, emotions, note):
         """Fallback prediction when models are not available"""
@@ -342,7 +336,7 @@ class EnhancedMentalHealthML:
     def _apply_ab_testing(self, recommendations, user_id):
         """Apply A/B testing to recommendations"""
         # Check for active recommendation experiments
-        active_experiments = self.ab_framework.list_active_experiments()
+        active_experiments = self.ab_framework.active_experiment_snapshot()
         
         for experiment in active_experiments:
             if experiment['status'] == 'active' and 'recommendation' in experiment['name'].lower():
@@ -380,7 +374,7 @@ class EnhancedMentalHealthML:
         )
         
         # Record A/B testing event
-        active_experiments = self.ab_framework.list_active_experiments()
+        active_experiments = self.ab_framework.active_experiment_snapshot()
         for experiment in active_experiments:
             if experiment['status'] == 'active':
                 self.ab_framework.record_event(
@@ -395,14 +389,25 @@ class EnhancedMentalHealthML:
         """Get comprehensive system insights"""
         insights = {
             'models_loaded': self.models_loaded,
+            'model': self.model_registry.get_status(),
             'learning_insights': self.learning_system.get_learning_insights(),
             'feedback_insights': self.feedback_system.get_feedback_insights(),
             'active_experiments': self.ab_framework.list_active_experiments(),
+            'sentiment_cache': self.feature_engineer.sentiment_service.get_stats(),
+            'prediction_batching': self.prediction_batcher.get_stats(),
             'system_status': 'healthy' if self.models_loaded else 'needs_training'
         }
         
         return insights
     
+    def cleanup(self):
+        """Stop background work and flush buffered learning samples, exposures and preferences"""
+        self.learning_system.close()
+        self.ab_framework.close()
+        self.feedback_system.close()
+        self.model_registry.stop_watching()
+        self.prediction_batcher.close()
+    
     def run_full_training_pipeline(self):
         """Run the complete training pipeline with all enhancements"""
         logger.info("Starting full training pipeline...")
@@ -467,6 +472,37 @@ def test_enhanced_ml_system():
         )
         print(f"   Prediction: {prediction}")
         
+        # Logged moods feed the user's history; the synthetic training users are never persisted
+        assert enhanced_ml.mood_history.storage.read_one(
+            'SELECT COUNT(*) FROM mood_history_state WHERE user_id LIKE ?', ('user_%',)
+        )[0] == 0
+        for day, logged_mood in enumerate((3, 6, 8), start=1):
+            enhanced_ml.predict_mood_enhanced(['Calm'], 'Evening check-in', user_id='test_user_002', mood=logged_mood,
+                                              time_context={'year': 2026, 'month': 3, 'day': day, 'hour': 20})
+        history = enhanced_ml.mood_history.features('test_user_002')
+        assert history['mood_trend'] > 0 and history['mood_volatility'] > 0, history
+        print(f"   History after 3 logged moods: {history}")
+        
+        # Concurrent predictions are served in micro-batches
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(16) as pool:
+            concurrent_predictions = list(pool.map(
+                lambda i: enhanced_ml.predict_mood_enhanced(['Calm'], f'Note {i}'), range(64)
+            ))
+        assert all(p['method'] == 'enhanced_ml' for p in concurrent_predictions)
+        print(f"   Batching: {enhanced_ml.prediction_batcher.get_stats()}")
+        
+        # The published (compiled) bundle reproduces the sklearn model exactly (sequential sklearn run)
+        import joblib
+        rows = np.stack([enhanced_ml._prepare_prediction_features(['Sad'], f'Note {i}', None) for i in range(16)])
+        bundle = enhanced_ml.model_registry.current()
+        version_dir = enhanced_ml.model_registry.version_path(bundle.version)
+        model = joblib.load(os.path.join(version_dir, "mood_predictor.joblib"))
+        scaler = joblib.load(os.path.join(version_dir, "scaler.joblib"))
+        model.n_jobs = 1
+        assert np.array_equal(bundle.predict_proba(rows), model.predict_proba(scaler.transform(rows)))
+        print(f"   Model {bundle.version} matches predict_proba ({bundle.model.n_estimators} trees)")
+        
         # Test enhanced recommendations
         print("\n💡 Testing enhanced recommendations...")
         recommendations = enhanced_ml.get_enhanced_recommendations(
@@ -502,16 +538,15 @@ def test_enhanced_ml_system():
         print("❌ Full training pipeline failed")
     
     # Clean up
-    enhanced_ml.learning_system.stop_continuous_learning()
+    enhanced_ml.cleanup()
     
     # Clean up test files
     import shutil
     if os.path.exists("test_enhanced_models"):
         shutil.rmtree("test_enhanced_models")
     for db_file in ["test_enhanced.db", "test_enhanced.db_feedback", 
-                   "test_enhanced.db_ab", "test_enhanced.db_learning"]:
-        if os.path.exists(db_file):
-            os.remove(db_file)
+                   "test_enhanced.db_ab", "test_enhanced.db_learning", "test_enhanced.db_history"]:
+        remove_database(db_file)
     
     print("\n🎉 Enhanced ML system test completed!")
     
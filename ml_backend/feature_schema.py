@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Feature Schema for Mental Health Companion
+Single, versioned definition of the model's feature columns shared by training, inference and retraining
+"""
+
+import json
+import hashlib
+import os
+import numpy as np
+from typing import Dict, List, Optional
+
+# Bump whenever the meaning of an existing column changes
+SCHEMA_VERSION = 1
+SCHEMA_FILENAME = "feature_schema.json"
+
+# Emotion vocabulary shared by the per-row and batch extractors
+ALL_EMOTIONS = ['Happy', 'Sad', 'Anxious', 'Calm', 'Excited', 'Frustrated',
+                'Grateful', 'Lonely', 'Confident', 'Overwhelmed', 'Peaceful', 'Angry']
+EMOTION_CATEGORIES = {
+    'positive': ['Happy', 'Excited', 'Grateful', 'Confident', 'Peaceful'],
+    'negative': ['Sad', 'Anxious', 'Frustrated', 'Lonely', 'Overwhelmed', 'Angry'],
+    'neutral': ['Calm', 'Peaceful']
+}
+
+# Column groups in the order _extract_mood_features emits them
+TARGET_COLUMN = 'mood'
+BASE_COLUMNS = [TARGET_COLUMN, 'emotion_count', 'has_note']
+TEMPORAL_COLUMNS = ['hour', 'day_of_week', 'is_weekend', 'is_morning', 'is_afternoon',
+                    'is_evening', 'is_night', 'month', 'season']
+CYCLICAL_COLUMNS = ['hour_sin', 'hour_cos', 'day_sin', 'day_cos', 'month_sin', 'month_cos']
+EMOTION_COLUMNS = ([f'emotion_{emotion.lower()}' for emotion in ALL_EMOTIONS] +
+                   [f'{category}_emotion_count' for category in EMOTION_CATEGORIES] +
+                   ['emotion_diversity', 'emotion_intensity'])
+TEXT_COLUMNS = ['text_length', 'word_count', 'sentence_count', 'avg_word_length',
+                'sentiment_positive', 'sentiment_negative', 'sentiment_neutral',
+                'sentiment_compound', 'polarity', 'subjectivity', 'readability_score',
+                'emotional_words_count', 'question_marks', 'exclamation_marks',
+                'capital_letters', 'pronoun_count', 'negative_words', 'positive_words']
+CONTEXT_COLUMNS = ['sleep_quality', 'exercise_today', 'social_interaction', 'work_stress',
+                   'medication_taken', 'therapy_session', 'crisis_thoughts']
+PROFILE_COLUMNS = ['has_condition', 'life_stress_level', 'social_support',
+                   'age_group_encoded', 'occupation_encoded', 'living_situation_encoded']
+HISTORY_COLUMNS = ['mood_trend', 'mood_volatility', 'entry_frequency',
+                   'mood_momentum', 'mood_consistency', 'mood_recovery']
+JOURNAL_COLUMNS = ['journal_entries_today', 'total_journal_length', 'avg_journal_sentiment']
+
+# Model inputs: every group, minus the target
+MODEL_COLUMNS = (BASE_COLUMNS[1:] + TEMPORAL_COLUMNS + CYCLICAL_COLUMNS + EMOTION_COLUMNS +
+                 TEXT_COLUMNS + CONTEXT_COLUMNS + PROFILE_COLUMNS + HISTORY_COLUMNS +
+                 JOURNAL_COLUMNS)
+
+class FeatureSchemaMismatch(ValueError):
+    """Raised when saved model artifacts were built for a different feature layout"""
+
+class FeatureSchema:
+    """Ordered feature names with a precomputed name -> column index map
+
+    Rows are float32 and zero-filled, so features an entry does not have
+    (no context, no journal) are 0 exactly as in the training matrix.
+    """
+
+    def __init__(self, feature_names: List[str], version: int = SCHEMA_VERSION):
+        self.feature_names = list(feature_names)
+        self.version = version
+        self.index = {name: i for i, name in enumerate(self.feature_names)}
+        self.size = len(self.feature_names)
+        self.fingerprint = hashlib.sha256('\n'.join(self.feature_names).encode('utf-8')).hexdigest()[:16]
+
+        if len(self.index) != self.size:
+            raise ValueError("Feature schema contains duplicate names")
+
+    def new_row(self) -> np.ndarray:
+        return np.zeros(self.size, dtype=np.float32)
+
+    def new_matrix(self, n_rows: int) -> np.ndarray:
+        return np.zeros((n_rows, self.size), dtype=np.float32)
+
+    def row_from_dict(self, features: Dict, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Place a feature dict (e.g. a stored learning sample) into a schema row
+
+        Unknown names and non-numeric values are ignored; missing names stay 0.
+        """
+        row = self.new_row() if out is None else out
+        index = self.index
+        for name, value in features.items():
+            column = index.get(name)
+            if column is not None and isinstance(value, (int, float, np.number)):
+                row[column] = value
+        return row
+
+    def to_dict(self, row: np.ndarray) -> Dict[str, float]:
+        """JSON-friendly {name: float} view of a schema row"""
+        return dict(zip(self.feature_names, row.tolist()))
+
+    def to_json(self) -> Dict:
+        return {
+            'version': self.version,
+            'fingerprint': self.fingerprint,
+            'feature_names': self.feature_names
+        }
+
+    @classmethod
+    def from_json(cls, data: Dict) -> 'FeatureSchema':
+        return cls(data['feature_names'], data.get('version', 0))
+
+    def save(self, models_dir: str) -> str:
+        """Write the schema next to the model artifacts"""
+        os.makedirs(models_dir, exist_ok=True)
+        path = os.path.join(models_dir, SCHEMA_FILENAME)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_json(), f, indent=2)
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, models_dir: str) -> 'FeatureSchema':
+        path = os.path.join(models_dir, SCHEMA_FILENAME)
+        if not os.path.exists(path):
+            raise FeatureSchemaMismatch(f"No {SCHEMA_FILENAME} in {models_dir}; models predate the feature schema")
+        with open(path) as f:
+            return cls.from_json(json.load(f))
+
+    def check_compatible(self, other: 'FeatureSchema'):
+        """Raise FeatureSchemaMismatch unless ``other`` has the same layout"""
+        if other.version != self.version or other.feature_names != self.feature_names:
+            missing = [name for name in self.feature_names if name not in other.index]
+            extra = [name for name in other.feature_names if name not in self.index]
+            raise FeatureSchemaMismatch(
+                f"Feature schema mismatch: artifacts v{other.version} ({other.fingerprint}, "
+                f"{other.size} features) vs code v{self.version} ({self.fingerprint}, "
+                f"{self.size} features); missing={missing[:5]} extra={extra[:5]}"
+            )
+
+    def check_estimator(self, estimator, name: str = "model"):
+        """Raise FeatureSchemaMismatch if a fitted estimator expects another width"""
+        n_features = getattr(estimator, 'n_features_in_', None)
+        if n_features is not None and n_features != self.size:
+            raise FeatureSchemaMismatch(
+                f"{name} expects {n_features} features but the schema has {self.size}"
+            )
+
+# The layout the running code produces
+FEATURE_SCHEMA = FeatureSchema(MODEL_COLUMNS)
+
+def load_feature_schema(models_dir: str, model=None, scaler=None,
+                        schema: FeatureSchema = FEATURE_SCHEMA) -> FeatureSchema:
+    """Load the schema saved with a model and check it against the running code"""
+    saved = FeatureSchema.load(models_dir)
+    schema.check_compatible(saved)
+    if model is not None:
+        schema.check_estimator(model, "model")
+    if scaler is not None:
+        schema.check_estimator(scaler, "scaler")
+    return saved
+
+def test_feature_schema():
+    """Test the feature schema"""
+    print("🧩 Testing Feature Schema")
+    print("=" * 40)
+
+    print(f"   {FEATURE_SCHEMA.size} features, v{FEATURE_SCHEMA.version} ({FEATURE_SCHEMA.fingerprint})")
+    assert TARGET_COLUMN not in FEATURE_SCHEMA.index
+
+    row = FEATURE_SCHEMA.row_from_dict({'emotion_count': 2, 'mood': 7, 'note': 'text', 'polarity': 0.5})
+    assert row[FEATURE_SCHEMA.index['emotion_count']] == 2 and row.sum() == 2.5
+    assert FEATURE_SCHEMA.to_dict(row)['polarity'] == 0.5
+
+    FEATURE_SCHEMA.save("test_schema_models")
+    assert load_feature_schema("test_schema_models").fingerprint == FEATURE_SCHEMA.fingerprint
+
+    # A model saved with another layout is rejected
+    FeatureSchema(MODEL_COLUMNS[:22]).save("test_schema_models")
+    try:
+        load_feature_schema("test_schema_models")
+        raise AssertionError("mismatched schema was accepted")
+    except FeatureSchemaMismatch as e:
+        print(f"   Rejected: {e}")
+
+    import shutil
+    shutil.rmtree("test_schema_models")
+
+    print("✅ Feature schema test completed!")
+    return FEATURE_SCHEMA
+
+if __name__ == "__main__":
+    schema = test_feature_schema()
@@ -5,23 +5,124 @@ Implements feedback loops to improve recommendations and model performance
 """
 
 import json
+import threading
+import time
 import numpy as np
 from datetime import datetime, timedelta
-from collections import defaultdict, deque
-import sqlite3
+from collections import defaultdict, deque, OrderedDict
 import os
+from micro_batcher import MicroBatcher, register_after_fork
+from sqlite_storage import get_storage, remove_database
+
+def _backfill_rollups(conn):
+    """Recompute the feedback rollups from the raw feedback table"""
+    category = "COALESCE(CASE WHEN json_valid(context) THEN json_extract(context, '$.category') END, '')"
+    for table, width in (('feedback_rollup_hourly', 13), ('feedback_rollup_daily', 10)):
+        conn.execute(f'DELETE FROM {table}')
+        conn.execute(f'''
+            INSERT INTO {table} (bucket, category, feedback_type, feedback_count)
+            SELECT substr(timestamp, 1, {width}), {category}, feedback_type, COUNT(*)
+            FROM feedback WHERE timestamp IS NOT NULL
+            GROUP BY 1, 2, 3
+        ''')
+    conn.execute('DELETE FROM feedback_users')
+    conn.execute('''
+        INSERT INTO feedback_users (user_id, last_feedback)
+        SELECT user_id, MAX(timestamp)
+        FROM feedback WHERE timestamp IS NOT NULL AND user_id IS NOT NULL
+        GROUP BY user_id
+    ''')
+
+def _prune_rollups(conn, now, retention_days):
+    """Drop hourly buckets older than ``retention_days``"""
+    since = now - timedelta(days=retention_days)
+    conn.execute('DELETE FROM feedback_rollup_hourly WHERE bucket < ?', (since.strftime('%Y-%m-%dT%H'),))
+
+# Versioned schema changes for existing databases (see SQLiteStorage.migrate)
+MIGRATIONS = [
+    (1, [
+        # Merge duplicate (type, text) rows into the newest one before making the pair unique
+        '''UPDATE recommendation_performance SET
+               total_feedback = (SELECT SUM(d.total_feedback) FROM recommendation_performance d
+                                 WHERE d.recommendation_type = recommendation_performance.recommendation_type
+                                   AND d.recommendation_text = recommendation_performance.recommendation_text),
+               positive_feedback = (SELECT SUM(d.positive_feedback) FROM recommendation_performance d
+                                    WHERE d.recommendation_type = recommendation_performance.recommendation_type
+                                      AND d.recommendation_text = recommendation_performance.recommendation_text),
+               negative_feedback = (SELECT SUM(d.negative_feedback) FROM recommendation_performance d
+                                    WHERE d.recommendation_type = recommendation_performance.recommendation_type
+                                      AND d.recommendation_text = recommendation_performance.recommendation_text),
+               avg_rating = (SELECT SUM(d.avg_rating * d.total_feedback) / SUM(d.total_feedback)
+                             FROM recommendation_performance d
+                             WHERE d.recommendation_type = recommendation_performance.recommendation_type
+                               AND d.recommendation_text = recommendation_performance.recommendation_text)
+           WHERE id IN (SELECT MAX(id) FROM recommendation_performance
+                        GROUP BY recommendation_type, recommendation_text HAVING COUNT(*) > 1)''',
+        '''DELETE FROM recommendation_performance WHERE id NOT IN (
+               SELECT MAX(id) FROM recommendation_performance
+               GROUP BY recommendation_type, recommendation_text)''',
+        '''CREATE UNIQUE INDEX IF NOT EXISTS idx_recommendation_performance_type_text
+               ON recommendation_performance (recommendation_type, recommendation_text)''',
+    ]),
+    (2, [_backfill_rollups]),
+]
 
 class FeedbackSystem:
-    """User feedback system for continuous improvement"""
+    """User feedback system for continuous improvement
+
+    Recent scores are kept per (type, text) in fixed-size deques, at most
+    ``max_tracked_recommendations`` of them (least recently used dropped), so
+    quality scores are O(1) and memory is bounded. They are restored at
+    startup from the newest ``score_restore_limit`` feedback rows.
+
+    User preferences (category sets) are cached for at most
+    ``max_cached_users`` users and re-read after ``preferences_ttl``
+    seconds. Changed preferences are marked dirty and written back in
+    batches by a background writer, once per user per batch.
+
+    Feedback counts are rolled up per (category, feedback_type) into hourly
+    and daily buckets in the same transaction as the raw insert, so insights
+    for any window read at most 24 hourly plus ``days`` daily buckets. Each
+    user's latest feedback time is kept in one row, so engaged users in a
+    window are one index range count. Hourly buckets are pruned after
+    ``hourly_retention_days``; daily buckets are kept.
+    """
     
-    def __init__(self, db_path="feedback.db"):
+    def __init__(self, db_path="feedback.db", recent_scores_window: int = 10,
+                 max_tracked_recommendations: int = 50000, score_restore_limit: int = 200000,
+                 max_cached_users: int = 100000, preferences_ttl: float = 300.0,
+                 hourly_retention_days: int = 2):
         self.db_path = db_path
+        self.hourly_retention_days = hourly_retention_days
+        self._pruned_day = None  # day of the last rollup pruning
+        self.storage = get_storage(db_path)
         self.init_database()
         
         # Feedback tracking
         self.feedback_history = deque(maxlen=1000)  # Keep last 1000 feedback entries
-        self.recommendation_performance = defaultdict(list)
-        self.user_preferences = defaultdict(dict)
+        
+        # user_id -> (loaded at, preferences), LRU order; dirty preferences wait for the writer
+        self.max_cached_users = max_cached_users
+        self.preferences_ttl = preferences_ttl
+        self.user_preferences = OrderedDict()
+        self._dirty_preferences = {}
+        self._preferences_lock = threading.Lock()
+        self.preferences_writer = MicroBatcher(self._write_preferences, max_batch_size=1000, max_wait_ms=1000,
+                                               name="preferences-writer")
+        self._last_preferences_write = None
+        register_after_fork(self)
+        
+        # (type, text) -> deque of the latest scores, LRU order
+        self.recent_scores_window = recent_scores_window
+        self.max_tracked_recommendations = max_tracked_recommendations
+        self.recommendation_performance = OrderedDict()
+        self._performance_lock = threading.Lock()
+        
+        # Normalised exponential recency weights for every buffer length (oldest first)
+        self._score_weights = [()] + [
+            tuple((weights / weights.sum()).tolist())
+            for weights in (np.exp(np.linspace(-1, 0, n)) for n in range(1, recent_scores_window + 1))
+        ]
         
         # Learning parameters
         self.learning_rate = 0.1
@@ -32,14 +133,12 @@ class FeedbackSystem:
             'irrelevant': -0.8,
             'inappropriate': -1.0
         }
+        self.restore_recent_scores(score_restore_limit)
     
     def init_database(self):
         """Initialize feedback database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Create feedback table
-        cursor.execute('''
+        self.storage.executescript('''
+            -- Feedback table
             CREATE TABLE IF NOT EXISTS feedback (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id TEXT,
@@ -49,11 +148,9 @@ class FeedbackSystem:
                 comment TEXT,
                 timestamp DATETIME,
                 context TEXT
-            )
-        ''')
-        
-        # Create recommendation performance table
-        cursor.execute('''
+            );
+            
+            -- Recommendation performance table
             CREATE TABLE IF NOT EXISTS recommendation_performance (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 recommendation_type TEXT,
@@ -63,22 +160,42 @@ class FeedbackSystem:
                 negative_feedback INTEGER,
                 avg_rating REAL,
                 last_updated DATETIME
-            )
-        ''')
-        
-        # Create user preferences table
-        cursor.execute('''
+            );
+            
+            -- User preferences table
             CREATE TABLE IF NOT EXISTS user_preferences (
                 user_id TEXT PRIMARY KEY,
                 preferred_categories TEXT,
                 avoided_categories TEXT,
                 feedback_threshold REAL,
                 last_updated DATETIME
-            )
+            );
+            
+            -- Feedback counts per time bucket ('' when there is no category)
+            CREATE TABLE IF NOT EXISTS feedback_rollup_hourly (
+                bucket TEXT,
+                category TEXT,
+                feedback_type TEXT,
+                feedback_count INTEGER,
+                PRIMARY KEY (bucket, category, feedback_type)
+            );
+            
+            CREATE TABLE IF NOT EXISTS feedback_rollup_daily (
+                bucket TEXT,
+                category TEXT,
+                feedback_type TEXT,
+                feedback_count INTEGER,
+                PRIMARY KEY (bucket, category, feedback_type)
+            );
+            
+            -- Latest feedback time per user, for distinct-user counts over a window
+            CREATE TABLE IF NOT EXISTS feedback_users (
+                user_id TEXT PRIMARY KEY,
+                last_feedback DATETIME
+            );
+            CREATE INDEX IF NOT EXISTS idx_feedback_users_last_feedback ON feedback_users (last_feedback);
         ''')
-        
-        conn.commit()
-        conn.close()
+        self.storage.migrate('feedback', MIGRATIONS)
     
     def record_feedback(self, user_id, recommendation_id, feedback_type, rating=None, comment=None, context=None):
         """Record user feedback for a recommendation"""
@@ -107,48 +224,107 @@ class FeedbackSystem:
         return True
     
     def _store_feedback_db(self, feedback_entry):
-        """Store feedback in database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO feedback (user_id, recommendation_id, feedback_type, rating, comment, timestamp, context)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            feedback_entry['user_id'],
-            feedback_entry['recommendation_id'],
-            feedback_entry['feedback_type'],
-            feedback_entry['rating'],
-            feedback_entry['comment'],
-            feedback_entry['timestamp'].isoformat(),
-            json.dumps(feedback_entry['context']) if feedback_entry['context'] else None
-        ))
-        
-        conn.commit()
-        conn.close()
+        """Store feedback in database, bump its hourly and daily rollups and the user's last feedback
+        
+        The first write of each day also prunes expired hourly buckets.
+        """
+        timestamp = feedback_entry['timestamp']
+        day = timestamp.strftime('%Y-%m-%d')
+        context = feedback_entry['context']
+        category = context.get('category', '') if context else ''
+        
+        def store(conn):
+            conn.execute('''
+                INSERT INTO feedback (user_id, recommendation_id, feedback_type, rating, comment, timestamp, context)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                feedback_entry['user_id'],
+                feedback_entry['recommendation_id'],
+                feedback_entry['feedback_type'],
+                feedback_entry['rating'],
+                feedback_entry['comment'],
+                timestamp.isoformat(),
+                json.dumps(context) if context else None
+            ))
+            for table, bucket in (('feedback_rollup_hourly', timestamp.strftime('%Y-%m-%dT%H')),
+                                  ('feedback_rollup_daily', day)):
+                conn.execute(f'''
+                    INSERT INTO {table} (bucket, category, feedback_type, feedback_count)
+                    VALUES (?, ?, ?, 1)
+                    ON CONFLICT (bucket, category, feedback_type) DO UPDATE SET
+                        feedback_count = feedback_count + 1
+                ''', (bucket, category, feedback_entry['feedback_type']))
+            if feedback_entry['user_id'] is not None:
+                conn.execute('''
+                    INSERT INTO feedback_users (user_id, last_feedback) VALUES (?, ?)
+                    ON CONFLICT (user_id) DO UPDATE SET
+                        last_feedback = MAX(last_feedback, excluded.last_feedback)
+                ''', (feedback_entry['user_id'], timestamp.isoformat()))
+            if self._pruned_day != day:
+                _prune_rollups(conn, timestamp, self.hourly_retention_days)
+                self._pruned_day = day
+        
+        self.storage.transaction(store)
+    
+    def prune_rollups(self):
+        """Drop hourly buckets older than ``hourly_retention_days``"""
+        self.storage.transaction(lambda conn: _prune_rollups(conn, datetime.now(), self.hourly_retention_days))
+    
+    def backfill_rollups(self):
+        """Rebuild the rollups from the feedback table, then prune; returns the feedback count"""
+        self.storage.transaction(_backfill_rollups)
+        self.prune_rollups()
+        return self.storage.read_one('SELECT COALESCE(SUM(feedback_count), 0) FROM feedback_rollup_daily')[0]
     
     def _update_recommendation_performance(self, recommendation_id, feedback_type, rating):
         """Update recommendation performance metrics"""
         # Parse recommendation ID to get type and text
         rec_type, rec_text = self._parse_recommendation_id(recommendation_id)
         
-        if rec_type not in self.recommendation_performance:
-            self.recommendation_performance[rec_type] = []
-        
         # Calculate feedback score
-        feedback_score = self.feedback_weights.get(feedback_type, 0)
-        if rating is not None:
-            feedback_score = (rating - 3) / 2  # Convert 1-5 rating to -1 to 1 scale
-        
-        self.recommendation_performance[rec_type].append({
-            'text': rec_text,
-            'score': feedback_score,
-            'timestamp': datetime.now()
-        })
+        feedback_score = self._feedback_score(feedback_type, rating)
+        self._recent_scores(rec_type, rec_text).append(feedback_score)
         
         # Update database
         self._update_recommendation_performance_db(rec_type, rec_text, feedback_score)
     
+    def _feedback_score(self, feedback_type, rating=None):
+        """Feedback as a -1..1 score"""
+        if rating is not None:
+            return (rating - 3) / 2  # Convert 1-5 rating to -1 to 1 scale
+        return self.feedback_weights.get(feedback_type, 0)
+    
+    def _recent_scores(self, rec_type, rec_text, create=True):
+        """The recommendation's ring buffer of recent scores (marked as recently used)"""
+        key = (rec_type, rec_text)
+        with self._performance_lock:
+            scores = self.recommendation_performance.get(key)
+            if scores is not None:
+                self.recommendation_performance.move_to_end(key)
+            elif create:
+                scores = self.recommendation_performance[key] = deque(maxlen=self.recent_scores_window)
+                if len(self.recommendation_performance) > self.max_tracked_recommendations:
+                    self.recommendation_performance.popitem(last=False)
+            return scores
+    
+    def restore_recent_scores(self, limit: int = 200000) -> int:
+        """Refill the ring buffers from the newest ``limit`` feedback rows"""
+        rows = self.storage.read('''
+            SELECT recommendation_id, feedback_type, rating FROM (
+                SELECT id, recommendation_id, feedback_type, rating,
+                       ROW_NUMBER() OVER (PARTITION BY recommendation_id ORDER BY id DESC) AS recency
+                FROM feedback
+                WHERE id > (SELECT COALESCE(MAX(id), 0) FROM feedback) - ?
+            )
+            WHERE recency <= ?
+            ORDER BY id
+        ''', (limit, self.recent_scores_window))
+        
+        for recommendation_id, feedback_type, rating in rows:
+            rec_type, rec_text = self._parse_recommendation_id(recommendation_id)
+            self._recent_scores(rec_type, rec_text).append(self._feedback_score(feedback_type, rating))
+        return len(rows)
+    
     def _parse_recommendation_id(self, recommendation_id):
         """Parse recommendation ID to extract type and text"""
         # Simple parsing - in practice, this would be more sophisticated
@@ -158,152 +334,188 @@ class FeedbackSystem:
         return 'general', recommendation_id
     
     def _update_recommendation_performance_db(self, rec_type, rec_text, feedback_score):
-        """Update recommendation performance in database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Check if recommendation exists
-        cursor.execute('''
-            SELECT id, total_feedback, positive_feedback, negative_feedback, avg_rating
-            FROM recommendation_performance
-            WHERE recommendation_type = ? AND recommendation_text = ?
-        ''', (rec_type, rec_text))
-        
-        result = cursor.fetchone()
-        
-        if result:
-            # Update existing record
-            rec_id, total, positive, negative, avg_rating = result
-            total += 1
-            if feedback_score > 0:
-                positive += 1
-            elif feedback_score < 0:
-                negative += 1
-            
-            new_avg = ((avg_rating * (total - 1)) + feedback_score) / total
-            
-            cursor.execute('''
-                UPDATE recommendation_performance
-                SET total_feedback = ?, positive_feedback = ?, negative_feedback = ?, 
-                    avg_rating = ?, last_updated = ?
-                WHERE id = ?
-            ''', (total, positive, negative, new_avg, datetime.now().isoformat(), rec_id))
-        else:
-            # Create new record
-            positive = 1 if feedback_score > 0 else 0
-            negative = 1 if feedback_score < 0 else 0
-            
-            cursor.execute('''
-                INSERT INTO recommendation_performance
-                (recommendation_type, recommendation_text, total_feedback, positive_feedback, 
-                 negative_feedback, avg_rating, last_updated)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (rec_type, rec_text, 1, positive, negative, feedback_score, datetime.now().isoformat()))
-        
-        conn.commit()
-        conn.close()
+        """Fold one feedback score into the recommendation's counters
+        
+        A single upsert with the arithmetic in SQL: concurrent feedback for the
+        same recommendation (other threads or worker processes) cannot lose
+        updates, and callers do not wait for the commit.
+        """
+        feedback_score = float(feedback_score)
+        self.storage.write('''
+            INSERT INTO recommendation_performance
+            (recommendation_type, recommendation_text, total_feedback, positive_feedback, 
+             negative_feedback, avg_rating, last_updated)
+            VALUES (?, ?, 1, ?, ?, ?, ?)
+            ON CONFLICT (recommendation_type, recommendation_text) DO UPDATE SET
+                total_feedback = total_feedback + 1,
+                positive_feedback = positive_feedback + excluded.positive_feedback,
+                negative_feedback = negative_feedback + excluded.negative_feedback,
+                avg_rating = (avg_rating * total_feedback + excluded.avg_rating) / (total_feedback + 1),
+                last_updated = excluded.last_updated
+        ''', (
+            rec_type, rec_text,
+            1 if feedback_score > 0 else 0,
+            1 if feedback_score < 0 else 0,
+            feedback_score,
+            datetime.now().isoformat()
+        ), wait=False)
     
     def _update_user_preferences(self, user_id, feedback_type, context):
         """Update user preferences based on feedback"""
-        if user_id not in self.user_preferences:
-            self.user_preferences[user_id] = {
-                'preferred_categories': [],
-                'avoided_categories': [],
-                'feedback_threshold': 0.5
-            }
-        
         # Extract category from context if available
-        if context and 'category' in context:
-            category = context['category']
-            
-            if feedback_type in ['helpful', 'very_helpful']:
-                if category not in self.user_preferences[user_id]['preferred_categories']:
-                    self.user_preferences[user_id]['preferred_categories'].append(category)
-            elif feedback_type in ['not_helpful', 'irrelevant', 'inappropriate']:
-                if category not in self.user_preferences[user_id]['avoided_categories']:
-                    self.user_preferences[user_id]['avoided_categories'].append(category)
-        
-        # Update database
-        self._update_user_preferences_db(user_id)
+        if not context or 'category' not in context:
+            return
+        category = context['category']
+        
+        if feedback_type in ['helpful', 'very_helpful']:
+            field = 'preferred_categories'
+        elif feedback_type in ['not_helpful', 'irrelevant', 'inappropriate']:
+            field = 'avoided_categories'
+        else:
+            return
+        
+        prefs = self.get_user_preferences(user_id)
+        with self._preferences_lock:
+            if category in prefs[field]:
+                return  # unchanged: nothing to write
+            prefs[field].add(category)
+            self._mark_preferences_dirty(user_id, prefs)
     
-    def _update_user_preferences_db(self, user_id):
-        """Update user preferences in database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        prefs = self.user_preferences[user_id]
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO user_preferences
+    def _after_fork(self):
+        """The parent writes the preferences it queued; the child starts with none queued"""
+        self._preferences_lock = threading.Lock()
+        self._performance_lock = threading.Lock()
+        self._dirty_preferences = {}
+        self._last_preferences_write = None
+    
+    def _mark_preferences_dirty(self, user_id, prefs):
+        """Queue a write-back (caller holds the preferences lock)"""
+        if user_id not in self._dirty_preferences:
+            self._last_preferences_write = self.preferences_writer.submit(user_id)
+        self._dirty_preferences[user_id] = prefs
+    
+    def _write_preferences(self, user_ids):
+        """Preferences writer batch: one upsert per dirty user
+        
+        If the write fails, its users are marked dirty again (unless they
+        changed meanwhile and are already queued) so the next batch retries.
+        """
+        now = datetime.now().isoformat()
+        with self._preferences_lock:
+            batch = {user_id: self._dirty_preferences.pop(user_id) for user_id in set(user_ids)
+                     if user_id in self._dirty_preferences}
+            rows = [
+                (user_id, json.dumps(sorted(prefs['preferred_categories'])),
+                 json.dumps(sorted(prefs['avoided_categories'])), prefs['feedback_threshold'], now)
+                for user_id, prefs in batch.items()
+            ]
+        
+        try:
+            self._upsert_preferences(rows)
+        except Exception:
+            with self._preferences_lock:
+                for user_id, prefs in batch.items():
+                    if user_id not in self._dirty_preferences:
+                        self._mark_preferences_dirty(user_id, prefs)
+            raise
+        return [None] * len(user_ids)
+    
+    def _upsert_preferences(self, rows):
+        """Insert or replace preference rows (user_id, preferred, avoided, threshold, updated)"""
+        self.storage.write_many('''
+            INSERT INTO user_preferences
             (user_id, preferred_categories, avoided_categories, feedback_threshold, last_updated)
             VALUES (?, ?, ?, ?, ?)
-        ''', (
-            user_id,
-            json.dumps(prefs['preferred_categories']),
-            json.dumps(prefs['avoided_categories']),
-            prefs['feedback_threshold'],
-            datetime.now().isoformat()
-        ))
-        
-        conn.commit()
-        conn.close()
+            ON CONFLICT (user_id) DO UPDATE SET
+                preferred_categories = excluded.preferred_categories,
+                avoided_categories = excluded.avoided_categories,
+                feedback_threshold = excluded.feedback_threshold,
+                last_updated = excluded.last_updated
+        ''', rows)
+    
+    def flush_preferences(self):
+        """Block until every dirty preference queued so far has been written"""
+        last_write = self._last_preferences_write
+        if last_write is not None:
+            last_write.exception()  # waits; a failed batch is already logged
+    
+    def close(self):
+        """Write dirty preferences and stop the preferences writer"""
+        self.preferences_writer.close()
     
     def get_recommendation_quality_score(self, recommendation_type, recommendation_text):
         """Get quality score for a recommendation based on feedback"""
-        if recommendation_type not in self.recommendation_performance:
-            return 0.5  # Neutral score for new recommendations
-        
-        scores = [entry['score'] for entry in self.recommendation_performance[recommendation_type]
-                 if entry['text'] == recommendation_text]
-        
+        scores = self._recent_scores(recommendation_type, recommendation_text, create=False)
         if not scores:
-            return 0.5
-        
-        # Calculate weighted average with recency bias
-        recent_scores = scores[-10:]  # Last 10 feedback entries
-        weights = np.exp(np.linspace(-1, 0, len(recent_scores)))  # Exponential decay
+            return 0.5  # Neutral score for new recommendations
         
-        weighted_score = np.average(recent_scores, weights=weights)
+        # Weighted average of the last feedback entries with recency bias
+        recent_scores = tuple(scores)
+        weights = self._score_weights[len(recent_scores)]
+        weighted_score = sum(weight * score for weight, score in zip(weights, recent_scores))
         return max(0, min(1, (weighted_score + 1) / 2))  # Convert to 0-1 scale
     
     def get_user_preferences(self, user_id):
-        """Get user preferences for personalized recommendations"""
-        if user_id in self.user_preferences:
-            return self.user_preferences[user_id]
+        """Get user preferences for personalized recommendations
         
-        # Load from database if not in memory
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT preferred_categories, avoided_categories, feedback_threshold
-            FROM user_preferences WHERE user_id = ?
-        ''', (user_id,))
-        
-        result = cursor.fetchone()
-        conn.close()
-        
-        if result:
-            prefs = {
-                'preferred_categories': json.loads(result[0]) if result[0] else [],
-                'avoided_categories': json.loads(result[1]) if result[1] else [],
-                'feedback_threshold': result[2] or 0.5
-            }
-            self.user_preferences[user_id] = prefs
-            return prefs
+        The returned dict is the cached entry; its category sets must not be modified.
+        """
+        return self.get_user_preferences_many([user_id])[user_id]
+    
+    def get_user_preferences_many(self, user_ids):
+        """Preferences for many users: cache hits plus one chunked query for the rest"""
+        preferences = {}
+        missing = []
+        now = time.monotonic()
+        with self._preferences_lock:
+            for user_id in user_ids:
+                cached = self.user_preferences.get(user_id)
+                # Expired entries are re-read unless they have unwritten changes
+                if cached is not None and (now - cached[0] < self.preferences_ttl
+                                           or user_id in self._dirty_preferences):
+                    self.user_preferences.move_to_end(user_id)
+                    preferences[user_id] = cached[1]
+                else:
+                    missing.append(user_id)
+        if not missing:
+            return preferences
         
-        return {
-            'preferred_categories': [],
-            'avoided_categories': [],
-            'feedback_threshold': 0.5
-        }
+        # Load from database if not in memory
+        loaded = {}
+        for start in range(0, len(missing), 500):
+            chunk = missing[start:start + 500]
+            rows = self.storage.read(f'''
+                SELECT user_id, preferred_categories, avoided_categories, feedback_threshold
+                FROM user_preferences WHERE user_id IN ({', '.join('?' * len(chunk))})
+            ''', chunk)
+            for user_id, preferred, avoided, threshold in rows:
+                loaded[user_id] = {
+                    'preferred_categories': set(json.loads(preferred)) if preferred else set(),
+                    'avoided_categories': set(json.loads(avoided)) if avoided else set(),
+                    'feedback_threshold': threshold or 0.5
+                }
+        
+        with self._preferences_lock:
+            for user_id in missing:
+                if user_id in self._dirty_preferences:
+                    prefs = self._dirty_preferences[user_id]  # unwritten changes are newer than the row
+                else:
+                    # Users without a row are cached too, so they cost no query until the TTL
+                    prefs = loaded.get(user_id) or {
+                        'preferred_categories': set(),
+                        'avoided_categories': set(),
+                        'feedback_threshold': 0.5
+                    }
+                self.user_preferences[user_id] = (now, prefs)
+                self.user_preferences.move_to_end(user_id)
+                preferences[user_id] = prefs
+            while len(self.user_preferences) > self.max_cached_users:
+                self.user_preferences.popitem(last=False)  # dirty ones stay in _dirty_preferences
+        return preferences
     
     def get_top_recommendations(self, category, limit=10):
         """Get top performing recommendations for a category"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        results = self.storage.read('''
             SELECT recommendation_text, avg_rating, total_feedback, positive_feedback
             FROM recommendation_performance
             WHERE recommendation_type = ? AND total_feedback >= ?
@@ -311,9 +523,6 @@ class FeedbackSystem:
             LIMIT ?
         ''', (category, self.min_feedback_samples, limit))
         
-        results = cursor.fetchall()
-        conn.close()
-        
         return [
             {
                 'text': row[0],
@@ -326,16 +535,33 @@ class FeedbackSystem:
         ]
     
     def get_feedback_insights(self, days=30):
-        """Get insights from feedback data"""
-        cutoff_date = datetime.now() - timedelta(days=days)
-        
-        # Filter recent feedback
-        recent_feedback = [
-            f for f in self.feedback_history
-            if f['timestamp'] >= cutoff_date
-        ]
+        """Get insights from feedback data
+        
+        Counts come from hourly buckets for the first (partial) day of the
+        window and daily buckets after it. Hourly buckets older than
+        ``hourly_retention_days`` are pruned, so longer windows count their
+        first day whole. User engagement is the exact number of distinct
+        users with feedback since the cutoff.
+        """
+        now = datetime.now()
+        cutoff_date = now - timedelta(days=days)
+        if cutoff_date < now - timedelta(days=self.hourly_retention_days):
+            first_full_day = cutoff_date.strftime('%Y-%m-%d')
+        else:
+            first_full_day = (cutoff_date + timedelta(days=1)).strftime('%Y-%m-%d')
+        
+        rows = self.storage.read('''
+            SELECT category, feedback_type, SUM(feedback_count) FROM (
+                SELECT category, feedback_type, feedback_count FROM feedback_rollup_hourly
+                WHERE bucket >= ? AND bucket < ?
+                UNION ALL
+                SELECT category, feedback_type, feedback_count FROM feedback_rollup_daily
+                WHERE bucket >= ?
+            )
+            GROUP BY category, feedback_type
+        ''', (cutoff_date.strftime('%Y-%m-%dT%H'), first_full_day, first_full_day))
         
-        if not recent_feedback:
+        if not rows:
             return {
                 'total_feedback': 0,
                 'feedback_distribution': {},
@@ -345,23 +571,25 @@ class FeedbackSystem:
             }
         
         # Calculate insights
-        total_feedback = len(recent_feedback)
+        total_feedback = sum(count for _, _, count in rows)
         feedback_distribution = defaultdict(int)
-        category_feedback = defaultdict(list)
-        user_engagement = len(set(f['user_id'] for f in recent_feedback))
-        
-        for feedback in recent_feedback:
-            feedback_distribution[feedback['feedback_type']] += 1
+        category_counts = defaultdict(lambda: [0, 0])  # category -> [positive, total]
+        user_engagement = self.storage.read_one(
+            'SELECT COUNT(*) FROM feedback_users WHERE last_feedback >= ?',
+            (cutoff_date.isoformat(),)
+        )[0]
+        
+        for category, feedback_type, count in rows:
+            feedback_distribution[feedback_type] += count
             
-            if feedback['context'] and 'category' in feedback['context']:
-                category = feedback['context']['category']
-                category_feedback[category].append(feedback['feedback_type'])
+            if category:
+                category_counts[category][1] += count
+                if feedback_type in ['helpful', 'very_helpful']:
+                    category_counts[category][0] += count
         
         # Calculate category performance
         category_performance = {}
-        for category, feedbacks in category_feedback.items():
-            positive_count = sum(1 for f in feedbacks if f in ['helpful', 'very_helpful'])
-            total_count = len(feedbacks)
+        for category, (positive_count, total_count) in category_counts.items():
             category_performance[category] = {
                 'success_rate': positive_count / total_count if total_count > 0 else 0,
                 'total_feedback': total_count
@@ -382,6 +610,14 @@ class FeedbackSystem:
             'improvement_areas': improvement_areas
         }
     
+    def _recent_scores_report(self):
+        """{type: {text: [recent scores]}} for reports"""
+        report = defaultdict(dict)
+        with self._performance_lock:
+            for (rec_type, rec_text), scores in self.recommendation_performance.items():
+                report[rec_type][rec_text] = list(scores)
+        return dict(report)
+    
     def generate_feedback_report(self):
         """Generate comprehensive feedback report"""
         insights = self.get_feedback_insights(30)
@@ -390,7 +626,7 @@ class FeedbackSystem:
             'generated_at': datetime.now().isoformat(),
             'period_days': 30,
             'insights': insights,
-            'recommendation_performance': dict(self.recommendation_performance),
+            'recommendation_performance': self._recent_scores_report(),
             'active_users': len(self.user_preferences)
         }
         
@@ -450,12 +686,79 @@ def test_feedback_system():
     quality_score = feedback_system.get_recommendation_quality_score('anxiety_management', 'breathing_exercise')
     print(f"   Anxiety breathing exercise: {quality_score:.2f}")
     
+    # Ring buffers keep the last 10 scores and are restored after a restart
+    ratings = [1, 2, 5, 5, 4, 5, 5, 4, 5, 5, 5, 3]
+    for rating in ratings:
+        feedback_system.record_feedback('user_003', 'sleep_wind_down_routine', 'helpful', rating=rating)
+    recent = [(rating - 3) / 2 for rating in ratings[-10:]]
+    expected = (np.average(recent, weights=np.exp(np.linspace(-1, 0, 10))) + 1) / 2
+    score = feedback_system.get_recommendation_quality_score('sleep', 'wind_down_routine')
+    assert abs(score - expected) < 1e-9, (score, expected)
+    restarted = FeedbackSystem("test_feedback.db")
+    assert abs(restarted.get_recommendation_quality_score('sleep', 'wind_down_routine') - score) < 1e-9
+    bounded = FeedbackSystem("test_feedback.db", max_tracked_recommendations=2)
+    assert len(bounded.recommendation_performance) == 2
+    print(f"   Sleep wind-down routine: {score:.2f} (restored after restart)")
+    
     # Test user preferences
     print(f"\n👤 User Preferences:")
     user_prefs = feedback_system.get_user_preferences('user_001')
     print(f"   User 001 preferred categories: {user_prefs['preferred_categories']}")
     print(f"   User 001 avoided categories: {user_prefs['avoided_categories']}")
     
+    # Preferences are sets, written back once per dirty user and shared through SQLite
+    assert user_prefs['preferred_categories'] == {'anxiety_management'}
+    assert user_prefs['avoided_categories'] == {'depression_support'}
+    feedback_system.flush_preferences()
+    other_worker = FeedbackSystem("test_feedback.db", max_cached_users=2)
+    many = other_worker.get_user_preferences_many(['user_001', 'user_002', 'user_unknown'])
+    assert many['user_002']['preferred_categories'] == {'anxiety_management', 'stress_management'}
+    assert many['user_unknown']['avoided_categories'] == set()
+    assert len(other_worker.user_preferences) == 2  # bounded LRU
+    other_worker.record_feedback('user_001', 'sleep_wind_down_routine', 'irrelevant', context={'category': 'sleep'})
+    other_worker.close()
+    assert other_worker.storage.read_one(
+        'SELECT avoided_categories FROM user_preferences WHERE user_id = ?', ('user_001',)
+    )[0] == json.dumps(['depression_support', 'sleep'])
+    
+    # A failed write-back leaves its users dirty, and the next batch writes them
+    def read_avoided(user_id):
+        row = feedback_system.storage.read_one(
+            'SELECT avoided_categories FROM user_preferences WHERE user_id = ?', (user_id,))
+        return row and json.loads(row[0])
+    
+    def unavailable(rows):
+        raise sqlite3.OperationalError("database is locked")
+    
+    import signal
+    import sqlite3
+    feedback_system._upsert_preferences = unavailable
+    feedback_system._update_user_preferences('user_004', 'irrelevant', {'category': 'sleep'})
+    failed = feedback_system._last_preferences_write
+    assert isinstance(failed.exception(timeout=5), sqlite3.OperationalError)
+    del feedback_system._upsert_preferences
+    assert 'user_004' in feedback_system._dirty_preferences and feedback_system._last_preferences_write is not failed
+    feedback_system.flush_preferences()
+    assert read_avoided('user_004') == ['sleep']
+    print("   Failed preference write retried in the next batch")
+    
+    # A forked worker neither waits on nor loses the parent's queued write-backs
+    feedback_system._update_user_preferences('user_005', 'irrelevant', {'category': 'sleep'})
+    if hasattr(os, 'fork'):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                signal.alarm(10)
+                feedback_system.flush_preferences()
+                feedback_system._update_user_preferences('user_006', 'irrelevant', {'category': 'stress'})
+                feedback_system.flush_preferences()
+                os._exit(0 if read_avoided('user_006') == ['stress'] else 1)
+            except BaseException:
+                os._exit(1)
+        assert os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1]) == 0, "forked worker preferences"
+    feedback_system.flush_preferences()
+    assert read_avoided('user_005') == ['sleep']
+    
     # Test top recommendations
     print(f"\n🏆 Top Recommendations:")
     top_recs = feedback_system.get_top_recommendations('anxiety_management', 3)
@@ -468,10 +771,108 @@ def test_feedback_system():
     print(f"   Total feedback: {insights['total_feedback']}")
     print(f"   User engagement: {insights['user_engagement']} users")
     print(f"   Improvement areas: {insights['improvement_areas']}")
+    assert insights['total_feedback'] == 4 + len(ratings) + 1
+    assert insights['feedback_distribution'] == {'helpful': 2 + len(ratings), 'not_helpful': 1,
+                                                 'very_helpful': 1, 'irrelevant': 1}
+    assert dict(insights['top_categories'])['anxiety_management'] == {'success_rate': 1.0, 'total_feedback': 2}
+    assert insights['user_engagement'] == 3
+    
+    # Rollups cover the whole window, not just recent memory, and can be rebuilt from raw feedback
+    old = (datetime.now() - timedelta(days=10)).isoformat()
+    feedback_system.storage.write_many('''
+        INSERT INTO feedback (user_id, recommendation_id, feedback_type, timestamp, context)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(f"user_old_{i}", 'sleep_wind_down_routine', 'not_helpful', old, json.dumps({'category': 'sleep'}))
+          for i in range(6)])
+    assert feedback_system.backfill_rollups() == insights['total_feedback'] + 6
+    assert feedback_system.get_feedback_insights(days=1) == insights
+    month = feedback_system.get_feedback_insights(days=30)
+    assert month['total_feedback'] == insights['total_feedback'] + 6 and month['user_engagement'] == 9
+    assert month['improvement_areas'] == ['sleep']
+    # Hourly buckets are pruned; daily buckets remain
+    retained_since = (datetime.now() - timedelta(days=feedback_system.hourly_retention_days)).strftime('%Y-%m-%d')
+    assert feedback_system.storage.read_one('SELECT MIN(bucket) FROM feedback_rollup_hourly')[0] >= retained_since
+    for sql in ('SELECT category, feedback_type, feedback_count FROM feedback_rollup_daily WHERE bucket >= ?',
+                'SELECT COUNT(*) FROM feedback_users WHERE last_feedback >= ?'):
+        assert feedback_system.storage.uses_index(sql, ('2026-01-01',))
+    
+    # Engaged users are distinct users since the cutoff, however many days each was active
+    now = datetime.now()
+    feedback_system.storage.write_many('''
+        INSERT INTO feedback (user_id, recommendation_id, feedback_type, timestamp)
+        VALUES (?, ?, ?, ?)
+    ''', [('user_multi_day', 'sleep_wind_down_routine', 'helpful', (now - timedelta(days=day + 0.5)).isoformat())
+          for day in range(1, 6)] +
+         [('user_yesterday', 'sleep_wind_down_routine', 'helpful', (now - timedelta(hours=30)).isoformat())])
+    feedback_system.backfill_rollups()
+    assert feedback_system.get_feedback_insights(days=30)['user_engagement'] == 9 + 2
+    assert feedback_system.get_feedback_insights(days=1)['user_engagement'] == 3
+    feedback_system.record_feedback('user_multi_day', 'sleep_wind_down_routine', 'helpful')
+    assert feedback_system.get_feedback_insights(days=1)['user_engagement'] == 4
+    assert feedback_system.get_feedback_insights(days=30)['user_engagement'] == 9 + 2
+    print(f"   30-day insights from rollups: {month['total_feedback']} feedback, "
+          f"improvement areas {month['improvement_areas']}")
+    
+    # Concurrent feedback for one recommendation loses no counts
+    from concurrent.futures import ThreadPoolExecutor
+    
+    def send_feedback(i):
+        feedback_system.record_feedback(f"user_{i % 20:03d}", 'stress_test_recommendation',
+                                        'helpful' if i % 3 else 'not_helpful')
+    
+    threads, events = 16, 1600
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(send_feedback, range(events)))
+    feedback_system.storage.flush()  # reads only wait for this thread's own writes
+    total, positive, negative, avg_rating = feedback_system.storage.read_one('''
+        SELECT total_feedback, positive_feedback, negative_feedback, avg_rating
+        FROM recommendation_performance WHERE recommendation_type = ? AND recommendation_text = ?
+    ''', ('stress', 'test_recommendation'))
+    helpful = sum(1 for i in range(events) if i % 3)
+    assert (total, positive, negative) == (events, helpful, events - helpful), (total, positive, negative)
+    expected_avg = (helpful * 1.0 + (events - helpful) * -0.5) / events
+    assert abs(avg_rating - expected_avg) < 1e-9
+    print(f"   Stress test: {events} concurrent feedback events from {threads} threads, none lost")
+    
+    # ... and from several worker processes writing the same database
+    if hasattr(os, 'fork'):
+        processes, per_process = 4, 200
+        children = []
+        for _ in range(processes):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    for i in range(per_process):
+                        feedback_system._update_recommendation_performance_db('stress', 'multi_process', 1.0)
+                    feedback_system.storage.flush()
+                    os._exit(0)
+                except BaseException:
+                    os._exit(1)
+            children.append(pid)
+        assert all(os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1]) == 0 for pid in children)
+        total = feedback_system.storage.read_one('''
+            SELECT total_feedback FROM recommendation_performance
+            WHERE recommendation_type = ? AND recommendation_text = ?
+        ''', ('stress', 'multi_process'))[0]
+        assert total == processes * per_process, total
+        print(f"   Stress test: {processes} processes x {per_process} events, none lost")
+    
+    # Hot queries are index lookups, not table scans
+    storage = feedback_system.storage
+    assert storage.uses_index('''
+        SELECT id, total_feedback, positive_feedback, negative_feedback, avg_rating
+        FROM recommendation_performance WHERE recommendation_type = ? AND recommendation_text = ?
+    ''', ('anxiety_management', 'breathing_exercise'))
+    assert storage.uses_index('''
+        SELECT recommendation_text, avg_rating, total_feedback, positive_feedback
+        FROM recommendation_performance WHERE recommendation_type = ? AND total_feedback >= ?
+        ORDER BY avg_rating DESC, total_feedback DESC LIMIT ?
+    ''', ('anxiety_management', 5, 3))
+    print(f"   Query plans use indexes")
     
     # Clean up test database
-    if os.path.exists("test_feedback.db"):
-        os.remove("test_feedback.db")
+    feedback_system.close()
+    remove_database("test_feedback.db")
     
     print(f"\n✅ Feedback system test completed!")
     
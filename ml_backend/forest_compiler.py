@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Forest Compiler for Mental Health Companion
+Flattens a trained RandomForestClassifier into NumPy node arrays and evaluates it without sklearn
+"""
+
+import json
+import os
+import shutil
+import time
+import logging
+import numpy as np
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+COMPILED_FOREST_DIRNAME = "mood_predictor_forest"
+COMPILED_FOREST_FORMAT = 2
+FOREST_META_FILENAME = "forest.json"
+
+# Large per-node arrays; opened with mmap_mode so processes share them through the page cache
+NODE_ARRAYS = ('feature', 'threshold', 'left', 'right', 'value')
+
+def _leaf_probabilities(tree) -> np.ndarray:
+    """Per-node class probabilities exactly as DecisionTreeClassifier.predict_proba returns them"""
+    import sklearn
+
+    value = tree.tree_.value[:, 0, :tree.n_classes_].astype(np.float64, copy=True)
+    major, minor = (int(part) for part in sklearn.__version__.split('.')[:2])
+    if (major, minor) < (1, 4):
+        # Older releases store class counts and normalise at predict time
+        normalizer = value.sum(axis=1)[:, np.newaxis]
+        normalizer[normalizer == 0.0] = 1.0
+        value /= normalizer
+    return value
+
+def _scaler_casts_parameters(scaler) -> bool:
+    """Whether this sklearn casts mean_/scale_ to the input dtype before scaling
+
+    Recent releases do (float32 arithmetic for float32 input); older ones
+    subtract the float64 parameters. Probing the fitted scaler once tells us
+    which formula reproduces it exactly.
+    """
+    probe = np.random.default_rng(0).normal(size=(64, scaler.n_features_in_)).astype(np.float32) * 10
+    expected = scaler.transform(probe)
+    cast = probe.copy()
+    if scaler.with_mean:
+        cast -= scaler.mean_.astype(np.float32)
+    if scaler.with_std:
+        cast /= scaler.scale_.astype(np.float32)
+    return np.array_equal(cast, expected)
+
+def export_forest(model, path: str, scaler=None, schema_fingerprint: str = "") -> str:
+    """Flatten ``model`` (and optionally its StandardScaler) into a directory of .npy files
+
+    Nodes of all trees are concatenated; ``left``/``right`` hold global node
+    indices and leaves point at themselves, so evaluation can step every
+    (row, tree) pair ``max_depth`` times without branching on leaves. Each
+    array is a plain uncompressed .npy file so it can be memory-mapped.
+    """
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        n_nodes = tree.node_count
+        node_ids = np.arange(n_nodes, dtype=np.int32)
+        is_leaf = tree.children_left == -1
+
+        features.append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+        thresholds.append(np.where(is_leaf, 0.0, tree.threshold).astype(np.float64))
+        lefts.append(np.where(is_leaf, node_ids, tree.children_left).astype(np.int32) + offset)
+        rights.append(np.where(is_leaf, node_ids, tree.children_right).astype(np.int32) + offset)
+        values.append(_leaf_probabilities(estimator))
+        roots.append(offset)
+
+        offset += n_nodes
+        max_depth = max(max_depth, tree.max_depth)
+
+    arrays = {
+        'feature': np.concatenate(features),
+        'threshold': np.concatenate(thresholds),
+        'left': np.concatenate(lefts),
+        'right': np.concatenate(rights),
+        'value': np.concatenate(values),
+        'roots': np.array(roots, dtype=np.int32),
+        'classes': np.asarray(model.classes_)
+    }
+    meta = {
+        'format': COMPILED_FOREST_FORMAT,
+        'max_depth': int(max_depth),
+        'n_features': int(model.n_features_in_),
+        'schema_fingerprint': schema_fingerprint
+    }
+    if scaler is not None:
+        arrays['scaler_mean'] = (np.asarray(scaler.mean_, dtype=np.float64)
+                                 if getattr(scaler, 'with_mean', True) else np.zeros(0))
+        arrays['scaler_scale'] = (np.asarray(scaler.scale_, dtype=np.float64)
+                                  if getattr(scaler, 'with_std', True) else np.zeros(0))
+        meta['scaler_casts_parameters'] = _scaler_casts_parameters(scaler)
+
+    path = os.path.abspath(path)
+    tmp_dir = f"{path}.tmp{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), np.ascontiguousarray(array), allow_pickle=False)
+    with open(os.path.join(tmp_dir, FOREST_META_FILENAME), 'w') as f:
+        json.dump(meta, f, indent=2)
+    _replace_directory(tmp_dir, path)
+    return path
+
+def _replace_directory(src: str, dst: str):
+    """Move a fully written directory into place
+
+    Processes that already mapped the old files keep valid mappings after
+    the old directory is removed.
+    """
+    if os.path.isdir(dst):
+        old_dir = f"{dst}.old{os.getpid()}"
+        os.rename(dst, old_dir)
+        os.rename(src, dst)
+        shutil.rmtree(old_dir, ignore_errors=True)
+    else:
+        os.rename(src, dst)
+
+def export_legacy_forest(models_dir: str = "models") -> Optional[str]:
+    """Compile ``models_dir/mood_predictor.joblib`` (pre-registry layout) if its forest is missing or stale
+
+    A one-off step for deploy or training time
+    (``python forest_compiler.py export-legacy [models_dir]``); servers only
+    open the result. Registry versions are compiled by ModelRegistry.publish.
+    Returns the forest directory, or None when there is no forest model.
+    """
+    import joblib
+
+    model_path = os.path.join(models_dir, "mood_predictor.joblib")
+    forest_dir = os.path.join(models_dir, COMPILED_FOREST_DIRNAME)
+    if not os.path.exists(model_path):
+        return None
+    if os.path.isdir(forest_dir) and os.path.getmtime(forest_dir) >= os.path.getmtime(model_path):
+        return forest_dir
+    model = joblib.load(model_path)
+    if not hasattr(model, 'estimators_'):
+        return None
+    export_forest(model, forest_dir)
+    logger.info(f"Exported compiled forest to {forest_dir}")
+    return forest_dir
+
+class CompiledForest:
+    """Vectorized evaluator over the arrays written by export_forest
+
+    ``predict_proba`` matches RandomForestClassifier.predict_proba bit for
+    bit: inputs are cast to float32, compared against float64 thresholds,
+    and per-tree probabilities are added in estimator order before dividing
+    by the number of trees (sklearn with ``n_jobs > 1`` may add in a
+    different order and differ in the last ulp).
+    """
+
+    def __init__(self, arrays, meta, mmap_mode: Optional[str] = None):
+        self.feature = arrays['feature']
+        self.threshold = arrays['threshold']
+        self.left = arrays['left']
+        self.right = arrays['right']
+        self.value = arrays['value']
+        self.roots = arrays['roots']
+        self.classes_ = arrays['classes']
+        self.max_depth = meta['max_depth']
+        self.n_features = meta['n_features']
+        self.schema_fingerprint = meta['schema_fingerprint']
+        self.n_estimators = len(self.roots)
+        self.mmap_mode = mmap_mode
+
+        self.scaler_mean = arrays.get('scaler_mean')
+        self.scaler_scale = arrays.get('scaler_scale')
+        self.scaler_casts_parameters = meta.get('scaler_casts_parameters', False)
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: Optional[str] = None) -> 'CompiledForest':
+        """Open a compiled forest; with ``mmap_mode='r'`` node arrays stay on disk, shared read-only"""
+        with open(os.path.join(path, FOREST_META_FILENAME)) as f:
+            meta = json.load(f)
+        if meta.get('format') != COMPILED_FOREST_FORMAT:
+            raise ValueError(f"Unsupported compiled forest format {meta.get('format')}")
+
+        arrays = {}
+        for filename in os.listdir(path):
+            if not filename.endswith('.npy'):
+                continue
+            name = filename[:-4]
+            array = np.load(os.path.join(path, filename), allow_pickle=False,
+                            mmap_mode=mmap_mode if name in NODE_ARRAYS else None)
+            # Plain ndarray view of the mapping: fancy indexing then yields ordinary arrays
+            arrays[name] = array.view(np.ndarray)
+        return cls(arrays, meta, mmap_mode)
+
+    @property
+    def has_scaler(self) -> bool:
+        return self.scaler_mean is not None
+
+    def transform(self, X) -> np.ndarray:
+        """Apply the exported StandardScaler the way sklearn does (same dtype, same op order)"""
+        X = np.array(X, copy=True)
+        if X.dtype not in (np.float32, np.float64):
+            X = X.astype(np.float64)
+        if self.scaler_mean is not None and self.scaler_mean.size:
+            X -= self.scaler_mean.astype(X.dtype) if self.scaler_casts_parameters else self.scaler_mean
+        if self.scaler_scale is not None and self.scaler_scale.size:
+            X /= self.scaler_scale.astype(X.dtype) if self.scaler_casts_parameters else self.scaler_scale
+        return X
+
+    def predict_proba(self, X) -> np.ndarray:
+        """Mean class probabilities over all trees for each row of X"""
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != self.n_features:
+            raise ValueError(f"X has {X.shape[1]} features, the forest expects {self.n_features}")
+        if np.isnan(X).any():
+            raise ValueError("Compiled forest does not handle NaN inputs")
+
+        n_rows = X.shape[0]
+        rows = np.arange(n_rows)[:, np.newaxis]
+        nodes = np.repeat(self.roots[np.newaxis, :], n_rows, axis=0)
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+
+        # add.accumulate sums sequentially, i.e. in the same order as sklearn's loop
+        proba = np.add.accumulate(self.value[nodes], axis=1)[:, -1].copy()
+        proba /= self.n_estimators
+        return proba
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1), axis=0)
+
+def load_compiled_forest(path: str, schema_fingerprint: Optional[str] = None,
+                         mmap_mode: Optional[str] = None) -> Optional[CompiledForest]:
+    """Load a compiled forest if present (None when missing or built for another schema)"""
+    if not os.path.isdir(path):
+        return None
+    try:
+        forest = CompiledForest.load(path, mmap_mode)
+    except Exception as e:
+        logger.warning(f"Could not load compiled forest {path}: {e}")
+        return None
+    if schema_fingerprint is not None and forest.schema_fingerprint != schema_fingerprint:
+        logger.warning(f"Compiled forest {path} was built for another feature schema")
+        return None
+    return forest
+
+def test_forest_compiler():
+    """Test the forest compiler"""
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.preprocessing import StandardScaler
+
+    print("🌲 Testing Forest Compiler")
+    print("=" * 40)
+
+    rng = np.random.default_rng(7)
+    X = rng.normal(size=(600, 20)).astype(np.float32)
+    y = (X[:, 0] * 3 + X[:, 1] + rng.normal(size=600)).round().clip(-3, 3).astype(int) + 5
+
+    scaler = StandardScaler().fit(X)
+    model = RandomForestClassifier(n_estimators=50, max_depth=8, min_samples_leaf=2,
+                                   random_state=42).fit(scaler.transform(X), y)
+
+    export_forest(model, "test_forest", scaler=scaler, schema_fingerprint="test")
+    forest = load_compiled_forest("test_forest", "test", mmap_mode='r')
+
+    X_test = rng.normal(size=(257, 20)).astype(np.float32)
+    X_scaled = scaler.transform(X_test)
+    assert np.array_equal(forest.transform(X_test), X_scaled)
+    assert np.array_equal(forest.predict_proba(X_scaled), model.predict_proba(X_scaled))
+    assert np.array_equal(forest.predict(X_scaled), model.predict(X_scaled))
+    assert load_compiled_forest("test_forest", "other") is None
+    print(f"   {forest.n_estimators} trees, {len(forest.feature)} nodes: predict_proba matches exactly")
+
+    # Re-exporting swaps the directory; the mapped forest keeps working
+    export_forest(model, "test_forest", scaler=scaler, schema_fingerprint="test")
+    assert np.array_equal(forest.predict_proba(X_scaled), model.predict_proba(X_scaled))
+
+    shutil.rmtree("test_forest")
+
+    # Legacy models directories are compiled once, by the CLI step, and left alone while fresh
+    import joblib
+    os.makedirs("test_legacy_models", exist_ok=True)
+    joblib.dump(model, os.path.join("test_legacy_models", "mood_predictor.joblib"))
+    forest_dir = export_legacy_forest("test_legacy_models")
+    exported_at = os.path.getmtime(forest_dir)
+    assert export_legacy_forest("test_legacy_models") == forest_dir and os.path.getmtime(forest_dir) == exported_at
+    assert np.array_equal(load_compiled_forest(forest_dir).predict(X_scaled), model.predict(X_scaled))
+    assert export_legacy_forest("missing_models") is None
+    shutil.rmtree("test_legacy_models")
+    print("✅ Forest compiler test completed!")
+    return forest
+
+def benchmark_forest_compiler(n_estimators=200, max_depth=15):
+    """Per-call latency of sklearn vs the compiled evaluator for the mood model's shape"""
+    from sklearn.ensemble import RandomForestClassifier
+
+    print("⏱️ Benchmarking Forest Compiler")
+    print("=" * 40)
+
+    rng = np.random.default_rng(42)
+    X = rng.normal(size=(2000, 74)).astype(np.float32)
+    y = rng.integers(1, 11, size=2000)
+    model = RandomForestClassifier(n_estimators=n_estimators, max_depth=max_depth,
+                                   min_samples_split=5, min_samples_leaf=2, random_state=42).fit(X, y)
+    export_forest(model, "bench_forest")
+    forest = CompiledForest.load("bench_forest", mmap_mode='r')
+
+    for batch_size in [1, 32, 256]:
+        batch = X[:batch_size]
+        assert np.array_equal(forest.predict_proba(batch), model.predict_proba(batch))
+        timings = {}
+        for name, predict in [('sklearn', model.predict_proba), ('compiled', forest.predict_proba)]:
+            repeats = max(5, 200 // batch_size)
+            start = time.perf_counter()
+            for _ in range(repeats):
+                predict(batch)
+            timings[name] = (time.perf_counter() - start) / repeats * 1000
+        print(f"   batch {batch_size:>3}: sklearn {timings['sklearn']:7.2f} ms, "
+              f"compiled {timings['compiled']:7.2f} ms")
+
+    shutil.rmtree("bench_forest")
+
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:2] == ['export-legacy']:
+        # python forest_compiler.py export-legacy [models_dir]
+        logging.basicConfig(level=logging.INFO)
+        forest_dir = export_legacy_forest(sys.argv[2] if len(sys.argv) > 2 else "models")
+        print(f"✅ Compiled forest: {forest_dir}" if forest_dir else "⚠️ No forest model to compile")
+    else:
+        forest = test_forest_compiler()
+        benchmark_forest_compiler()
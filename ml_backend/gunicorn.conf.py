@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Gunicorn Configuration for Mental Health Companion
+Preloads the app in the master so workers share model pages, and reports per-worker memory at startup
+"""
+
+import os
+import threading
+import time
+
+from process_memory import format_memory, memory_report, read_process_memory
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '4'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+
+# Import the app (and load models) once in the master; forked workers share
+# those pages copy-on-write and the memory-mapped model arrays via the page cache
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+# Seconds to wait for every worker to boot before logging the memory report
+MEMORY_REPORT_TIMEOUT = float(os.getenv('GUNICORN_MEMORY_REPORT_TIMEOUT', '60'))
+
+def _report_worker_memory(server):
+    """Log master and per-worker memory once all workers are up"""
+    deadline = time.monotonic() + MEMORY_REPORT_TIMEOUT
+    while len(server.WORKERS) < server.num_workers and time.monotonic() < deadline:
+        time.sleep(0.5)
+
+    # Without preload each worker imports the app after it is spawned: wait until RSS settles
+    report = memory_report(list(server.WORKERS))
+    while time.monotonic() < deadline:
+        time.sleep(1)
+        previous, report = report, memory_report(list(server.WORKERS))
+        if report.keys() == previous.keys() and all(
+            abs(report[pid]['rss_mb'] - previous[pid]['rss_mb']) < 1.0 for pid in report
+        ):
+            break
+
+    master = read_process_memory()
+    server.log.info(f"Memory report (preload_app={preload_app}, {len(report)} workers)")
+    server.log.info(f"  master {os.getpid()}: {format_memory(master)}")
+    for pid, memory in sorted(report.items()):
+        server.log.info(f"  worker {pid}: {format_memory(memory)}")
+
+    if all('pss_mb' in memory for memory in report.values()) and 'pss_mb' in master:
+        total_pss = master['pss_mb'] + sum(memory['pss_mb'] for memory in report.values())
+        total_rss = master['rss_mb'] + sum(memory['rss_mb'] for memory in report.values())
+        server.log.info(f"  total: pss {total_pss:.1f} MB (rss sum {total_rss:.1f} MB)")
+
+def when_ready(server):
+    server.log.info(f"Master ready: {format_memory(read_process_memory())}")
+    threading.Thread(target=_report_worker_memory, args=(server,),
+                     name="memory-report", daemon=True).start()
+
+def post_worker_init(worker):
+    worker.log.info(f"Worker {worker.pid} booted: {format_memory(read_process_memory())}")
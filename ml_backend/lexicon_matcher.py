@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Lexicon Matcher for Mental Health Companion
+Scores many word lists against journal text in a single pass over the tokens
+"""
+
+import re
+import numpy as np
+from typing import Dict, Iterable, List, Optional
+
+# Same boundaries as the regex \b...\b, so "like" never matches inside "unlikely"
+TOKEN_PATTERN = re.compile(r'\w+')
+
+class LexiconMatcher:
+    """Compiled token index over several lexicons
+
+    Every lexicon term maps to the slots it belongs to, so scoring a note is a
+    dictionary lookup per token and the cost does not grow with lexicon size.
+    ``presence_lexicons`` count how many distinct terms appear in the text;
+    ``occurrence_lexicons`` count every occurrence (e.g. pronouns).
+    """
+
+    def __init__(self, presence_lexicons: Dict[str, Iterable[str]],
+                 occurrence_lexicons: Optional[Dict[str, Iterable[str]]] = None):
+        occurrence_lexicons = occurrence_lexicons or {}
+        self.names: List[str] = list(presence_lexicons) + list(occurrence_lexicons)
+
+        presence_slots = {}
+        occurrence_slots = {}
+        for slot, name in enumerate(self.names):
+            if name in presence_lexicons:
+                words, target = presence_lexicons[name], presence_slots
+            else:
+                words, target = occurrence_lexicons[name], occurrence_slots
+            for word in words:
+                target.setdefault(word.lower(), []).append(slot)
+
+        # token -> (slots counted once per note, slots counted per occurrence)
+        self._index = {
+            token: (tuple(presence_slots.get(token, ())), tuple(occurrence_slots.get(token, ())))
+            for token in set(presence_slots) | set(occurrence_slots)
+        }
+
+    def _score_into(self, text, counts):
+        """Accumulate lexicon counts for one text into ``counts``"""
+        index = self._index
+        seen = set()
+        for token in TOKEN_PATTERN.findall(text.lower()):
+            hit = index.get(token)
+            if hit is None:
+                continue
+            presence, occurrence = hit
+            if presence and token not in seen:
+                seen.add(token)
+                for slot in presence:
+                    counts[slot] += 1
+            for slot in occurrence:
+                counts[slot] += 1
+        return counts
+
+    def score(self, text: str) -> Dict[str, int]:
+        """Score a single text against all lexicons"""
+        counts = self._score_into(text or '', [0] * len(self.names))
+        return dict(zip(self.names, counts))
+
+    def score_many(self, texts: Iterable[str]) -> np.ndarray:
+        """Score many texts at once; returns an (n_texts, n_lexicons) int array"""
+        rows = [self._score_into(text or '', [0] * len(self.names)) for text in texts]
+        if not rows:
+            return np.zeros((0, len(self.names)), dtype=np.int64)
+        return np.array(rows, dtype=np.int64)
+
+def test_lexicon_matcher():
+    """Test the lexicon matcher"""
+    print("🔤 Testing Lexicon Matcher")
+    print("=" * 40)
+
+    matcher = LexiconMatcher(
+        {'positive': ['like', 'good', 'calm'], 'negative': ['bad', 'sad']},
+        {'pronouns': ['i', 'me', 'my']}
+    )
+
+    scores = matcher.score("I like it. I'm calm, not sad -- unlikely to feel bad. Good good good")
+    print(f"   Scores: {scores}")
+    assert scores == {'positive': 3, 'negative': 2, 'pronouns': 2}
+    assert matcher.score("That seems unlikely")['positive'] == 0
+
+    batch = matcher.score_many(["my my my", "", "sad and bad"])
+    print(f"   Batch scores:\n{batch}")
+    assert batch.tolist() == [[0, 0, 3], [0, 0, 0], [0, 2, 0]]
+
+    print("✅ Lexicon matcher test completed!")
+    return matcher
+
+if __name__ == "__main__":
+    matcher = test_lexicon_matcher()
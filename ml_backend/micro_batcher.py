@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Micro-Batcher for Mental Health Companion
+Groups concurrent inference requests so the model runs once per batch instead of once per request
+"""
+
+import functools
+import os
+import threading
+import time
+import weakref
+import logging
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+def _call_weak(ref, method_name):
+    obj = ref()
+    if obj is not None:
+        getattr(obj, method_name)()
+
+def weak_method(obj, method_name: str) -> Callable[[], None]:
+    """Zero-argument callable running ``obj.<method_name>()`` while ``obj`` is alive
+
+    Only a weak reference is held, so process-lifetime hooks (at fork, at
+    exit) do not keep the object alive.
+    """
+    return functools.partial(_call_weak, weakref.ref(obj), method_name)
+
+def register_after_fork(obj, method_name: str = '_after_fork'):
+    """Run ``obj.<method_name>()`` in every forked child (gunicorn ``--preload`` workers)
+
+    Threads do not survive fork and a lock may be held by a thread that is
+    gone, so the hook restarts threads and replaces locks.
+    """
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=weak_method(obj, method_name))
+
+class MicroBatcher:
+    """Collect requests for up to ``max_wait_ms`` or ``max_batch_size`` items
+
+    A single worker thread takes the first waiting request, keeps collecting
+    until the batch is full or the wait window closes, then calls
+    ``process_batch(items)`` once. That call must return one result per item,
+    in order; each caller's Future gets its result (or the batch's exception).
+    An exception instance returned in place of a result fails only that item.
+    A request therefore waits at most ``max_wait_ms`` plus one batch run.
+    The worker is restarted in forked children (gunicorn ``--preload``).
+    """
+
+    def __init__(self, process_batch: Callable[[List[Any]], List[Any]],
+                 max_batch_size: int = 32, max_wait_ms: float = 2.0, name: str = "micro-batcher"):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+
+        self._pending = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+
+        # Batch statistics
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+
+        self.name = name
+        self._start_worker()
+        register_after_fork(self)
+
+    def _start_worker(self):
+        self._worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._worker.start()
+
+    def _after_fork(self):
+        """Only the forking thread survives fork; requests queued in the parent belong to the parent"""
+        self._pending = deque()
+        self._condition = threading.Condition()
+        if not self._closed:
+            self._start_worker()
+
+    def submit(self, item: Any) -> Future:
+        """Queue one item; the returned Future resolves when its batch has run"""
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("MicroBatcher is closed")
+            self._pending.append((item, future))
+            self._condition.notify()
+        return future
+
+    def process(self, item: Any, timeout: Optional[float] = None) -> Any:
+        """Submit an item and wait for its result"""
+        return self.submit(item).result(timeout)
+
+    def _next_batch(self):
+        """Block for the first item, then gather more until full or the window closes"""
+        with self._condition:
+            while not self._pending and not self._closed:
+                self._condition.wait()
+            if not self._pending:
+                return None
+
+            deadline = time.monotonic() + self.max_wait
+            while len(self._pending) < self.max_batch_size and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            size = min(len(self._pending), self.max_batch_size)
+            return [self._pending.popleft() for _ in range(size)]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            # Skip requests whose callers gave up (Future cancelled)
+            batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            try:
+                results = self.process_batch([item for item, _ in batch])
+                if len(results) != len(batch):
+                    raise ValueError(f"process_batch returned {len(results)} results for {len(batch)} items")
+            except Exception as e:
+                logger.error(f"Micro-batch of {len(batch)} failed: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    if isinstance(result, BaseException):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+
+            self.batches += 1
+            self.items += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+
+    def get_stats(self):
+        """Batching statistics"""
+        return {
+            'batches': self.batches,
+            'items': self.items,
+            'avg_batch_size': self.items / self.batches if self.batches else 0.0,
+            'largest_batch': self.largest_batch,
+            'pending': len(self._pending),
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000
+        }
+
+    def close(self, timeout: Optional[float] = 5.0):
+        """Stop accepting work, drain what is queued and stop the worker"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._worker.join(timeout)
+
+def batcher_from_env(process_batch: Callable[[List[Any]], List[Any]], name: str = "micro-batcher") -> MicroBatcher:
+    """MicroBatcher sized by PREDICTION_BATCH_SIZE / PREDICTION_BATCH_WAIT_MS"""
+    return MicroBatcher(
+        process_batch,
+        max_batch_size=int(os.getenv('PREDICTION_BATCH_SIZE', '32')),
+        max_wait_ms=float(os.getenv('PREDICTION_BATCH_WAIT_MS', '2')),
+        name=name
+    )
+
+def test_micro_batcher():
+    """Test the micro-batcher"""
+    print("📦 Testing Micro-Batcher")
+    print("=" * 40)
+
+    calls = []
+
+    def square_all(items):
+        calls.append(len(items))
+        return [item * item if item >= 0 else ValueError(f"negative: {item}") for item in items]
+
+    batcher = MicroBatcher(square_all, max_batch_size=8, max_wait_ms=20)
+    futures = [batcher.submit(i) for i in range(20)]
+    results = [future.result(timeout=5) for future in futures]
+    assert results == [i * i for i in range(20)]
+    assert max(calls) <= 8 and len(calls) < 20
+    print(f"   Batch sizes: {calls}")
+
+    # A per-item failure does not fail the rest of its batch
+    futures = [batcher.submit(i) for i in (-1, 2)]
+    assert isinstance(futures[0].exception(timeout=5), ValueError) and futures[1].result(timeout=5) == 4
+
+    def broken(items):
+        raise RuntimeError("model unavailable")
+
+    failing = MicroBatcher(broken, max_batch_size=4, max_wait_ms=1)
+    try:
+        failing.process(1, timeout=5)
+        raise AssertionError("exception was not propagated")
+    except RuntimeError as e:
+        print(f"   Propagated: {e}")
+
+    # A forked child (gunicorn --preload worker) gets its own running worker
+    if hasattr(os, 'fork'):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os._exit(0 if batcher.process(3, timeout=5) == 9 else 1)
+            except BaseException:
+                os._exit(1)
+        _, status = os.waitpid(pid, 0)
+        assert os.waitstatus_to_exitcode(status) == 0, "batcher is not usable after fork"
+        print("   Forked child served its own batch")
+
+    batcher.close()
+    failing.close()
+    print(f"   Stats: {batcher.get_stats()}")
+    print("✅ Micro-batcher test completed!")
+    return batcher
+
+def benchmark_micro_batcher(num_requests=2000, concurrency=32):
+    """Throughput and p99 latency of RandomForest inference at several batch sizes"""
+    import numpy as np
+    from concurrent.futures import ThreadPoolExecutor
+    from sklearn.ensemble import RandomForestClassifier
+
+    print("⏱️ Benchmarking Micro-Batcher")
+    print("=" * 40)
+
+    rng = np.random.default_rng(42)
+    X = rng.normal(size=(2000, 74)).astype(np.float32)
+    y = rng.integers(1, 11, size=2000)
+    model = RandomForestClassifier(n_estimators=200, max_depth=15, random_state=42).fit(X, y)
+
+    def predict_rows(batch):
+        probabilities = model.predict_proba(np.stack(batch))
+        labels = model.classes_[probabilities.argmax(axis=1)]
+        return list(zip(labels.tolist(), probabilities.max(axis=1).tolist()))
+
+    for batch_size in [1, 8, 32]:
+        batcher = MicroBatcher(predict_rows, max_batch_size=batch_size, max_wait_ms=2)
+        latencies = []
+
+        def request(i):
+            start = time.perf_counter()
+            batcher.process(X[i % len(X)], timeout=30)
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(request, range(num_requests)))
+        elapsed = time.perf_counter() - start
+        batcher.close()
+
+        stats = batcher.get_stats()
+        print(f"   batch<={batch_size:>2}: {num_requests / elapsed:8.0f} req/s, "
+              f"p99 {np.percentile(latencies, 99) * 1000:6.1f} ms, "
+              f"avg batch {stats['avg_batch_size']:.1f}")
+
+if __name__ == "__main__":
+    batcher = test_micro_batcher()
+    benchmark_micro_batcher()
@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+Model Registry for Mental Health Companion
+One immutable model bundle per process, swapped atomically on publish and refreshed from the models directory
+"""
+
+import json
+import os
+import shutil
+import threading
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from feature_schema import FEATURE_SCHEMA, FeatureSchema, load_feature_schema
+from forest_compiler import COMPILED_FOREST_DIRNAME, CompiledForest, export_forest, load_compiled_forest
+from micro_batcher import register_after_fork
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = "active_model.json"
+VERSIONS_DIRNAME = "versions"
+
+def model_mmap_mode() -> Optional[str]:
+    """mmap mode for model arrays: 'r' (shared, read-only pages) unless MODEL_MMAP=false"""
+    return 'r' if os.getenv('MODEL_MMAP', 'true').lower() == 'true' else None
+
+def active_model_dir(models_dir: str = "models") -> str:
+    """Directory holding the active version's artifacts (models_dir itself before the registry)"""
+    try:
+        with open(os.path.join(models_dir, MANIFEST_FILENAME)) as f:
+            return os.path.join(models_dir, json.load(f)['path'])
+    except (FileNotFoundError, KeyError, ValueError):
+        return models_dir
+
+def load_joblib(path: str):
+    """joblib.load with numpy payloads memory-mapped when MODEL_MMAP is on"""
+    import joblib
+    return joblib.load(path, mmap_mode=model_mmap_mode())
+
+@dataclass(frozen=True)
+class ModelBundle:
+    """Everything needed to serve one model version
+
+    ``model`` is a CompiledForest (which applies its own exported scaling,
+    ``scaler`` is then None) or, for artifacts without a compiled forest, a
+    fitted sklearn classifier paired with its StandardScaler.
+    """
+    model: Any
+    scaler: Any
+    schema: FeatureSchema
+    version: str
+    published_at: datetime = field(default_factory=datetime.now)
+
+    @property
+    def classes_(self) -> np.ndarray:
+        return self.model.classes_
+
+    def predict_proba(self, X) -> np.ndarray:
+        """Scale schema rows and return class probabilities"""
+        if self.scaler is None:
+            return self.model.predict_proba(self.model.transform(X))
+        return self.model.predict_proba(self.scaler.transform(X))
+
+class ModelRegistry:
+    """Holds the active ModelBundle for a models directory
+
+    Readers call ``current()``, a plain attribute read with no locking; a
+    bundle is never mutated, so a reader keeps a consistent (model, scaler,
+    schema, version) for as long as it holds the reference. ``publish``
+    writes an immutable ``versions/<version>/`` directory, points
+    ``active_model.json`` at it (atomic rename; the only "current" pointer)
+    and swaps the in-process bundle. The newest ``keep_versions`` versions
+    are kept on disk; older ones are deleted after each publish. Other processes see the manifest change through ``refresh()``
+    or the background watcher. Compiled forests are memory-mapped, so
+    gunicorn workers share one copy of each version in the page cache; a
+    watcher started before a fork (``--preload``) is restarted in the child.
+    """
+
+    def __init__(self, models_dir: str = "models", keep_versions: Optional[int] = None):
+        self.models_dir = models_dir
+        self.keep_versions = max(1, keep_versions if keep_versions is not None
+                                 else int(os.getenv('MODEL_KEEP_VERSIONS', '5')))
+        self._bundle: Optional[ModelBundle] = None
+        self._publish_lock = threading.Lock()
+        self._listeners: List[Callable[[ModelBundle], None]] = []
+        self._manifest_stamp = None
+
+        self._watch_thread = None
+        self._watch_interval = None
+        self._stop_watching = threading.Event()
+        register_after_fork(self)
+
+    # Readers
+    def current(self) -> Optional[ModelBundle]:
+        """Active bundle (None until a model is loaded or published)"""
+        return self._bundle
+
+    @property
+    def version(self) -> Optional[str]:
+        bundle = self._bundle
+        return bundle.version if bundle else None
+
+    def subscribe(self, callback: Callable[[ModelBundle], None]):
+        """Call ``callback(bundle)`` after every swap"""
+        self._listeners.append(callback)
+
+    # Writers
+    def publish(self, model, scaler, version: Optional[str] = None,
+                schema: FeatureSchema = FEATURE_SCHEMA) -> ModelBundle:
+        """Persist a newly trained model and make it the active bundle"""
+        version = version or f"v{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+        with self._publish_lock:
+            version_dir = self._version_dir(version)
+            self._write_artifacts(version_dir, model, scaler, schema)
+
+            published_at = datetime.now()
+            self._write_manifest({
+                'version': version,
+                'path': os.path.join(VERSIONS_DIRNAME, version),
+                'schema_fingerprint': schema.fingerprint,
+                'published_at': published_at.isoformat()
+            })
+
+            bundle = ModelBundle(
+                model=CompiledForest.load(os.path.join(version_dir, COMPILED_FOREST_DIRNAME),
+                                          model_mmap_mode()),
+                scaler=None,
+                schema=schema,
+                version=version,
+                published_at=published_at
+            )
+            self._swap(bundle)
+            self._prune_versions(keep=version)
+        logger.info(f"Published model {version}")
+        return bundle
+
+    def load(self) -> Optional[ModelBundle]:
+        """Load the active version from disk and swap it in
+
+        Raises FeatureSchemaMismatch for artifacts built for another layout.
+        """
+        with self._publish_lock:
+            manifest = self._read_manifest()
+            if manifest is not None:
+                bundle = self._load_version(manifest)
+            else:
+                bundle = self._load_legacy()
+            if bundle is not None:
+                self._swap(bundle)
+            return bundle
+
+    def refresh(self) -> bool:
+        """Swap in a version published by another process; True if it changed"""
+        stamp = self._stat_manifest()
+        if stamp is None or stamp == self._manifest_stamp:
+            return False
+        manifest = self._read_manifest()
+        if manifest is None or manifest['version'] == self.version:
+            self._manifest_stamp = stamp
+            return False
+        try:
+            with self._publish_lock:
+                bundle = self._load_version(manifest)
+                self._swap(bundle)
+            logger.info(f"Picked up model {bundle.version} from {self.models_dir}")
+            return True
+        except Exception as e:
+            logger.error(f"Could not load model {manifest.get('version')}: {e}")
+            self._manifest_stamp = stamp
+            return False
+
+    def start_watching(self, interval: Optional[float] = None):
+        """Poll the manifest in a daemon thread (MODEL_WATCH_INTERVAL seconds, default 5)"""
+        if self._watch_thread and self._watch_thread.is_alive():
+            return
+        interval = interval if interval is not None else float(os.getenv('MODEL_WATCH_INTERVAL', '5'))
+        self._watch_interval = interval
+        self._stop_watching.clear()
+        self._watch_thread = threading.Thread(target=self._watch_loop, args=(interval,),
+                                              name="model-registry-watcher", daemon=True)
+        self._watch_thread.start()
+
+    def stop_watching(self):
+        self._watch_interval = None
+        self._stop_watching.set()
+        if self._watch_thread:
+            self._watch_thread.join(timeout=5)
+
+    def get_status(self) -> Dict:
+        bundle = self._bundle
+        return {
+            'version': bundle.version if bundle else None,
+            'published_at': bundle.published_at.isoformat() if bundle else None,
+            'compiled': bundle is not None and bundle.scaler is None,
+            'memory_mapped': bundle is not None and getattr(bundle.model, 'mmap_mode', None) is not None,
+            'watching': bool(self._watch_thread and self._watch_thread.is_alive())
+        }
+
+    # Internals
+    def _after_fork(self):
+        """Threads do not survive fork: fresh lock, and restart the watcher if it was running"""
+        self._publish_lock = threading.Lock()
+        self._stop_watching = threading.Event()
+        self._watch_thread = None
+        if self._watch_interval is not None:
+            self.start_watching(self._watch_interval)
+
+    def _watch_loop(self, interval: float):
+        while not self._stop_watching.wait(interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Model watcher error: {e}")
+
+    def _swap(self, bundle: ModelBundle):
+        self._bundle = bundle  # single reference assignment: atomic for readers
+        self._manifest_stamp = self._stat_manifest()
+        for callback in list(self._listeners):
+            try:
+                callback(bundle)
+            except Exception as e:
+                logger.error(f"Model registry listener failed: {e}")
+
+    def _version_dir(self, version: str) -> str:
+        return os.path.join(self.models_dir, VERSIONS_DIRNAME, version)
+
+    def version_path(self, version: str) -> str:
+        """Directory of a published version's artifacts"""
+        return self._version_dir(version)
+
+    def _prune_versions(self, keep: str):
+        """Delete all but the newest keep_versions version directories (never ``keep``)
+
+        Workers still serving a deleted version keep their mapped pages until
+        they swap; new loads only follow the manifest.
+        """
+        versions_root = os.path.join(self.models_dir, VERSIONS_DIRNAME)
+        try:
+            versions = [entry for entry in os.scandir(versions_root) if entry.is_dir()]
+        except FileNotFoundError:
+            return
+        versions.sort(key=lambda entry: entry.stat().st_mtime_ns, reverse=True)
+        for entry in versions[self.keep_versions:]:
+            if entry.name != keep:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                logger.info(f"Pruned model version {entry.name}")
+
+    def _write_artifacts(self, directory: str, model, scaler, schema: FeatureSchema):
+        import joblib
+
+        os.makedirs(directory, exist_ok=True)
+        for name, obj in [("mood_predictor.joblib", model), ("scaler.joblib", scaler)]:
+            path = os.path.join(directory, name)
+            joblib.dump(obj, f"{path}.tmp")
+            os.replace(f"{path}.tmp", path)
+        schema.save(directory)
+        export_forest(model, os.path.join(directory, COMPILED_FOREST_DIRNAME),
+                      scaler=scaler, schema_fingerprint=schema.fingerprint)
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.models_dir, MANIFEST_FILENAME)
+
+    def _stat_manifest(self):
+        try:
+            stat = os.stat(self._manifest_path())
+            return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        except FileNotFoundError:
+            return None
+
+    def _read_manifest(self) -> Optional[Dict]:
+        try:
+            with open(self._manifest_path()) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_manifest(self, manifest: Dict):
+        path = self._manifest_path()
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(f"{path}.tmp", path)
+
+    def _load_version(self, manifest: Dict) -> ModelBundle:
+        directory = os.path.join(self.models_dir, manifest['path'])
+        schema = load_feature_schema(directory)
+        forest = load_compiled_forest(os.path.join(directory, COMPILED_FOREST_DIRNAME), schema.fingerprint,
+                                      model_mmap_mode())
+        if forest is not None and forest.has_scaler:
+            model, scaler = forest, None
+        else:
+            model = load_joblib(os.path.join(directory, "mood_predictor.joblib"))
+            scaler = load_joblib(os.path.join(directory, "scaler.joblib"))
+            load_feature_schema(directory, model, scaler)
+        published_at = manifest.get('published_at')
+        return ModelBundle(model, scaler, schema, manifest['version'],
+                           datetime.fromisoformat(published_at) if published_at else datetime.now())
+
+    def _load_legacy(self) -> Optional[ModelBundle]:
+        """Artifacts written straight into models_dir before the registry existed"""
+        model_path = os.path.join(self.models_dir, "mood_predictor.joblib")
+        scaler_path = os.path.join(self.models_dir, "scaler.joblib")
+        forest_path = os.path.join(self.models_dir, COMPILED_FOREST_DIRNAME)
+        if not os.path.exists(model_path) and not os.path.exists(forest_path):
+            return None
+
+        schema = load_feature_schema(self.models_dir)
+        forest = None
+        if os.path.exists(forest_path) and (
+            not os.path.exists(model_path) or os.path.getmtime(forest_path) >= os.path.getmtime(model_path)
+        ):
+            forest = load_compiled_forest(forest_path, schema.fingerprint, model_mmap_mode())
+        if forest is not None and forest.has_scaler:
+            return ModelBundle(forest, None, schema, "legacy")
+        if not os.path.exists(scaler_path):
+            return None
+
+        model = load_joblib(model_path)
+        scaler = load_joblib(scaler_path)
+        load_feature_schema(self.models_dir, model, scaler)
+        return ModelBundle(model, scaler, schema, "legacy")
+
+_registries: Dict[str, ModelRegistry] = {}
+_registries_lock = threading.Lock()
+
+def get_model_registry(models_dir: str = "models") -> ModelRegistry:
+    """Process-wide registry for ``models_dir`` shared by every ML component"""
+    key = os.path.abspath(models_dir)
+    with _registries_lock:
+        registry = _registries.get(key)
+        if registry is None:
+            registry = _registries[key] = ModelRegistry(models_dir)
+        return registry
+
+def test_model_registry():
+    """Test the model registry"""
+    import shutil
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.preprocessing import StandardScaler
+
+    print("🗂️ Testing Model Registry")
+    print("=" * 40)
+
+    rng = np.random.default_rng(3)
+    X = rng.normal(size=(300, FEATURE_SCHEMA.size)).astype(np.float32)
+    y = rng.integers(1, 6, size=300)
+
+    def train(seed):
+        scaler = StandardScaler().fit(X)
+        return RandomForestClassifier(n_estimators=10, max_depth=5, random_state=seed).fit(scaler.transform(X), y), scaler
+
+    # Two registries on one directory stand in for two gunicorn workers
+    writer = ModelRegistry("test_registry_models", keep_versions=2)
+    reader = ModelRegistry("test_registry_models")
+    assert reader.load() is None
+
+    swaps = []
+    reader.subscribe(lambda bundle: swaps.append(bundle.version))
+
+    model, scaler = train(1)
+    writer.publish(model, scaler, version="v1")
+    assert reader.refresh() and reader.version == "v1"
+    assert np.array_equal(reader.current().predict_proba(X[:5]), model.predict_proba(scaler.transform(X[:5])))
+
+    held = reader.current()
+    writer.publish(*train(2), version="v2")
+    reader.start_watching(interval=0.05)
+    for _ in range(100):
+        if reader.version == "v2":
+            break
+        threading.Event().wait(0.05)
+    if hasattr(os, 'fork'):
+        # A preloaded gunicorn worker keeps watching after the fork
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if reader.get_status()['watching'] else 1)
+        _, status = os.waitpid(pid, 0)
+        assert os.waitstatus_to_exitcode(status) == 0, "watcher did not survive fork"
+    reader.stop_watching()
+    assert reader.version == "v2" and held.version == "v1"  # old readers keep their bundle
+    print(f"   Swaps seen by reader: {swaps}")
+
+    # Artifacts are written once, under versions/; only the newest keep_versions survive
+    writer.publish(*train(3), version="v3")
+    assert sorted(os.listdir(os.path.join("test_registry_models", VERSIONS_DIRNAME))) == ["v2", "v3"]
+    assert not os.path.exists(os.path.join("test_registry_models", "mood_predictor.joblib"))
+    assert active_model_dir("test_registry_models") == writer.version_path("v3")
+    assert reader.refresh() and reader.version == "v3"
+    print(f"   Status: {reader.get_status()}")
+
+    shutil.rmtree("test_registry_models")
+    print("✅ Model registry test completed!")
+    return reader
+
+if __name__ == "__main__":
+    registry = test_model_registry()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Mood History Tracking for Mental Health Companion
+Per-user rolling state that turns mood history into features in O(1) per entry
+"""
+
+import json
+import math
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from sqlite_storage import get_storage, remove_database
+
+DEFAULT_HISTORY_FEATURES = {
+    'mood_trend': 0,
+    'mood_volatility': 0,
+    'entry_frequency': 1,
+    'mood_momentum': 0,
+    'mood_consistency': 0,
+    'mood_recovery': 0
+}
+
+class MoodHistoryState:
+    """Rolling summary of one user's mood history
+
+    Keeps exponentially weighted mean/variance, a fast EWMA for momentum, a
+    ring buffer of the last ``window`` moods, the EWMA of the gap between
+    entries and the time of the last low, so each update is constant time.
+    """
+
+    def __init__(self, window=7, alpha=0.3, fast_alpha=0.6, low_threshold=3, recovered_threshold=5):
+        self.window = window
+        self.alpha = alpha
+        self.fast_alpha = fast_alpha
+        self.low_threshold = low_threshold
+        self.recovered_threshold = recovered_threshold
+
+        self.count = 0
+        self.mean = 0.0
+        self.var = 0.0
+        self.fast_mean = 0.0
+        self.recent = deque(maxlen=window)
+        self.last_timestamp = None
+        self.interval_days = None
+        self.last_low_timestamp = None
+        self.in_low = False
+        self.recovery_days = None
+
+    def update(self, mood: float, timestamp: Optional[datetime] = None):
+        """Fold one mood entry into the state"""
+        mood = float(mood)
+        if self.count == 0:
+            self.mean = mood
+            self.fast_mean = mood
+            self.var = 0.0
+        else:
+            # Exponentially weighted mean/variance (incremental form)
+            diff = mood - self.mean
+            increment = self.alpha * diff
+            self.mean += increment
+            self.var = (1 - self.alpha) * (self.var + diff * increment)
+            self.fast_mean += self.fast_alpha * (mood - self.fast_mean)
+        self.count += 1
+        self.recent.append(mood)
+
+        if timestamp is not None:
+            if self.last_timestamp is not None:
+                gap = max((timestamp - self.last_timestamp).total_seconds() / 86400, 0.0)
+                self.interval_days = gap if self.interval_days is None else (
+                    self.interval_days + self.alpha * (gap - self.interval_days)
+                )
+            self.last_timestamp = timestamp
+
+        # Track lows and how long it takes to climb back out of them
+        if mood <= self.low_threshold:
+            if not self.in_low:
+                self.last_low_timestamp = timestamp
+            self.in_low = True
+        elif self.in_low and mood >= self.recovered_threshold:
+            self.in_low = False
+            if timestamp is not None and self.last_low_timestamp is not None:
+                days = (timestamp - self.last_low_timestamp).total_seconds() / 86400
+                self.recovery_days = days if self.recovery_days is None else (
+                    self.recovery_days + self.alpha * (days - self.recovery_days)
+                )
+
+    def features(self, timestamp: Optional[datetime] = None) -> Dict[str, float]:
+        """History features for an entry made after everything seen so far"""
+        if self.count == 0:
+            return dict(DEFAULT_HISTORY_FEATURES)
+
+        recent = list(self.recent)
+        n = len(recent)
+        recent_mean = sum(recent) / n
+        if n >= 2:
+            x_mean = (n - 1) / 2
+            slope_num = sum((i - x_mean) * (value - recent_mean) for i, value in enumerate(recent))
+            slope_den = sum((i - x_mean) ** 2 for i in range(n))
+            trend = slope_num / slope_den
+        else:
+            trend = 0.0
+        recent_std = math.sqrt(sum((value - recent_mean) ** 2 for value in recent) / n)
+
+        if self.recovery_days is not None:
+            recovery = self.recovery_days
+        elif self.in_low and timestamp is not None and self.last_low_timestamp is not None:
+            recovery = max((timestamp - self.last_low_timestamp).total_seconds() / 86400, 0.0)
+        else:
+            recovery = 0.0
+
+        return {
+            'mood_trend': trend,
+            'mood_volatility': math.sqrt(max(self.var, 0.0)),
+            'entry_frequency': 1 / self.interval_days if self.interval_days else 1,
+            'mood_momentum': self.fast_mean - self.mean,
+            'mood_consistency': 1 / (1 + recent_std),
+            'mood_recovery': recovery
+        }
+
+    def to_dict(self) -> Dict:
+        return {
+            'window': self.window, 'alpha': self.alpha, 'fast_alpha': self.fast_alpha,
+            'low_threshold': self.low_threshold, 'recovered_threshold': self.recovered_threshold,
+            'count': self.count, 'mean': self.mean, 'var': self.var, 'fast_mean': self.fast_mean,
+            'recent': list(self.recent),
+            'last_timestamp': self.last_timestamp.isoformat() if self.last_timestamp else None,
+            'interval_days': self.interval_days,
+            'last_low_timestamp': self.last_low_timestamp.isoformat() if self.last_low_timestamp else None,
+            'in_low': self.in_low,
+            'recovery_days': self.recovery_days
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'MoodHistoryState':
+        state = cls(data['window'], data['alpha'], data['fast_alpha'],
+                    data['low_threshold'], data['recovered_threshold'])
+        state.count = data['count']
+        state.mean = data['mean']
+        state.var = data['var']
+        state.fast_mean = data['fast_mean']
+        state.recent.extend(data['recent'])
+        state.last_timestamp = datetime.fromisoformat(data['last_timestamp']) if data['last_timestamp'] else None
+        state.interval_days = data['interval_days']
+        state.last_low_timestamp = (datetime.fromisoformat(data['last_low_timestamp'])
+                                    if data['last_low_timestamp'] else None)
+        state.in_low = data['in_low']
+        state.recovery_days = data['recovery_days']
+        return state
+
+class MoodHistoryTracker:
+    """Per-user MoodHistoryState map with optional SQLite persistence"""
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path
+        self.states = {}
+        self._lock = threading.Lock()
+        self.storage = get_storage(db_path) if db_path else None
+        if db_path:
+            self.init_database()
+
+    def init_database(self):
+        """Initialize mood history table"""
+        self.storage.executescript('''
+            CREATE TABLE IF NOT EXISTS mood_history_state (
+                user_id TEXT PRIMARY KEY,
+                state TEXT,
+                last_updated DATETIME
+            );
+        ''')
+
+    def get_state(self, user_id: str) -> Optional[MoodHistoryState]:
+        """Return the user's state, loading it from the database if needed"""
+        with self._lock:
+            state = self.states.get(user_id)
+        if state is not None or not self.db_path:
+            return state
+
+        row = self.storage.read_one('SELECT state FROM mood_history_state WHERE user_id = ?', (user_id,))
+        if not row:
+            return None
+
+        state = MoodHistoryState.from_dict(json.loads(row[0]))
+        with self._lock:
+            return self.states.setdefault(user_id, state)
+
+    def features(self, user_id: Optional[str], timestamp: Optional[datetime] = None) -> Dict[str, float]:
+        """History features for the user's next entry"""
+        state = self.get_state(user_id) if user_id is not None else None
+        return state.features(timestamp) if state else dict(DEFAULT_HISTORY_FEATURES)
+
+    def update(self, user_id: str, mood: float, timestamp: Optional[datetime] = None, persist: bool = True):
+        """Record a new mood entry for the user"""
+        state = self.get_state(user_id)
+        with self._lock:
+            if state is None:
+                state = self.states.setdefault(user_id, MoodHistoryState())
+            state.update(mood, timestamp)
+        if persist:
+            self.save_states([user_id])
+
+    def replace_states(self, states: Dict[str, MoodHistoryState], persist: bool = True):
+        """Adopt states computed elsewhere (e.g. by a training pass)"""
+        with self._lock:
+            self.states.update(states)
+        if persist:
+            self.save_states(list(states))
+
+    def save_states(self, user_ids=None):
+        """Write the given (default: all loaded) user states to the database"""
+        if not self.db_path:
+            return
+        with self._lock:
+            user_ids = list(self.states) if user_ids is None else user_ids
+            rows = [
+                (user_id, json.dumps(self.states[user_id].to_dict()), datetime.now().isoformat())
+                for user_id in user_ids if user_id in self.states
+            ]
+
+        self.storage.write_many('''
+            INSERT OR REPLACE INTO mood_history_state (user_id, state, last_updated)
+            VALUES (?, ?, ?)
+        ''', rows)
+
+def entry_timestamp(entry: Dict) -> Optional[datetime]:
+    """Timestamp of a mood entry from its 'timestamp' or 'date' fields"""
+    if entry.get('timestamp'):
+        value = entry['timestamp']
+        if not isinstance(value, datetime):
+            value = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        # Compare everything as naive UTC so date-only and ISO entries mix
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+    date_info = entry.get('date')
+    if not isinstance(date_info, dict) or 'year' not in date_info:
+        return None
+    return datetime(date_info['year'], date_info.get('month', 1), date_info.get('day', 1),
+                    date_info.get('hour', 12))
+
+def test_mood_history():
+    """Test mood history tracking"""
+    print("📈 Testing Mood History Tracking")
+    print("=" * 40)
+
+    tracker = MoodHistoryTracker("test_mood_history.db")
+    start = datetime(2024, 9, 1, 9)
+    for day, mood in enumerate([6, 5, 2, 3, 5, 7, 8]):
+        tracker.update('user_001', mood, start.replace(day=1 + day))
+
+    features = tracker.features('user_001', datetime(2024, 9, 8, 9))
+    print(f"   Features: {features}")
+    assert features['mood_trend'] > 0 and features['entry_frequency'] == 1
+    assert features['mood_recovery'] == 2
+
+    # States survive a reload
+    reloaded = MoodHistoryTracker("test_mood_history.db")
+    assert reloaded.features('user_001', datetime(2024, 9, 8, 9)) == features
+    assert reloaded.features('unknown_user') == DEFAULT_HISTORY_FEATURES
+
+    remove_database("test_mood_history.db")
+
+    print("✅ Mood history test completed!")
+    return tracker
+
+if __name__ == "__main__":
+    tracker = test_mood_history()
@@ -11,20 +11,16 @@ import logging
 import asyncio
 import threading
 from datetime import datetime, timedelta
-import json
 from functools import wraps
 import time
 from concurrent.futures import ThreadPoolExecutor
-import psutil
-
-# Import optimization libraries
-from cachetools import TTLCache
-import redis
-from celery import Celery
 
 # Import ML modules
 from enhanced_ml_system import EnhancedMentalHealthML
 from enhanced_recommendations import EnhancedMentalHealthRecommendations
+from response_cache import ResponseCache
+from cache_backends import MemoryCacheBackend, cache_from_env, celery_broker_url
+from health_monitor import SystemMetricsSampler
 
 # Configure logging
 logging.basicConfig(
@@ -44,15 +40,20 @@ app.config.update(
     JSONIFY_PRETTYPRINT_REGULAR=False
 )
 
-# Redis configuration for caching
-REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
-redis_client = redis.from_url(REDIS_URL, decode_responses=True)
+# Shared cache chosen by CACHE_BACKEND: redis (REDIS_URL), sqlite (one host) or memory
+cache_backend = cache_from_env()
 
-# Celery configuration for background tasks
-celery_app = Celery('ml_backend', broker=REDIS_URL)
+# Celery for background tasks only when a broker is configured (CELERY_BROKER_URL or redis);
+# without one, retraining runs on the thread pool below
+celery_broker = celery_broker_url(cache_backend.name)
+if celery_broker:
+    from celery import Celery
+    celery_app = Celery('ml_backend', broker=celery_broker)
+else:
+    celery_app = None
 
 # In-memory cache for frequently accessed data
-memory_cache = TTLCache(maxsize=1000, ttl=300)  # 5 minutes TTL
+memory_cache = MemoryCacheBackend(maxsize=1000, default_ttl=300)  # 5 minutes TTL
 
 # Thread pool for CPU-intensive tasks
 thread_pool = ThreadPoolExecutor(max_workers=4)
@@ -91,33 +92,6 @@ class PerformanceMonitor:
 
 performance_monitor = PerformanceMonitor()
 
-# Caching decorator
-def cache_result(ttl=300, key_prefix=""):
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            # Generate cache key
-            cache_key = f"{key_prefix}:{func.__name__}:{hash(str(args) + str(kwargs))}"
-            
-            # Try to get from cache
-            try:
-                cached_result = redis_client.get(cache_key)
-                if cached_result:
-                    return json.loads(cached_result)
-            except Exception as e:
-                logger.warning(f"Cache read error: {e}")
-            
-            # Execute function and cache result
-            result = func(*args, **kwargs)
-            try:
-                redis_client.setex(cache_key, ttl, json.dumps(result, default=str))
-            except Exception as e:
-                logger.warning(f"Cache write error: {e}")
-            
-            return result
-        return wrapper
-    return decorator
-
 # Performance monitoring decorator
 def monitor_performance(func):
     @wraps(func)
@@ -151,9 +125,30 @@ except Exception as e:
     logger.error(f"Failed to initialize recommendations system: {e}")
     recommendations = None
 
+# Response cache keyed by route, canonical request body and model version; shared
+# between workers unless the backend is in-process
+response_cache = ResponseCache(max_entries=1000, default_ttl=300,
+                               shared_backend=cache_backend if cache_backend.shared else None)
+if enhanced_ml:
+    response_cache.watch(enhanced_ml.model_registry)
+
+# System, cache and queue metrics sampled in the background; probes read the snapshot
+metrics_sampler = SystemMetricsSampler(interval=float(os.getenv('HEALTH_SAMPLE_INTERVAL', '5')))
+metrics_sampler.add_probe('cache', lambda: {
+    'backend': cache_backend.name,
+    'connected': cache_backend.ping(),
+    'memory_cache_size': len(memory_cache)
+})
+metrics_sampler.add_probe('response_cache', response_cache.get_stats)
+metrics_sampler.add_probe('queue', lambda: {
+    'thread_pool_pending': thread_pool._work_queue.qsize(),
+    'retrain_queue': f"celery:{celery_broker.split('://')[0]}" if celery_app else 'thread_pool'
+})
+metrics_sampler.add_probe('performance', performance_monitor.get_stats)
+metrics_sampler.start()
+
 # Background task for model updates
-@celery_app.task
-def update_models_async():
+def update_models():
     """Background task to update ML models"""
     try:
         if enhanced_ml:
@@ -162,47 +157,42 @@ def update_models_async():
     except Exception as e:
         logger.error(f"Model update failed: {e}")
 
+update_models_async = celery_app.task(update_models) if celery_app else None
+
 # Health check endpoint with system metrics
 @app.route('/api/health', methods=['GET'])
 @monitor_performance
 def health_check():
-    """Enhanced health check with system status and performance metrics"""
+    """Enhanced health check with system status and performance metrics (from the sampler snapshot)"""
     try:
-        # System metrics
-        cpu_percent = psutil.cpu_percent(interval=1)
-        memory = psutil.virtual_memory()
-        disk = psutil.disk_usage('/')
+        snapshot = metrics_sampler.snapshot
+        system = snapshot.get('system', {})
+        cache = snapshot.get('cache', {})
         
         # ML system status
         ml_status = "healthy" if enhanced_ml else "unavailable"
         recommendations_status = "healthy" if recommendations else "unavailable"
         
-        # Cache status
-        try:
-            redis_client.ping()
-            cache_status = "connected"
-        except:
-            cache_status = "disconnected"
-        
-        # Performance stats
-        perf_stats = performance_monitor.get_stats()
-        
         return jsonify({
             'status': 'healthy',
             'timestamp': datetime.now().isoformat(),
             'services': {
                 'ml_system': ml_status,
                 'recommendations': recommendations_status,
-                'cache': cache_status,
+                'cache': "connected" if cache.get('connected') else "disconnected",
+                'cache_backend': cache_backend.name,
                 'api': 'running'
             },
             'system_metrics': {
-                'cpu_percent': cpu_percent,
-                'memory_percent': memory.percent,
-                'disk_percent': disk.percent,
-                'cache_size': len(memory_cache)
+                'cpu_percent': system.get('cpu_percent'),
+                'memory_percent': system.get('memory_percent'),
+                'disk_percent': system.get('disk_percent'),
+                'cache_size': cache.get('memory_cache_size'),
+                'sampled_at': snapshot.get('sampled_at')
             },
-            'performance': perf_stats
+            'queue': snapshot.get('queue'),
+            'performance': snapshot.get('performance'),
+            'sampler': metrics_sampler.get_status()
         })
     except Exception as e:
         logger.error(f"Health check failed: {e}")
@@ -212,10 +202,36 @@ def health_check():
             'error': str(e)
         }), 500
 
+# Liveness and readiness probes: not monitored, so constant probing does not skew request stats
+@app.route('/api/health/live', methods=['GET'])
+def liveness_check():
+    """Liveness: the process is up and serving requests"""
+    return jsonify({
+        'status': 'alive',
+        'uptime_seconds': round(metrics_sampler.uptime(), 1),
+        'timestamp': datetime.now().isoformat()
+    })
+
+@app.route('/api/health/ready', methods=['GET'])
+def readiness_check():
+    """Readiness: models loaded, recommendations available, cache reachable and metrics current"""
+    checks = {
+        'ml_system': bool(enhanced_ml and enhanced_ml.models_loaded),
+        'recommendations': recommendations is not None,
+        'cache': bool(metrics_sampler.snapshot.get('cache', {}).get('connected')),
+        'metrics': metrics_sampler.is_fresh()
+    }
+    ready = all(checks.values())
+    return jsonify({
+        'status': 'ready' if ready else 'not_ready',
+        'checks': checks,
+        'timestamp': datetime.now().isoformat()
+    }), 200 if ready else 503
+
 # Optimized mood prediction endpoint
 @app.route('/api/predict-mood', methods=['POST'])
 @monitor_performance
-@cache_result(ttl=600, key_prefix="mood_prediction")
+@response_cache.cached(ttl=600)
 def predict_mood():
     """Predict mood with caching and optimization"""
     try:
@@ -245,7 +261,7 @@ def predict_mood():
 # Optimized sentiment analysis endpoint
 @app.route('/api/analyze-sentiment', methods=['POST'])
 @monitor_performance
-@cache_result(ttl=300, key_prefix="sentiment")
+@response_cache.cached(ttl=300)
 def analyze_sentiment():
     """Analyze sentiment with caching"""
     try:
@@ -275,7 +291,7 @@ def analyze_sentiment():
 # Optimized pattern analysis endpoint
 @app.route('/api/analyze-patterns', methods=['POST'])
 @monitor_performance
-@cache_result(ttl=1800, key_prefix="patterns")  # 30 minutes cache
+@response_cache.cached(ttl=1800)  # 30 minutes cache
 def analyze_patterns():
     """Analyze patterns with extended caching"""
     try:
@@ -312,7 +328,7 @@ def analyze_patterns():
 # Optimized recommendations endpoint
 @app.route('/api/recommendations', methods=['POST'])
 @monitor_performance
-@cache_result(ttl=900, key_prefix="recommendations")
+@response_cache.cached(ttl=900)
 def get_recommendations():
     """Get personalized recommendations with caching"""
     try:
@@ -386,12 +402,16 @@ def retrain_models():
         if not enhanced_ml:
             return jsonify({'error': 'ML system not available'}), 503
         
-        # Start background task
-        task = update_models_async.delay()
+        # Start background task: on a celery worker when configured, else in this process
+        if update_models_async:
+            task_id = update_models_async.delay().id
+        else:
+            thread_pool.submit(update_models)
+            task_id = None
         
         return jsonify({
             'message': 'Model retraining started',
-            'task_id': task.id,
+            'task_id': task_id,
             'timestamp': datetime.now().isoformat()
         })
     except Exception as e:
@@ -404,10 +424,8 @@ def retrain_models():
 def clear_cache():
     """Clear all caches"""
     try:
-        # Clear Redis cache
-        redis_client.flushdb()
-        
-        # Clear memory cache
+        # Clear cached responses (shared entries too) and the memory cache
+        response_cache.clear()
         memory_cache.clear()
         
         return jsonify({
@@ -423,20 +441,10 @@ def clear_cache():
 def cache_stats():
     """Get cache statistics"""
     try:
-        redis_info = redis_client.info()
-        
         return jsonify({
-            'memory_cache': {
-                'size': len(memory_cache),
-                'maxsize': memory_cache.maxsize,
-                'ttl': memory_cache.ttl
-            },
-            'redis_cache': {
-                'used_memory': redis_info.get('used_memory_human'),
-                'connected_clients': redis_info.get('connected_clients'),
-                'keyspace_hits': redis_info.get('keyspace_hits'),
-                'keyspace_misses': redis_info.get('keyspace_misses')
-            },
+            'memory_cache': memory_cache.get_stats(),
+            'response_cache': response_cache.get_stats(),
+            'shared_cache': cache_backend.get_stats(),
             'timestamp': datetime.now().isoformat()
         })
     except Exception as e:
@@ -465,6 +473,7 @@ def internal_error(error):
 def shutdown_handler():
     """Handle graceful shutdown"""
     logger.info("Shutting down ML backend...")
+    metrics_sampler.stop()
     thread_pool.shutdown(wait=True)
     if enhanced_ml:
         enhanced_ml.cleanup()
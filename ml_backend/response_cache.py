@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Response Cache for Mental Health Companion
+Serialized API responses keyed by route, canonical request body and active model version
+"""
+
+import json
+import hashlib
+import threading
+import time
+import logging
+from collections import OrderedDict
+from functools import wraps
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (status, mimetype, body bytes)
+CachedResponse = Tuple[int, str, bytes]
+
+class ResponseCache:
+    """Bounded LRU of response bytes with per-route TTLs
+
+    The key is the SHA-256 of the method and route (with sorted query
+    arguments), the request body as canonical JSON (sorted keys, no
+    insignificant whitespace) and the active model version. It is the same
+    in every worker, and requests that differ only in JSON formatting share
+    an entry. A new model version changes every key, and a registry swap
+    drops this process's entries for older versions at once. An optional
+    shared backend (SQLite file or Redis, see cache_backends) shares entries
+    across workers; its older-version keys simply expire.
+    """
+
+    def __init__(self, max_entries: int = 10000, default_ttl: float = 300.0,
+                 version_source: Optional[Callable[[], Optional[str]]] = None,
+                 shared_backend=None, key_prefix: str = "response"):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.version_source = version_source
+        self.shared_backend = shared_backend
+        self.key_prefix = key_prefix
+
+        # key -> (expires at, status, mimetype, body), LRU order
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Hit-rate tracking
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def watch(self, model_registry):
+        """Key entries by ``model_registry``'s version and drop them when it swaps"""
+        self.version_source = lambda: model_registry.version
+        model_registry.subscribe(self._on_model_swap)
+
+    def _on_model_swap(self, bundle):
+        self.invalidate()
+        logger.info(f"Response cache invalidated for model {bundle.version}")
+
+    @staticmethod
+    def canonical_body(body: bytes) -> bytes:
+        """Canonical JSON for JSON bodies; anything else is keyed on its raw bytes"""
+        if not body:
+            return b''
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return body
+        return json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+    def make_key(self, route: str, body: bytes = b'', version: Optional[str] = None) -> str:
+        """Stable digest of (route, canonical body, model version)"""
+        if version is None and self.version_source is not None:
+            version = self.version_source()
+        digest = hashlib.sha256()
+        for part in (route.encode('utf-8'), str(version).encode('utf-8'), self.canonical_body(body)):
+            digest.update(len(part).to_bytes(8, 'big'))  # length-prefixed: parts cannot run together
+            digest.update(part)
+        return f"{self.key_prefix}:{digest.hexdigest()}"
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        """Cached (status, mimetype, body) or None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1:]
+                del self._entries[key]
+
+        if self.shared_backend is not None:
+            try:
+                packed = self.shared_backend.get(key)
+            except Exception as e:
+                logger.warning(f"Response cache read error: {e}")
+                packed = None
+            if packed:
+                status, mimetype, body = packed.split(b'\n', 2)
+                with self._lock:
+                    self.shared_hits += 1
+                return int(status), mimetype.decode('utf-8'), body
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key: str, body: bytes, ttl: Optional[float] = None,
+            status: int = 200, mimetype: str = 'application/json'):
+        """Store serialized response bytes for ``ttl`` seconds"""
+        ttl = self.default_ttl if ttl is None else ttl
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, status, mimetype, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        if self.shared_backend is not None:
+            try:
+                self.shared_backend.set(key, b'%d\n%s\n' % (status, mimetype.encode('utf-8')) + body, ttl)
+            except Exception as e:
+                logger.warning(f"Response cache write error: {e}")
+
+    def invalidate(self):
+        """Drop every in-process entry"""
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def cached(self, ttl: Optional[float] = None):
+        """Decorator for Flask views: serve successful responses from the cache
+
+        Only 200 responses are stored; error responses always run the view.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                from flask import current_app, request
+
+                route = f"{request.method} {request.path}"
+                if request.args:
+                    route += '?' + '&'.join(f"{k}={v}" for k, v in sorted(request.args.items(multi=True)))
+                key = self.make_key(route, request.get_data(cache=True))
+
+                hit = self.get(key)
+                if hit is not None:
+                    status, mimetype, body = hit
+                    response = current_app.response_class(body, status=status, mimetype=mimetype)
+                    response.headers['X-Cache'] = 'HIT'
+                    return response
+
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code == 200 and not response.direct_passthrough:
+                    self.set(key, response.get_data(), ttl, response.status_code, response.mimetype)
+                response.headers['X-Cache'] = 'MISS'
+                return response
+            return wrapper
+        return decorator
+
+    def get_stats(self) -> Dict:
+        """Cache size and hit rate"""
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+            'invalidations': self.invalidations,
+            'model_version': self.version_source() if self.version_source else None
+        }
+
+    def clear(self):
+        """Drop in-process entries and, when shared, this cache's shared keys"""
+        self.invalidate()
+        if self.shared_backend is not None:
+            try:
+                self.shared_backend.clear(f"{self.key_prefix}:")
+            except Exception as e:
+                logger.warning(f"Response cache clear error: {e}")
+
+def test_response_cache():
+    """Test the response cache"""
+    import shutil
+    import numpy as np
+    from flask import Flask, jsonify, request
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.preprocessing import StandardScaler
+    from feature_schema import FEATURE_SCHEMA
+    from model_registry import ModelRegistry
+
+    print("🗃️ Testing Response Cache")
+    print("=" * 40)
+
+    rng = np.random.default_rng(5)
+    X = rng.normal(size=(100, FEATURE_SCHEMA.size)).astype(np.float32)
+    y = rng.integers(1, 6, size=100)
+    scaler = StandardScaler().fit(X)
+    model = RandomForestClassifier(n_estimators=5, max_depth=3, random_state=0).fit(scaler.transform(X), y)
+
+    registry = ModelRegistry("test_response_cache_models")
+    registry.publish(model, scaler, version="v1")
+    cache = ResponseCache(max_entries=100)
+    cache.watch(registry)
+
+    app = Flask(__name__)
+    calls = []
+
+    @app.route('/api/predict-mood', methods=['POST'])
+    @cache.cached(ttl=600)
+    def predict_mood():
+        data = request.get_json()
+        if not data or 'text' not in data:
+            return jsonify({'error': 'Text input required'}), 400
+        calls.append(data['text'])
+        return jsonify({'prediction': len(data['text']), 'model': registry.version})
+
+    client = app.test_client()
+    first = client.post('/api/predict-mood', data='{"text": "calm", "user": 1}', content_type='application/json')
+    # Same body with other key order and spacing is a hit; a different body is not
+    again = client.post('/api/predict-mood', data='{"user":1,"text":"calm"}', content_type='application/json')
+    other = client.post('/api/predict-mood', json={'text': 'anxious', 'user': 1})
+    assert (first.headers['X-Cache'], again.headers['X-Cache'], other.headers['X-Cache']) == ('MISS', 'HIT', 'MISS')
+    assert again.get_data() == first.get_data() and other.get_json()['prediction'] == 7
+    assert calls == ['calm', 'anxious']
+
+    # Errors are not cached
+    for _ in range(2):
+        assert client.post('/api/predict-mood', json={}).status_code == 400
+    assert len(cache._entries) == 2
+
+    # Keys are stable across processes (no randomized hash())
+    assert cache.make_key("POST /api/predict-mood", b'{"text": "calm"}', "v1") == \
+        ResponseCache().make_key("POST /api/predict-mood", b'{ "text":"calm" }', "v1")
+
+    # Publishing a new model version invalidates the cached responses
+    registry.publish(model, scaler, version="v2")
+    after = client.post('/api/predict-mood', json={'text': 'calm', 'user': 1})
+    assert after.headers['X-Cache'] == 'MISS' and after.get_json()['model'] == 'v2'
+    assert calls == ['calm', 'anxious', 'calm']
+
+    # Per-route TTL
+    short = ResponseCache()
+    short.set('k', b'{}', ttl=0.05)
+    assert short.get('k') == (200, 'application/json', b'{}')
+    time.sleep(0.06)
+    assert short.get('k') is None
+
+    # Workers sharing a backend serve each other's entries
+    from cache_backends import SQLiteCacheBackend
+    from sqlite_storage import remove_database
+    shared = SQLiteCacheBackend("test_response_cache.db")
+    worker_a, worker_b = ResponseCache(shared_backend=shared), ResponseCache(shared_backend=shared)
+    key = worker_a.make_key("POST /api/predict-mood", b'{"text": "calm"}', "v1")
+    worker_a.set(key, b'{"mood": 6}', ttl=60)
+    assert worker_b.get(key) == (200, 'application/json', b'{"mood": 6}') and worker_b.shared_hits == 1
+    worker_a.clear()
+    assert worker_b.get(key) is None
+    remove_database("test_response_cache.db")
+
+    print(f"   Stats: {cache.get_stats()}")
+    shutil.rmtree("test_response_cache_models")
+    print("✅ Response cache test completed!")
+    return cache
+
+def benchmark_response_cache(num_requests=2000):
+    """Cached vs uncached request latency through the Flask test client"""
+    from flask import Flask, jsonify, request
+
+    print("⏱️ Benchmarking Response Cache")
+    print("=" * 40)
+
+    app = Flask(__name__)
+    cache = ResponseCache(version_source=lambda: "v1")
+
+    def predict():
+        time.sleep(0.002)  # stands in for a ~2 ms model call
+        return jsonify({'prediction': len(request.get_json()['text'])})
+
+    app.add_url_rule('/uncached', 'uncached', predict, methods=['POST'])
+    app.add_url_rule('/cached', 'cached', cache.cached(ttl=600)(predict), methods=['POST'])
+    client = app.test_client()
+    bodies = [{'text': f"note {i % 100}"} for i in range(num_requests)]  # 100 distinct requests
+
+    for route in ['/uncached', '/cached']:
+        start = time.perf_counter()
+        for body in bodies:
+            client.post(route, json=body)
+        elapsed = time.perf_counter() - start
+        print(f"   {route:>9}: {elapsed / num_requests * 1e6:8.1f} µs/request")
+    print(f"   Hit rate: {cache.get_stats()['hit_rate']:.1%}")
+
+if __name__ == "__main__":
+    cache = test_response_cache()
+    benchmark_response_cache()
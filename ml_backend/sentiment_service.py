@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Sentiment Service for Mental Health Companion
+Content-addressed cache in front of VADER and TextBlob shared by every sentiment call site
+"""
+
+import json
+import hashlib
+import os
+import threading
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from sqlite_storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+class SentimentService:
+    """VADER + TextBlob scoring with a bounded LRU and optional SQLite persistence
+
+    Texts are normalised (surrounding and repeated whitespace removed) and
+    keyed by the SHA-256 of the normalised form, so the same note scored by
+    feature extraction, mood prediction and /api/sentiment is analysed once.
+    Persisted entries are read through the per-thread WAL connections of
+    SQLiteStorage and written without waiting, so disk I/O never runs under
+    the lock taken by in-memory hits.
+    """
+
+    def __init__(self, max_entries: int = 10000, persist_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.persist_path = persist_path
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._vader = None
+        self._vader_loaded = False
+
+        # Hit-rate tracking
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.storage = None
+        if persist_path:
+            self.storage = get_storage(persist_path)
+            self.storage.executescript('''
+                CREATE TABLE IF NOT EXISTS sentiment_cache (
+                    text_hash TEXT PRIMARY KEY,
+                    scores TEXT
+                );
+            ''')
+
+    @property
+    def vader(self):
+        """Lazily created VADER analyzer (None when the lexicon is unavailable)"""
+        if not self._vader_loaded:
+            with self._lock:
+                if not self._vader_loaded:
+                    try:
+                        import nltk
+                        from nltk.sentiment import SentimentIntensityAnalyzer
+                        try:
+                            nltk.data.find('sentiment/vader_lexicon.zip')
+                        except LookupError:
+                            nltk.download('vader_lexicon', quiet=True)
+                        self._vader = SentimentIntensityAnalyzer()
+                    except Exception as e:
+                        logger.warning(f"VADER unavailable, using TextBlob only: {e}")
+                        self._vader = None
+                    self._vader_loaded = True
+        return self._vader
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Canonical form used both for hashing and for scoring"""
+        return ' '.join((text or '').split())
+
+    @staticmethod
+    def text_key(normalized_text: str) -> str:
+        return hashlib.sha256(normalized_text.encode('utf-8')).hexdigest()
+
+    def scores(self, text: str) -> Dict:
+        """Return VADER and TextBlob scores for ``text``
+
+        The result has ``vader`` ({'neg', 'neu', 'pos', 'compound'} or None)
+        plus TextBlob ``polarity`` and ``subjectivity``.
+        """
+        normalized = self.normalize(text)
+        key = self.text_key(normalized)
+
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._copy(cached)
+
+        cached = self._load_from_disk(key)
+        if cached is not None:
+            with self._lock:
+                self.disk_hits += 1
+            self._remember(key, cached)
+            return self._copy(cached)
+
+        result = self._analyze(normalized)
+        with self._lock:
+            self.misses += 1
+        self._remember(key, result)
+        self._save_to_disk(key, result)
+        return self._copy(result)
+
+    def _analyze(self, normalized_text: str) -> Dict:
+        """Run the underlying analyzers"""
+        from textblob import TextBlob
+
+        analyzer = self.vader
+        vader_scores = analyzer.polarity_scores(normalized_text) if analyzer else None
+        sentiment = TextBlob(normalized_text).sentiment
+        return {
+            'vader': vader_scores,
+            'polarity': sentiment.polarity,
+            'subjectivity': sentiment.subjectivity
+        }
+
+    def _copy(self, result: Dict) -> Dict:
+        return {
+            'vader': dict(result['vader']) if result['vader'] is not None else None,
+            'polarity': result['polarity'],
+            'subjectivity': result['subjectivity']
+        }
+
+    def _remember(self, key: str, result: Dict):
+        with self._lock:
+            self._cache[key] = result
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def _load_from_disk(self, key: str) -> Optional[Dict]:
+        if self.storage is None:
+            return None
+        try:
+            row = self.storage.read_one('SELECT scores FROM sentiment_cache WHERE text_hash = ?', (key,))
+            return json.loads(row[0]) if row else None
+        except Exception as e:
+            logger.warning(f"Sentiment cache read error: {e}")
+            return None
+
+    def _save_to_disk(self, key: str, result: Dict):
+        if self.storage is None:
+            return
+        try:
+            self.storage.write('INSERT OR REPLACE INTO sentiment_cache (text_hash, scores) VALUES (?, ?)',
+                               (key, json.dumps(result)), wait=False)
+        except Exception as e:
+            logger.warning(f"Sentiment cache write error: {e}")
+
+    def get_stats(self) -> Dict:
+        """Cache statistics including the overall hit rate"""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'size': len(self._cache),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                'persistent': self.storage is not None
+            }
+
+    def close(self):
+        """Commit queued cache writes and stop persisting (the shared storage stays open)"""
+        if self.storage is not None:
+            self.storage.flush()
+            self.storage = None
+
+    def clear(self):
+        """Drop the in-memory cache and reset counters (disk entries are kept)"""
+        with self._lock:
+            self._cache.clear()
+            self.hits = self.disk_hits = self.misses = 0
+
+_default_service = None
+_default_service_lock = threading.Lock()
+
+def get_sentiment_service() -> SentimentService:
+    """Process-wide sentiment service configured from the environment"""
+    global _default_service
+    if _default_service is None:
+        with _default_service_lock:
+            if _default_service is None:
+                _default_service = SentimentService(
+                    max_entries=int(os.getenv('SENTIMENT_CACHE_SIZE', '10000')),
+                    persist_path=os.getenv('SENTIMENT_CACHE_PATH') or None
+                )
+    return _default_service
+
+def test_sentiment_service():
+    """Test the sentiment service"""
+    from sqlite_storage import remove_database
+
+    print("💬 Testing Sentiment Service")
+    print("=" * 40)
+
+    service = SentimentService(max_entries=2, persist_path="test_sentiment.db")
+
+    first = service.scores("Feeling great today!")
+    again = service.scores("  Feeling   great today! ")
+    print(f"   Scores: {first}")
+    assert first == again
+
+    service.scores("Having a tough day")
+    service.scores("Just another day")  # evicts the first text
+    service.scores("Feeling great today!")  # served from disk
+
+    stats = service.get_stats()
+    print(f"   Stats: {stats}")
+    assert stats['size'] == 2 and stats['hits'] == 1 and stats['disk_hits'] == 1
+
+    # A forked worker's scores persist for the parent
+    if hasattr(os, 'fork'):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                service.scores("Scored in a worker")
+                service.storage.flush()
+                os._exit(0)
+            except BaseException:
+                os._exit(1)
+        assert os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1]) == 0
+        service.scores("Scored in a worker")
+        assert service.get_stats()['disk_hits'] == 2
+        print("   Entry scored by a forked worker is served from disk in the parent")
+
+    service.close()
+    remove_database("test_sentiment.db")
+
+    print("✅ Sentiment service test completed!")
+    return service
+
+if __name__ == "__main__":
+    service = test_sentiment_service()
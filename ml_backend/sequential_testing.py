@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Sequential Testing for Mental Health Companion
+Always-valid mSPRT p-values so A/B experiments can be checked after every batch of events and stopped early
+"""
+
+import math
+import logging
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class SequentialDecision:
+    """Outcome of one sequential check of a challenger against the control"""
+    likelihood_ratio: float
+    p_value: float  # always-valid: running minimum of 1 / likelihood ratio
+    boundary_crossed: bool
+    ready: bool  # both arms have enough samples for the variance estimate
+
+class MixtureSPRT:
+    """Mixture sequential probability ratio test for a difference in means
+
+    The difference of the two arms' means is approximately normal with
+    variance V = var_a / n_a + var_b / n_b. Mixing the alternative over a
+    N(0, tau^2) prior on the difference gives the closed-form likelihood
+    ratio
+
+        Lambda = sqrt(V / (V + tau^2)) * exp(tau^2 * diff^2 / (2 V (V + tau^2)))
+
+    which is a martingale under the null, so ``p = min over checks of
+    1 / Lambda`` stays valid however often it is looked at (Johari et al.,
+    "Always Valid Inference"). tau is ``effect_size`` pooled standard
+    deviations: the size of effect the test is most sensitive to.
+    """
+
+    def __init__(self, alpha: float = 0.05, effect_size: float = 0.2, min_samples: int = 30):
+        self.alpha = alpha
+        self.effect_size = effect_size
+        self.min_samples = min_samples
+
+    def likelihood_ratio(self, metrics_a: Dict[str, float], metrics_b: Dict[str, float]) -> float:
+        """Mixture likelihood ratio from per-arm count, mean and (population) std"""
+        n_a, n_b = metrics_a['count'], metrics_b['count']
+        var_a, var_b = metrics_a['std'] ** 2, metrics_b['std'] ** 2
+        variance = var_a / n_a + var_b / n_b
+        pooled_variance = (n_a * var_a + n_b * var_b) / (n_a + n_b)
+        tau_squared = self.effect_size ** 2 * pooled_variance
+        if variance <= 0 or tau_squared <= 0:
+            return 1.0  # no spread yet: no evidence either way
+
+        diff = metrics_b['mean'] - metrics_a['mean']
+        log_ratio = (0.5 * math.log(variance / (variance + tau_squared))
+                     + tau_squared * diff ** 2 / (2 * variance * (variance + tau_squared)))
+        return math.exp(min(log_ratio, 700.0))  # cap to stay finite
+
+    def check(self, metrics_a: Dict[str, float], metrics_b: Dict[str, float],
+              previous_p_value: float = 1.0, alpha: Optional[float] = None) -> SequentialDecision:
+        """Update the always-valid p-value with the current aggregates"""
+        alpha = self.alpha if alpha is None else alpha
+        if min(metrics_a['count'], metrics_b['count']) < self.min_samples:
+            return SequentialDecision(1.0, previous_p_value, False, False)
+
+        ratio = self.likelihood_ratio(metrics_a, metrics_b)
+        p_value = min(previous_p_value, 1.0 / ratio)
+        return SequentialDecision(ratio, p_value, p_value < alpha, True)
+
+def test_sequential_testing():
+    """Test the mSPRT against simulated null and alternative streams"""
+    print("📐 Testing Sequential Testing (mSPRT)")
+    print("=" * 40)
+
+    rng = np.random.default_rng(7)
+    test = MixtureSPRT(alpha=0.05, effect_size=0.2)
+
+    def run(rate_a, rate_b, batches=100, batch_size=40):
+        """Check after every batch; return the batch the boundary was crossed in (or None)"""
+        a = rng.random((batches, batch_size)) < rate_a
+        b = rng.random((batches, batch_size)) < rate_b
+        p_value = 1.0
+        for batch in range(1, batches + 1):
+            seen_a, seen_b = a[:batch].ravel(), b[:batch].ravel()
+            decision = test.check(
+                {'count': seen_a.size, 'mean': seen_a.mean(), 'std': seen_a.std()},
+                {'count': seen_b.size, 'mean': seen_b.mean(), 'std': seen_b.std()},
+                p_value
+            )
+            p_value = decision.p_value
+            if decision.boundary_crossed:
+                return batch
+        return None
+
+    # Peeking after every batch under the null keeps false positives near alpha
+    null_runs = 500
+    false_positives = sum(run(0.5, 0.5) is not None for _ in range(null_runs))
+    print(f"   Null (100 looks each): {false_positives}/{null_runs} false positives")
+    assert false_positives / null_runs <= test.alpha
+
+    # A real effect is detected long before the fixed horizon
+    stops = [run(0.5, 0.6) for _ in range(20)]
+    detected = [stop for stop in stops if stop is not None]
+    print(f"   50% vs 60%: detected in {len(detected)}/20, median stop at batch {int(np.median(detected))} of 100")
+    assert len(detected) >= 16
+
+    # The p-value never increases
+    low = test.check({'count': 500, 'mean': 0.5, 'std': 0.5}, {'count': 500, 'mean': 0.6, 'std': 0.49})
+    later = test.check({'count': 600, 'mean': 0.5, 'std': 0.5}, {'count': 600, 'mean': 0.5, 'std': 0.5}, low.p_value)
+    assert later.p_value == low.p_value
+
+    print("✅ Sequential testing test completed!")
+    return test
+
+if __name__ == "__main__":
+    test = test_sequential_testing()
@@ -24,9 +24,8 @@ CORS(app)
 def analyze_sentiment_simple(text):
     """Simple sentiment analysis using TextBlob"""
     try:
-        from textblob import TextBlob
-        blob = TextBlob(text)
-        polarity = blob.sentiment.polarity
+        from sentiment_service import get_sentiment_service
+        polarity = get_sentiment_service().scores(text)['polarity']
         
         if polarity >= 0.1:
             return {"sentiment": "positive", "confidence": polarity}
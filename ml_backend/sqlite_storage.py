@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""
+SQLite Storage Layer for Mental Health Companion
+Long-lived per-thread WAL connections and a group-committing writer shared by the feedback, A/B and learning stores
+"""
+
+import atexit
+import functools
+import os
+import sqlite3
+import threading
+import time
+import weakref
+import logging
+from concurrent.futures import Future, wait as wait_futures
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from micro_batcher import MicroBatcher, register_after_fork
+
+logger = logging.getLogger(__name__)
+
+# (version, steps): each step is a SQL statement or a callable taking the connection
+Migration = Tuple[int, Sequence[Union[str, Callable[[sqlite3.Connection], Any]]]]
+
+# Plan details that read a table through an index (or the rowid) rather than a full scan
+_INDEXED_ACCESS = ('USING INDEX', 'USING COVERING INDEX', 'USING INTEGER PRIMARY KEY', 'USING PRIMARY KEY')
+
+class SQLiteStorage:
+    """Connection management for one SQLite database file
+
+    Every thread gets its own long-lived connection in WAL mode, so readers
+    never block the writer and prepared statements stay in the connection's
+    statement cache instead of being re-parsed on every call. All writes are
+    queued to a single writer thread (a MicroBatcher) which runs whatever has
+    queued up in one ``BEGIN IMMEDIATE ... COMMIT``. Concurrent request
+    threads therefore share one commit instead of taking turns on the
+    database write lock. Each queued write runs in its own savepoint, so a
+    failing write is rolled back and reported to its caller only.
+
+    Reads wait for writes the calling thread has already queued
+    (read-your-writes); ``flush()`` waits for every queued write. In a forked
+    child (gunicorn ``--preload``) the writer starts with an empty queue and
+    the inherited connections are abandoned, not closed: they belong to
+    the parent.
+    """
+
+    def __init__(self, db_path: str, cached_statements: int = 256, busy_timeout: float = 30.0,
+                 max_batch_size: int = 256, synchronous: str = "NORMAL"):
+        self.db_path = db_path
+        self.cached_statements = cached_statements
+        self.busy_timeout = busy_timeout
+        self.synchronous = synchronous
+
+        self._local = threading.local()
+        self._connections: List[tuple] = []  # (weakref to owning thread, connection)
+        self._connections_lock = threading.Lock()
+        self._last_write: Optional[Future] = None  # latest write from any thread, for flush()
+        self._closed = False
+
+        # max_wait_ms=0: no artificial delay, a batch is whatever queued while the last commit ran
+        self._writer = MicroBatcher(self._commit_batch, max_batch_size=max_batch_size, max_wait_ms=0,
+                                    name=f"sqlite-writer-{os.path.basename(db_path)}")
+        register_after_fork(self)
+
+    def _after_fork(self):
+        """Writes pending in the parent never complete here; parent connections must not be closed"""
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._last_write = None
+
+    # Connections
+    def connection(self) -> sqlite3.Connection:
+        """This thread's connection (opened on first use, reopened after fork)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        if self._closed:
+            raise RuntimeError(f"Storage for {self.db_path} is closed")
+
+        # isolation_level=None: no implicit transactions; the writer manages them explicitly
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, isolation_level=None,
+                               check_same_thread=False, cached_statements=self.cached_statements)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA synchronous={self.synchronous}')
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        with self._connections_lock:
+            # Thread-per-request servers: close connections whose threads have exited
+            alive = []
+            for thread_ref, other in self._connections:
+                thread = thread_ref()
+                if thread is not None and thread.is_alive():
+                    alive.append((thread_ref, other))
+                else:
+                    other.close()
+            alive.append((weakref.ref(threading.current_thread()), conn))
+            self._connections = alive
+        return conn
+
+    # Reads
+    def read(self, sql: str, params: Sequence = ()) -> List[tuple]:
+        """Run a query and return all rows"""
+        self._wait_for_writes()
+        return self.connection().execute(sql, params).fetchall()
+
+    def read_one(self, sql: str, params: Sequence = ()) -> Optional[tuple]:
+        """Run a query and return the first row (or None)"""
+        self._wait_for_writes()
+        return self.connection().execute(sql, params).fetchone()
+
+    # Writes
+    def write(self, sql: str, params: Sequence = (), wait: bool = True):
+        """Queue one statement; returns its lastrowid (or a Future when ``wait`` is False)"""
+        return self.transaction(lambda conn: conn.execute(sql, params).lastrowid, wait)
+
+    def write_many(self, sql: str, seq_of_params: Iterable[Sequence], wait: bool = True):
+        """Queue an executemany; returns the row count (or a Future when ``wait`` is False)"""
+        rows = list(seq_of_params)
+        return self.transaction(lambda conn: conn.executemany(sql, rows).rowcount, wait)
+
+    def transaction(self, operation: Callable[[sqlite3.Connection], Any], wait: bool = True):
+        """Run ``operation(conn)`` atomically on the writer thread
+
+        Use this for read-modify-write sequences: operations run one at a
+        time, so nothing else writes between the read and the write.
+        """
+        future = self._writer.submit(operation)
+        self._local.last_write = future
+        self._last_write = future
+        return future.result() if wait else future
+
+    def executescript(self, script: str):
+        """Run DDL (CREATE TABLE ...) immediately on the calling thread"""
+        self.connection().executescript(script)
+
+    def migrate(self, component: str, migrations: Sequence[Migration]) -> int:
+        """Apply the component's migrations newer than its recorded version
+
+        Versions are tracked per component in ``schema_migrations``, so stores
+        sharing one database file migrate independently. Each migration runs
+        in its own writer transaction and re-checks the recorded version first,
+        so processes starting at the same time apply it once. Returns the
+        number of migrations applied.
+        """
+        self.executescript('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                component TEXT,
+                version INTEGER,
+                applied_date DATETIME,
+                PRIMARY KEY (component, version)
+            );
+        ''')
+
+        def apply(conn, version, steps):
+            current = conn.execute('SELECT MAX(version) FROM schema_migrations WHERE component = ?',
+                                   (component,)).fetchone()[0] or 0
+            if version <= current:
+                return False
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute('INSERT INTO schema_migrations (component, version, applied_date) VALUES (?, ?, ?)',
+                         (component, version, time.strftime('%Y-%m-%dT%H:%M:%S')))
+            return True
+
+        applied = 0
+        for version, steps in sorted(migrations, key=lambda migration: migration[0]):
+            if self.transaction(functools.partial(apply, version=version, steps=steps)):
+                logger.info(f"Applied {component} migration {version} to {self.db_path}")
+                applied += 1
+        return applied
+
+    def schema_version(self, component: str) -> int:
+        """Latest migration version applied for ``component`` (0 if none)"""
+        row = self.read_one('SELECT MAX(version) FROM schema_migrations WHERE component = ?', (component,))
+        return row[0] or 0
+
+    def explain_query_plan(self, sql: str, params: Sequence = ()) -> List[str]:
+        """The detail lines of ``EXPLAIN QUERY PLAN`` for a query"""
+        return [row[-1] for row in self.read(f'EXPLAIN QUERY PLAN {sql}', params)]
+
+    def uses_index(self, sql: str, params: Sequence = ()) -> bool:
+        """True when every table the query reads is searched or walked through an index"""
+        plan = self.explain_query_plan(sql, params)
+        table_access = [detail for detail in plan if detail.startswith(('SCAN', 'SEARCH'))]
+        return bool(table_access) and all(
+            any(access in detail for access in _INDEXED_ACCESS) for detail in table_access
+        )
+
+    def flush(self):
+        """Block until every write queued so far (by any thread) has been committed"""
+        self._wait_for(self._last_write)
+
+    def _wait_for_writes(self):
+        """Read-your-writes for the calling thread only"""
+        self._wait_for(getattr(self._local, 'last_write', None))
+
+    @staticmethod
+    def _wait_for(last_write: Optional[Future]):
+        # Writes are committed in submission order, so the latest one finishing means all before it have
+        if last_write is not None and not last_write.done():
+            wait_futures([last_write])
+
+    def _commit_batch(self, operations: List[Callable[[sqlite3.Connection], Any]]) -> List[Any]:
+        conn = self.connection()
+        results = []
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for operation in operations:
+                conn.execute('SAVEPOINT write_op')
+                try:
+                    results.append(operation(conn))
+                    conn.execute('RELEASE write_op')
+                except Exception as e:
+                    conn.execute('ROLLBACK TO write_op')
+                    conn.execute('RELEASE write_op')
+                    logger.error(f"Write to {self.db_path} failed: {e}")
+                    results.append(e)
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        return results
+
+    def close(self):
+        """Commit queued writes and close every connection"""
+        if self._closed:
+            return
+        self._writer.close()
+        self._closed = True
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for _, conn in connections:
+            try:
+                conn.close()
+            except Exception as e:
+                logger.warning(f"Error closing connection to {self.db_path}: {e}")
+
+    def get_stats(self) -> Dict:
+        """Writer batching statistics"""
+        stats = self._writer.get_stats()
+        return {
+            'db_path': self.db_path,
+            'connections': len(self._connections),
+            'commits': stats['batches'],
+            'writes': stats['items'],
+            'avg_writes_per_commit': stats['avg_batch_size'],
+            'pending_writes': stats['pending']
+        }
+
+_storages: Dict[str, SQLiteStorage] = {}
+_storages_lock = threading.Lock()
+
+def get_storage(db_path: str) -> SQLiteStorage:
+    """Process-wide storage for ``db_path`` shared by every store using that file"""
+    key = os.path.abspath(db_path)
+    with _storages_lock:
+        storage = _storages.get(key)
+        # A deleted database file (tests, manual resets) gets fresh connections
+        if storage is not None and (storage._closed or not os.path.exists(key)):
+            storage.close()
+            storage = None
+        if storage is None:
+            storage = _storages[key] = SQLiteStorage(db_path)
+        return storage
+
+def close_storage(db_path: str):
+    """Close and forget the shared storage for ``db_path`` (e.g. before deleting the file)"""
+    with _storages_lock:
+        storage = _storages.pop(os.path.abspath(db_path), None)
+    if storage is not None:
+        storage.close()
+
+@atexit.register
+def close_all_storages():
+    """Commit writes still queued (e.g. ``wait=False`` events) before the interpreter exits"""
+    with _storages_lock:
+        storages = list(_storages.values())
+        _storages.clear()
+    for storage in storages:
+        storage.close()
+
+def remove_database(db_path: str):
+    """Close the storage and delete the database with its -wal/-shm files"""
+    close_storage(db_path)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+
+def test_sqlite_storage():
+    """Test the SQLite storage layer"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    print("🗄️ Testing SQLite Storage")
+    print("=" * 40)
+
+    storage = get_storage("test_storage.db")
+    storage.executescript('''
+        CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT, value REAL);
+        CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER);
+    ''')
+    assert storage.read_one('PRAGMA journal_mode')[0] == 'wal'
+
+    # Many threads writing at once share commits
+    with ThreadPoolExecutor(16) as pool:
+        list(pool.map(lambda i: storage.write('INSERT INTO events (user_id, value) VALUES (?, ?)',
+                                              (f"user_{i % 10}", i)), range(400)))
+    assert storage.read_one('SELECT COUNT(*) FROM events')[0] == 400
+
+    # Read-modify-write inside one writer transaction loses no increments
+    def increment(conn):
+        row = conn.execute('SELECT value FROM counters WHERE name = ?', ('hits',)).fetchone()
+        conn.execute('INSERT OR REPLACE INTO counters (name, value) VALUES (?, ?)', ('hits', (row[0] if row else 0) + 1))
+
+    with ThreadPoolExecutor(16) as pool:
+        list(pool.map(lambda _: storage.transaction(increment), range(200)))
+    assert storage.read_one('SELECT value FROM counters WHERE name = ?', ('hits',))[0] == 200
+
+    # A failing write is rolled back alone; writes without waiting are visible to the next read
+    try:
+        storage.write('INSERT INTO missing_table VALUES (1)')
+        raise AssertionError("failed write was not reported")
+    except sqlite3.OperationalError as e:
+        print(f"   Reported: {e}")
+    storage.write_many('INSERT INTO events (user_id, value) VALUES (?, ?)', [('user_x', 1.0)] * 5, wait=False)
+    assert storage.read_one('SELECT COUNT(*) FROM events')[0] == 405
+
+    # A child forked during a write burst does not wait on the parent's pending writes
+    if hasattr(os, 'fork'):
+        import signal
+        for i in range(200):
+            storage.write('INSERT INTO events (user_id, value) VALUES (?, ?)', ('user_burst', i), wait=False)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                signal.alarm(10)
+                storage.read_one('SELECT COUNT(*) FROM events')
+                storage.write('INSERT INTO counters (name, value) VALUES (?, ?)', ('child', 1))
+                storage.flush()
+                os._exit(0)
+            except BaseException:
+                os._exit(1)
+        assert os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1]) == 0, "forked child hung or failed"
+        storage.flush()
+        assert storage.read_one('SELECT value FROM counters WHERE name = ?', ('child',)) == (1,)
+        assert storage.read_one('SELECT COUNT(*) FROM events')[0] == 605
+        print("   Forked child reads and writes without waiting on the parent's queue")
+
+    # Migrations run once per component and version
+    migrations = [
+        (1, ['CREATE INDEX IF NOT EXISTS idx_events_user ON events (user_id)']),
+        (2, [lambda conn: conn.execute('UPDATE counters SET value = value + 1000')]),
+    ]
+    assert storage.migrate('events', migrations) == 2
+    assert storage.migrate('events', migrations) == 0 and storage.schema_version('events') == 2
+    assert storage.read_one('SELECT value FROM counters WHERE name = ?', ('hits',))[0] == 1200
+    assert storage.uses_index('SELECT value FROM events WHERE user_id = ?', ('user_1',))
+    assert not storage.uses_index('SELECT user_id FROM events WHERE value > ?', (1,))
+    print(f"   Plan: {storage.explain_query_plan('SELECT value FROM events WHERE user_id = ?', ('user_1',))}")
+
+    print(f"   Stats: {storage.get_stats()}")
+    remove_database("test_storage.db")
+    assert not os.path.exists("test_storage.db-wal")
+
+    print("✅ SQLite storage test completed!")
+    return storage
+
+def benchmark_sqlite_storage(num_events=4000, threads=16):
+    """experiment_events inserts/s: connect-commit-close per call vs the shared storage"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    print("⏱️ Benchmarking SQLite Storage")
+    print("=" * 40)
+
+    schema = '''
+        CREATE TABLE IF NOT EXISTS experiment_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, experiment_id TEXT, user_id TEXT, variant TEXT,
+            event_type TEXT, event_value REAL, timestamp DATETIME, context TEXT
+        )
+    '''
+    insert = '''
+        INSERT INTO experiment_events
+        (experiment_id, user_id, variant, event_type, event_value, timestamp, context)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    '''
+
+    def event(i):
+        return ('exp1', f"user_{i % 500}", 'control' if i % 2 else 'enhanced',
+                'recommendation_helpful', float(i % 2), '2024-09-01T12:00:00', None)
+
+    def per_call(i):
+        # What record_event used to do
+        conn = sqlite3.connect("bench_before.db", timeout=30)
+        cursor = conn.cursor()
+        cursor.execute(insert, event(i))
+        conn.commit()
+        conn.close()
+
+    conn = sqlite3.connect("bench_before.db")
+    conn.execute(schema)
+    conn.close()
+
+    storage = get_storage("bench_after.db")
+    storage.executescript(schema)
+
+    results = {}
+    for name, record in [('connect/commit per call', per_call),
+                         ('shared storage', lambda i: storage.write(insert, event(i)))]:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            list(pool.map(record, range(num_events)))
+        results[name] = num_events / (time.perf_counter() - start)
+        print(f"   {name:<24} {results[name]:8.0f} events/s ({threads} threads)")
+
+    print(f"   Commits: {storage.get_stats()['commits']} for {num_events} events")
+    remove_database("bench_before.db")
+    remove_database("bench_after.db")
+    return results
+
+if __name__ == "__main__":
+    storage = test_sqlite_storage()
+    benchmark_sqlite_storage()
@@ -9,6 +9,9 @@ python -c "import nltk; nltk.download('vader_lexicon')"
 # Create models directory if it doesn't exist
 mkdir -p models
 
+# Compile a legacy models/mood_predictor.joblib once, before any worker starts
+python forest_compiler.py export-legacy models
+
 # Start the application
 echo "🚀 Starting Gunicorn server..."
-exec gunicorn app:app --bind 0.0.0.0:$PORT --workers 4 --timeout 120 --access-logfile - --error-logfile -
+exec gunicorn --config gunicorn.conf.py --access-logfile - --error-logfile - app:app
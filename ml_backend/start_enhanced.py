@@ -100,6 +100,7 @@ def main():
     print("   - GET  /api/health")
     print("   - POST /api/sentiment")
     print("   - POST /api/predict-mood")
+    print("   - POST /api/mood-entry")
     print("   - POST /api/recommendations")
     print("   - POST /api/feedback")
     print("   - POST /api/patterns")
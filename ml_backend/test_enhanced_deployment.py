@@ -100,14 +100,10 @@ def test_enhanced_system():
             import shutil
             if os.path.exists("test_models"):
                 shutil.rmtree("test_models")
-            if os.path.exists("test_enhanced.db"):
-                os.remove("test_enhanced.db")
-            if os.path.exists("test_enhanced.db_feedback"):
-                os.remove("test_enhanced.db_feedback")
-            if os.path.exists("test_enhanced.db_ab"):
-                os.remove("test_enhanced.db_ab")
-            if os.path.exists("test_enhanced.db_learning"):
-                os.remove("test_enhanced.db_learning")
+            from sqlite_storage import remove_database
+            for db_file in ["test_enhanced.db", "test_enhanced.db_feedback", "test_enhanced.db_ab",
+                            "test_enhanced.db_learning", "test_enhanced.db_history"]:
+                remove_database(db_file)
         except:
             pass
 